@@ -19,15 +19,17 @@
 
 #include "actions.h"
 
+#include <algorithm>
 #include <limits>
 #include <stack>
 #include <typeinfo>
 
+#include "predicates.h"
 #include "problems.h"
 #include "refcount.h"
 #include "types.h"
 
-size_t Action::next_id = 0;
+std::atomic<size_t> Action::next_id(0);
 
 Action::Action(const std::string& name, bool durative)
     : id_(next_id++),
@@ -132,6 +134,175 @@ void Action::strengthen_effects(const Domain& domain) {
   }
 }
 
+namespace {
+
+// A static precondition of an action schema viewed as a relation over the
+// initial state.  Objects are represented by their rank in the list of
+// objects compatible with the type of the corresponding parameter, so that
+// sorting tuples of ranks reproduces the order of plain enumeration.
+struct StaticRelation {
+  // Parameter indices that are bound by this relation.
+  std::vector<size_t> columns;
+  // Positions in columns of the parameters bound by relations joined
+  // earlier.
+  std::vector<size_t> key_positions;
+  // Tuples of the relation, with one rank for each column.
+  std::vector<std::vector<size_t> > rows;
+  // Rows indexed by the ranks of the key columns.
+  std::map<std::vector<size_t>, std::vector<size_t> > index;
+};
+
+// Collects the static atoms that are top-level conjuncts of the given
+// formula.
+void collect_static_atoms(std::vector<const Atom*>& atoms,
+                          const Formula& formula) {
+  const Conjunction* conj = dynamic_cast<const Conjunction*>(&formula);
+  if (conj != NULL) {
+    for (FormulaList::const_iterator fi = conj->conjuncts().begin();
+         fi != conj->conjuncts().end(); fi++) {
+      collect_static_atoms(atoms, **fi);
+    }
+    return;
+  }
+  const Atom* atom = dynamic_cast<const Atom*>(&formula);
+  if (atom == NULL) {
+    const TimedLiteral* tl = dynamic_cast<const TimedLiteral*>(&formula);
+    if (tl != NULL) {
+      atom = dynamic_cast<const Atom*>(&tl->literal());
+    }
+  }
+  if (atom != NULL && atom->id() == 0 &&
+      PredicateTable::static_predicate(atom->predicate())) {
+    atoms.push_back(atom);
+  }
+}
+
+// Fills the given relation with the tuples of the initial state that match
+// the given static atom.  Returns false if the atom mentions a variable that
+// is not an action parameter.
+bool make_relation(StaticRelation& relation, const Atom& atom,
+                   const std::map<Term, size_t>& parameters,
+                   const std::vector<std::map<Term, size_t> >& ranks,
+                   const Problem& problem) {
+  std::vector<int> term_columns;
+  for (size_t i = 0; i < atom.arity(); i++) {
+    const Term& t = atom.term(i);
+    if (t.variable()) {
+      std::map<Term, size_t>::const_iterator pi = parameters.find(t);
+      if (pi == parameters.end()) {
+        return false;
+      }
+      std::vector<size_t>::const_iterator ci =
+          std::find(relation.columns.begin(), relation.columns.end(),
+                    (*pi).second);
+      term_columns.push_back(ci - relation.columns.begin());
+      if (ci == relation.columns.end()) {
+        relation.columns.push_back((*pi).second);
+      }
+    } else {
+      term_columns.push_back(-1);
+    }
+  }
+  std::vector<size_t> row(relation.columns.size());
+  std::vector<bool> assigned(relation.columns.size());
+  for (AtomSet::const_iterator ai = problem.init_atoms().begin();
+       ai != problem.init_atoms().end(); ai++) {
+    const Atom& init = **ai;
+    if (init.predicate() != atom.predicate()) {
+      continue;
+    }
+    std::fill(assigned.begin(), assigned.end(), false);
+    bool match = true;
+    for (size_t i = 0; i < atom.arity() && match; i++) {
+      int c = term_columns[i];
+      if (c < 0) {
+        match = init.term(i) == atom.term(i);
+        continue;
+      }
+      size_t p = relation.columns[c];
+      std::map<Term, size_t>::const_iterator ri = ranks[p].find(init.term(i));
+      if (ri == ranks[p].end()) {
+        match = false;
+      } else if (assigned[c]) {
+        match = row[c] == (*ri).second;
+      } else {
+        row[c] = (*ri).second;
+        assigned[c] = true;
+      }
+    }
+    if (match) {
+      relation.rows.push_back(row);
+    }
+  }
+  return true;
+}
+
+// Returns true if the first relation should be joined before the second,
+// given the parameters bound so far.
+bool more_selective(const StaticRelation& r1, const StaticRelation& r2,
+                    const std::vector<bool>& bound) {
+  size_t b1 = 0;
+  for (size_t i = 0; i < r1.columns.size(); i++) {
+    b1 += bound[r1.columns[i]] ? 1 : 0;
+  }
+  size_t b2 = 0;
+  for (size_t i = 0; i < r2.columns.size(); i++) {
+    b2 += bound[r2.columns[i]] ? 1 : 0;
+  }
+  bool f1 = b1 == r1.columns.size();
+  bool f2 = b2 == r2.columns.size();
+  if (f1 != f2) {
+    return f1;
+  } else if ((b1 > 0) != (b2 > 0)) {
+    return b1 > 0;
+  } else {
+    return r1.rows.size() < r2.rows.size();
+  }
+}
+
+// Enumerates the tuples of parameter ranks that satisfy all relations,
+// joining the relations in order starting with the given one.
+void join_relations(std::vector<std::vector<size_t> >& tuples,
+                    std::vector<size_t>& tuple,
+                    const std::vector<StaticRelation>& relations,
+                    size_t r) {
+  if (r == relations.size()) {
+    tuples.push_back(tuple);
+    return;
+  }
+  const StaticRelation& relation = relations[r];
+  std::vector<size_t> key;
+  for (size_t i = 0; i < relation.key_positions.size(); i++) {
+    key.push_back(tuple[relation.columns[relation.key_positions[i]]]);
+  }
+  std::map<std::vector<size_t>, std::vector<size_t> >::const_iterator ki =
+      relation.index.find(key);
+  if (ki == relation.index.end()) {
+    return;
+  }
+  for (std::vector<size_t>::const_iterator ri = (*ki).second.begin();
+       ri != (*ki).second.end(); ri++) {
+    const std::vector<size_t>& row = relation.rows[*ri];
+    for (size_t i = 0; i < relation.columns.size(); i++) {
+      tuple[relation.columns[i]] = row[i];
+    }
+    join_relations(tuples, tuple, relations, r + 1);
+  }
+}
+
+// Returns the index past the run of tuples, starting at the given index,
+// that have the same rank for the given parameter.
+size_t next_run(const std::vector<std::vector<size_t> >& tuples,
+                size_t parameter, size_t first, size_t last) {
+  size_t rank = tuples[first][parameter];
+  do {
+    first++;
+  } while (first < last && tuples[first][parameter] == rank);
+  return first;
+}
+
+}  // namespace
+
 ActionSchema::ActionSchema(const std::string& name, bool durative)
     : Action(name, durative) {}
 
@@ -147,24 +318,133 @@ void ActionSchema::instantiations(std::vector<const GroundAction*>& actions,
       actions.push_back(inst_action);
     }
   } else {
-    std::map<Variable, Term> args;
     std::vector<const std::vector<Object>*> arguments(n);
-    std::vector<std::vector<Object>::const_iterator> next_arg;
+    std::map<Term, size_t> params;
+    std::vector<std::map<Term, size_t> > ranks(n);
     for (size_t i = 0; i < n; i++) {
       const Type& t = TermTable::type(parameters()[i]);
       arguments[i] = &problem.terms().compatible_objects(t);
       if (arguments[i]->empty()) {
         return;
       }
-      next_arg.push_back(arguments[i]->begin());
+      params.insert(std::make_pair(parameters()[i], i));
+      for (size_t j = 0; j < arguments[i]->size(); j++) {
+        ranks[i].insert(std::make_pair((*arguments[i])[j], j));
+      }
+    }
+
+    // Static preconditions are relations over the initial state.  Unary
+    // relations restrict the domain of a single parameter, and the remaining
+    // relations are joined so that only supported tuples are enumerated.
+    std::vector<const Atom*> static_atoms;
+    collect_static_atoms(static_atoms, condition());
+    std::vector<std::vector<bool> > allowed(n);
+    for (size_t i = 0; i < n; i++) {
+      allowed[i].assign(arguments[i]->size(), true);
     }
+    std::vector<StaticRelation> relations;
+    for (std::vector<const Atom*>::const_iterator ai = static_atoms.begin();
+         ai != static_atoms.end(); ai++) {
+      StaticRelation relation;
+      if (!make_relation(relation, **ai, params, ranks, problem)) {
+        continue;
+      }
+      if (relation.columns.size() == 1) {
+        size_t p = relation.columns[0];
+        std::vector<bool> supported(arguments[p]->size());
+        for (size_t r = 0; r < relation.rows.size(); r++) {
+          supported[relation.rows[r][0]] = true;
+        }
+        for (size_t j = 0; j < supported.size(); j++) {
+          allowed[p][j] = allowed[p][j] && supported[j];
+        }
+      } else {
+        relations.push_back(relation);
+      }
+    }
+    std::vector<std::vector<size_t> > domains(n);
+    for (size_t i = 0; i < n; i++) {
+      for (size_t j = 0; j < allowed[i].size(); j++) {
+        if (allowed[i][j]) {
+          domains[i].push_back(j);
+        }
+      }
+      if (domains[i].empty()) {
+        return;
+      }
+    }
+    for (size_t r = 0; r < relations.size(); r++) {
+      StaticRelation& relation = relations[r];
+      std::vector<std::vector<size_t> > rows;
+      for (size_t k = 0; k < relation.rows.size(); k++) {
+        const std::vector<size_t>& row = relation.rows[k];
+        bool supported = true;
+        for (size_t i = 0; i < row.size() && supported; i++) {
+          supported = allowed[relation.columns[i]][row[i]];
+        }
+        if (supported) {
+          rows.push_back(row);
+        }
+      }
+      relation.rows.swap(rows);
+    }
+
+    // Join the most selective relation first, and index each relation on
+    // the parameters bound by the relations joined before it.
+    std::vector<bool> joined(n);
+    for (size_t r = 0; r < relations.size(); r++) {
+      size_t best = r;
+      for (size_t s = r + 1; s < relations.size(); s++) {
+        if (more_selective(relations[s], relations[best], joined)) {
+          best = s;
+        }
+      }
+      std::swap(relations[r], relations[best]);
+      StaticRelation& relation = relations[r];
+      for (size_t i = 0; i < relation.columns.size(); i++) {
+        if (joined[relation.columns[i]]) {
+          relation.key_positions.push_back(i);
+        }
+      }
+      for (size_t k = 0; k < relation.rows.size(); k++) {
+        std::vector<size_t> key;
+        for (size_t i = 0; i < relation.key_positions.size(); i++) {
+          key.push_back(relation.rows[k][relation.key_positions[i]]);
+        }
+        relation.index[key].push_back(k);
+      }
+      for (size_t i = 0; i < relation.columns.size(); i++) {
+        joined[relation.columns[i]] = true;
+      }
+    }
+    std::vector<std::vector<size_t> > tuples;
+    std::vector<size_t> tuple(n);
+    join_relations(tuples, tuple, relations, 0);
+    if (tuples.empty()) {
+      return;
+    }
+    std::sort(tuples.begin(), tuples.end());
+
+    // Enumerate the supported tuples in parameter order, instantiating the
+    // condition one parameter at a time so that contradictions prune the
+    // remaining parameters.  Joined parameters take their values from the
+    // runs of tuples that agree on the parameters before them.
+    std::map<Variable, Term> args;
+    std::vector<size_t> next_arg(n);
+    std::vector<size_t> first_tuple(n);
+    std::vector<size_t> last_tuple(n);
+    first_tuple[0] = 0;
+    last_tuple[0] = tuples.size();
+    next_arg[0] = 0;
     std::stack<const Formula*> conds;
     conds.push(&condition());
     Formula::register_use(conds.top());
     for (size_t i = 0; i < n;) {
-      args.insert(std::make_pair(parameters()[i], *next_arg[i]));
+      size_t rank =
+          joined[i] ? tuples[next_arg[i]][i] : domains[i][next_arg[i]];
+      args.insert(std::make_pair(parameters()[i], (*arguments[i])[rank]));
       std::map<Variable, Term> pargs;
-      pargs.insert(std::make_pair(parameters()[i], *next_arg[i]));
+      pargs.insert(std::make_pair(parameters()[i], (*arguments[i])[rank]));
       const Formula& inst_cond = conds.top()->instantiation(pargs, problem);
       conds.push(&inst_cond);
       Formula::register_use(conds.top());
@@ -180,21 +460,32 @@ void ActionSchema::instantiations(std::vector<const GroundAction*>& actions,
           Formula::unregister_use(conds.top());
           conds.pop();
           args.erase(parameters()[j]);
-          next_arg[j]++;
-          if (next_arg[j] == arguments[j]->end()) {
-            if (j == 0) {
-              i = n;
-              break;
-            } else {
-              next_arg[j] = arguments[j]->begin();
-            }
+          bool exhausted;
+          if (joined[j]) {
+            next_arg[j] = next_run(tuples, j, next_arg[j], last_tuple[j]);
+            exhausted = next_arg[j] == last_tuple[j];
           } else {
+            next_arg[j]++;
+            exhausted = next_arg[j] == domains[j].size();
+          }
+          if (!exhausted) {
             i = j;
             break;
+          } else if (j == 0) {
+            i = n;
+            break;
           }
         }
       } else {
+        if (joined[i]) {
+          first_tuple[i + 1] = next_arg[i];
+          last_tuple[i + 1] = next_run(tuples, i, next_arg[i], last_tuple[i]);
+        } else {
+          first_tuple[i + 1] = first_tuple[i];
+          last_tuple[i + 1] = last_tuple[i];
+        }
         i++;
+        next_arg[i] = joined[i] ? first_tuple[i] : 0;
       }
     }
     while (!conds.empty()) {
@@ -22,6 +22,7 @@
 #ifndef ACTIONS_H_
 #define ACTIONS_H_
 
+#include <atomic>
 #include <cstddef>
 #include <iostream>
 #include <string>
@@ -89,7 +90,7 @@ class Action {
 
  private:
   // Next action id.
-  static size_t next_id;
+  static std::atomic<size_t> next_id;
 
   // Unique id for actions.
   size_t id_;
@@ -21,7 +21,12 @@
 
 #include <limits.h>
 #include <algorithm>
+#include <bitset>
+#include <cstdint>
 #include <limits>
+#include <mutex>
+#include <new>
+#include <sstream>
 #include <typeinfo>
 
 #include "debug.h"
@@ -40,12 +45,274 @@ typedef std::pair<Variable, size_t> StepVariable;
 
 
 /* ====================================================================== */
-/* VariableSet */
+/* VarsetIndex */
+
+struct Varset;
 
 /*
- * A set of variables.
+ * A persistent map from keys to varsets, represented as a hash array
+ * mapped trie.  Mapping keys copies only the nodes on the paths to
+ * the keys, and shares all other nodes with the original map.  The
+ * empty map is represented by a null pointer.
  */
-struct VariableSet : public std::set<StepVariable> {
+struct VarsetIndex {
+  /* A list of keys mapped to varsets. */
+  typedef std::vector<std::pair<uint64_t, const Varset*> > MappingList;
+
+  /* Register use of this object. */
+  static void register_use(const VarsetIndex* i) {
+    if (i != 0) {
+      Threads::Increment(i->ref_count_);
+    }
+  }
+
+  /* Unregister use of this object. */
+  static void unregister_use(const VarsetIndex* i) {
+    if (i != 0) {
+      if (Threads::Decrement(i->ref_count_) == 0) {
+        i->~VarsetIndex();
+        ::operator delete(const_cast<VarsetIndex*>(i));
+      }
+    }
+  }
+
+  /* Returns the varset that the given key maps to in the given
+     index, or 0 if the key is not mapped. */
+  static const Varset* find(const VarsetIndex* index, uint64_t key) {
+    uint64_t hash = hash_key(key);
+    for (int shift = TOP_SHIFT; index != 0; shift -= BITS) {
+      unsigned int bit = 1U << ((hash >> shift) & MASK);
+      if ((index->used_ & bit) == 0) {
+        return 0;
+      }
+      const Entry& entry = index->entries_[index->position(bit)];
+      if ((index->leaves_ & bit) != 0) {
+        return (entry.hash == hash) ? entry.varset : 0;
+      }
+      index = entry.node;
+    }
+    return 0;
+  }
+
+  /* Returns the index obtained by adding the given mappings, in
+     order, to the given index.  The list of mappings is consumed. */
+  static const VarsetIndex* insert(const VarsetIndex* index,
+                                   MappingList& mappings) {
+    if (mappings.empty()) {
+      return index;
+    }
+    for (MappingList::iterator mi = mappings.begin();
+         mi != mappings.end(); mi++) {
+      (*mi).first = hash_key((*mi).first);
+    }
+    /* Sort by hash, so that the mappings below each node of the trie
+       are adjacent, and keep only the last mapping for each key. */
+    std::stable_sort(mappings.begin(), mappings.end(), HashLess());
+    MappingList::iterator last = mappings.begin();
+    for (MappingList::iterator mi = mappings.begin() + 1;
+         mi != mappings.end(); mi++) {
+      if ((*mi).first != (*last).first) {
+        ++last;
+      }
+      *last = *mi;
+    }
+    mappings.erase(last + 1, mappings.end());
+    return insert(index, &mappings[0], &mappings[0] + mappings.size(),
+                  TOP_SHIFT);
+  }
+
+  /* Deletes this index. */
+  ~VarsetIndex() {
+    for (unsigned int bit = 1; bit <= used_; bit <<= 1) {
+      if ((used_ & bit) != 0 && (leaves_ & bit) == 0) {
+        unregister_use(entries_[position(bit)].node);
+      }
+    }
+  }
+
+private:
+  /* Number of hash bits consumed by each level of the trie. */
+  static const int BITS = 4;
+  /* Mask for the hash bits consumed by a level of the trie. */
+  static const uint64_t MASK = (1 << BITS) - 1;
+  /* Position of the hash bits consumed by the root of the trie; the
+     most significant bits are consumed first. */
+  static const int TOP_SHIFT = 64 - BITS;
+
+  /*
+   * A varset with the hash of its key, or a subtrie.
+   */
+  struct Entry {
+    /* Hash of the key of a varset. */
+    uint64_t hash;
+    union {
+      /* A varset. */
+      const Varset* varset;
+      /* A subtrie. */
+      const VarsetIndex* node;
+    };
+  };
+
+  /*
+   * Less-than function object for mappings ordered by hash.
+   */
+  struct HashLess {
+    bool operator()(const std::pair<uint64_t, const Varset*>& m1,
+                    const std::pair<uint64_t, const Varset*>& m2) const {
+      return m1.first < m2.first;
+    }
+  };
+
+  /* Bits for the entries of this node. */
+  unsigned int used_;
+  /* Bits for the entries of this node that hold varsets. */
+  unsigned int leaves_;
+  /* Reference counter. */
+  mutable std::atomic<size_t> ref_count_;
+  /* Entries, in the order of their bits; the node is allocated with
+     room for as many entries as it uses. */
+  Entry entries_[1];
+
+  /* Returns a hash of the given key; distinct keys have distinct
+     hashes. */
+  static uint64_t hash_key(uint64_t key) {
+    key = (key ^ (key >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    key = (key ^ (key >> 27)) * 0x94d049bb133111ebULL;
+    return key ^ (key >> 31);
+  }
+
+  /* Constructs a node with the given bits. */
+  VarsetIndex(unsigned int used, unsigned int leaves)
+    : used_(used), leaves_(leaves), ref_count_(0) {}
+
+  /* Returns a node with the given bits, and uninitialized entries. */
+  static VarsetIndex* make(unsigned int used, unsigned int leaves) {
+    size_t n = std::bitset<1 << BITS>(used).count();
+    void* p = ::operator new(sizeof(VarsetIndex) + (n - 1)*sizeof(Entry));
+    return new (p) VarsetIndex(used, leaves);
+  }
+
+  /* Returns the position of the entry with the given bit. */
+  size_t position(unsigned int bit) const {
+    return std::bitset<1 << BITS>(used_ & (bit - 1)).count();
+  }
+
+  /* Returns the index obtained by adding the given mappings, which
+     have distinct hashes in increasing order, to the given index at
+     the level consuming the hash bits at the given position. */
+  static const VarsetIndex* insert(const VarsetIndex* index,
+                                   const std::pair<uint64_t,
+                                                   const Varset*>* first,
+                                   const std::pair<uint64_t,
+                                                   const Varset*>* last,
+                                   int shift) {
+    unsigned int used = (index != 0) ? index->used_ : 0;
+    unsigned int leaves = (index != 0) ? index->leaves_ : 0;
+    Entry entries[1 << BITS];
+    for (unsigned int slot = 0; slot < (1U << BITS); slot++) {
+      unsigned int bit = 1U << slot;
+      const std::pair<uint64_t, const Varset*>* next = first;
+      while (next != last && ((next->first >> shift) & MASK) == slot) {
+        next++;
+      }
+      if ((used & bit) != 0) {
+        entries[slot] = index->entries_[index->position(bit)];
+      }
+      if (first == next) {
+        continue;
+      }
+      if ((used & bit) == 0 || (leaves & bit) != 0) {
+        if (next - first == 1
+            && ((used & bit) == 0 || entries[slot].hash == first->first)) {
+          /* A single varset replaces the entry. */
+          used |= bit;
+          leaves |= bit;
+          entries[slot].hash = first->first;
+          entries[slot].varset = first->second;
+        } else {
+          /* The varsets, and the varset of the entry unless it is
+             replaced, go in a new subtrie. */
+          const VarsetIndex* node = 0;
+          if ((used & bit) != 0) {
+            VarsetIndex* leaf =
+              make(1U << ((entries[slot].hash >> (shift - BITS)) & MASK), 0);
+            leaf->leaves_ = leaf->used_;
+            leaf->entries_[0] = entries[slot];
+            node = leaf;
+          }
+          register_use(node);
+          entries[slot].node = insert(node, first, next, shift - BITS);
+          unregister_use(node);
+          used |= bit;
+          leaves &= ~bit;
+        }
+      } else {
+        entries[slot].node = insert(entries[slot].node, first, next,
+                                    shift - BITS);
+      }
+      first = next;
+    }
+    VarsetIndex* node = make(used, leaves);
+    for (unsigned int slot = 0, i = 0; slot < (1U << BITS); slot++) {
+      unsigned int bit = 1U << slot;
+      if ((used & bit) != 0) {
+        node->entries_[i++] = entries[slot];
+        if ((leaves & bit) == 0) {
+          register_use(entries[slot].node);
+        }
+      }
+    }
+    return node;
+  }
+};
+
+
+/* Returns the key of the given term of the given step in a varset
+   index.  Objects are looked up with step id 0. */
+static uint64_t varset_key(const Term& term, size_t step_id) {
+  return ((uint64_t(step_id) << 32)
+          | uint32_t(std::hash<Term>()(term)));
+}
+
+
+/* ====================================================================== */
+/* Varsets */
+
+/*
+ * A chain of varsets, most recently added first, with an index that
+ * maps each term to the most recently added varset including it.
+ * Varsets added to the chain are only entered into the persistent
+ * index when the index is requested, so that bindings that are only
+ * tested for consistency never copy any part of it.
+ */
+struct Varsets {
+  /* Constructs a chain of varsets. */
+  Varsets(const Chain<Varset>* chain, const VarsetIndex* index);
+
+  /* Deletes this chain of varsets. */
+  ~Varsets();
+
+  /* Returns the chain of varsets. */
+  const Chain<Varset>* chain() const { return chain_; }
+
+  /* Returns the index of the varsets. */
+  const VarsetIndex* index();
+
+  /* Returns the varset containing the given term, or 0 if none do. */
+  const Varset* find(const Term& term, size_t step_id) const;
+
+  /* Adds the given varset to the front of the chain, and returns the
+     added varset. */
+  const Varset* add(const Varset& vs);
+
+private:
+  /* The chain of varsets. */
+  const Chain<Varset>* chain_;
+  /* The index of the varsets, except for the most recent ones. */
+  const VarsetIndex* index_;
+  /* Keys mapped to the most recent varsets, in the order they were
+     mapped. */
+  VarsetIndex::MappingList recent_;
 };
 
 
@@ -118,14 +385,13 @@ struct Varset {
 
   /* Returns the varset obtained by adding the given object to this
      varset, or 0 if the object is excluded from this varset. */
-  const Varset* add(const Chain<Varset>*& vsc, const Object& obj) const {
+  const Varset* add(Varsets& vsc, const Object& obj) const {
     if (constant() != 0) {
       return (*constant() == obj) ? this : 0;
     } else {
       const Type& ot = TermTable::type(obj);
       if (TypeTable::subtype(ot, type_)) {
-        vsc = new Chain<Varset>(Varset(&obj, cd_set(), ncd_set(), ot), vsc);
-        return &vsc->head;
+        return vsc.add(Varset(&obj, cd_set(), ncd_set(), ot));
       } else {
         return 0;
       }
@@ -134,7 +400,7 @@ struct Varset {
 
   /* Returns the varset obtained by adding the given variable to this
      varset, or 0 if the variable is excluded from this varset. */
-  const Varset* add(const Chain<Varset>*& vsc, const Variable& var,
+  const Varset* add(Varsets& vsc, const Variable& var,
                     size_t step_id) const {
     if (excludes(var, step_id)) {
       return 0;
@@ -153,14 +419,13 @@ struct Varset {
       }
       const Chain<StepVariable>* new_cd =
         new Chain<StepVariable>(std::make_pair(var, step_id), cd_set());
-      vsc = new Chain<Varset>(Varset(constant(), new_cd, ncd_set(), *tt), vsc);
-      return &vsc->head;
+      return vsc.add(Varset(constant(), new_cd, ncd_set(), *tt));
     }
   }
 
   /* Returns the varset obtained by adding the given term to this
      varset, or 0 if the term is excluded from this varset. */
-  const Varset* add(const Chain<Varset>*& vsc, const Term& term,
+  const Varset* add(Varsets& vsc, const Term& term,
                     size_t step_id) const {
     if (term.object()) {
       return add(vsc, term.as_object());
@@ -172,17 +437,16 @@ struct Varset {
   /* Returns the varset obtained by adding the given variable to the
      non-codesignation list of this varset; N.B. assumes that the
      variable is not included in the varset already. */
-  const Varset* restrict(const Chain<Varset>*& vsc,
+  const Varset* restrict(Varsets& vsc,
                          const Variable& var, size_t step_id) const {
     const Chain<StepVariable>* new_ncd =
       new Chain<StepVariable>(std::make_pair(var, step_id), ncd_set());
-    vsc = new Chain<Varset>(Varset(constant(), cd_set(), new_ncd, type_), vsc);
-    return &vsc->head;
+    return vsc.add(Varset(constant(), cd_set(), new_ncd, type_));
   }
 
   /* Returns the combination of this and the given varset, or 0 if
      the combination is inconsistent. */
-  const Varset* combine(const Chain<Varset>*& vsc, const Varset& vs) const {
+  const Varset* combine(Varsets& vsc, const Varset& vs) const {
     const Object* comb_obj;
     const Type* tt;
     if (constant() != 0) {
@@ -233,21 +497,18 @@ struct Varset {
         comb_ncd = new Chain<StepVariable>(step_var, comb_ncd);
       }
     }
-    vsc = new Chain<Varset>(Varset(comb_obj, comb_cd, comb_ncd, *tt), vsc);
-    return &vsc->head;
+    return vsc.add(Varset(comb_obj, comb_cd, comb_ncd, *tt));
   }
 
   /* Returns the varset representing the given equality binding. */
-  static const Varset* make(const Chain<Varset>*& vsc, const Binding& b,
+  static const Varset* make(Varsets& vsc, const Binding& b,
                             bool reverse = false) {
     if (b.equality()) {
       const Chain<StepVariable>* cd_set =
         new Chain<StepVariable>(std::make_pair(b.var(), b.var_id()), 0);
       if (b.term().object()) {
         Object obj = b.term().as_object();
-        vsc = new Chain<Varset>(Varset(&obj, cd_set, 0,
-                                       TermTable::type(b.term())),
-                                vsc);
+        return vsc.add(Varset(&obj, cd_set, 0, TermTable::type(b.term())));
       } else {
         const Type* tt = TypeTable::most_specific(TermTable::type(b.var()),
                                                   TermTable::type(b.term()));
@@ -259,27 +520,22 @@ struct Varset {
         cd_set = new Chain<StepVariable>(std::make_pair(b.term().as_variable(),
                                                         b.term_id()),
                                          cd_set);
-        vsc = new Chain<Varset>(Varset(0, cd_set, 0, *tt), vsc);
+        return vsc.add(Varset(0, cd_set, 0, *tt));
       }
-      return &vsc->head;
     } else {
       if (reverse) {
         const Chain<StepVariable>* ncd_set =
           new Chain<StepVariable>(std::make_pair(b.var(), b.var_id()), 0);
         if (b.term().object()) {
           Object obj = b.term().as_object();
-          vsc = new Chain<Varset>(Varset(&obj, 0, ncd_set,
-                                         TermTable::type(b.term())),
-                                  vsc);
+          return vsc.add(Varset(&obj, 0, ncd_set, TermTable::type(b.term())));
         } else {
           Variable var = b.term().as_variable();
           const Chain<StepVariable>* cd_set =
             new Chain<StepVariable>(std::make_pair(var, b.term_id()), 0);
-          vsc = new Chain<Varset>(Varset(0, cd_set, ncd_set,
-                                         TermTable::type(b.term())),
-                                  vsc);
+          return vsc.add(Varset(0, cd_set, ncd_set,
+                                TermTable::type(b.term())));
         }
-        return &vsc->head;
       } else { /* !reverse */
         if (b.term().object()) {
           return 0;
@@ -289,10 +545,7 @@ struct Varset {
             new Chain<StepVariable>(std::make_pair(b.var(), b.var_id()), 0);
           const Chain<StepVariable>* ncd_set =
             new Chain<StepVariable>(std::make_pair(var, b.term_id()), 0);
-          vsc = new Chain<Varset>(Varset(0, cd_set, ncd_set,
-                                         TermTable::type(b.var())),
-                                  vsc);
-          return &vsc->head;
+          return vsc.add(Varset(0, cd_set, ncd_set, TermTable::type(b.var())));
         }
       }
     }
@@ -310,39 +563,87 @@ private:
 };
 
 
-/* Returns the varset containing the given object, or 0 if none do. */
-static const Varset* find_varset(const Chain<Varset>* varsets,
-                                 const Object& obj) {
-  for (const Chain<Varset>* vsc = varsets; vsc != 0; vsc = vsc->tail) {
-    const Varset& vs = vsc->head;
-    if (vs.includes(obj)) {
-      return &vs;
+/* Constructs a chain of varsets. */
+Varsets::Varsets(const Chain<Varset>* chain, const VarsetIndex* index)
+  : chain_(chain), index_(index) {
+  RCObject::ref(chain_);
+  VarsetIndex::register_use(index_);
+}
+
+
+/* Deletes this chain of varsets. */
+Varsets::~Varsets() {
+  RCObject::destructive_deref(chain_);
+  VarsetIndex::unregister_use(index_);
+}
+
+
+/* Returns the index of the varsets. */
+const VarsetIndex* Varsets::index() {
+  const VarsetIndex* index = VarsetIndex::insert(index_, recent_);
+  VarsetIndex::register_use(index);
+  VarsetIndex::unregister_use(index_);
+  index_ = index;
+  recent_.clear();
+  return index_;
+}
+
+
+/* Returns the varset containing the given term, or 0 if none do. */
+const Varset* Varsets::find(const Term& term, size_t step_id) const {
+  uint64_t key = varset_key(term, term.object() ? 0 : step_id);
+  for (size_t i = recent_.size(); i > 0; i--) {
+    if (recent_[i - 1].first == key) {
+      return recent_[i - 1].second;
     }
   }
-  return 0;
+  return VarsetIndex::find(index_, key);
+}
+
+
+/* Adds the given varset to the front of the chain, and returns the
+   added varset. */
+const Varset* Varsets::add(const Varset& vs) {
+  const Chain<Varset>* chain = new Chain<Varset>(vs, chain_);
+  RCObject::ref(chain);
+  RCObject::destructive_deref(chain_);
+  chain_ = chain;
+  const Varset* added = &chain_->head;
+  if (added->constant() != 0) {
+    recent_.push_back(std::make_pair(varset_key(*added->constant(), 0),
+                                     added));
+  }
+  for (const Chain<StepVariable>* vc = added->cd_set();
+       vc != 0; vc = vc->tail) {
+    recent_.push_back(std::make_pair(varset_key(vc->head.first,
+                                                vc->head.second),
+                                     added));
+  }
+  return added;
+}
+
+
+/* Returns the varset containing the given object, or 0 if none do. */
+static const Varset* find_varset(const VarsetIndex* index,
+                                 const Object& obj) {
+  return VarsetIndex::find(index, varset_key(obj, 0));
 }
 
 
 /* Returns the varset containing the given variable, or 0 if none do. */
-static const Varset* find_varset(const Chain<Varset>* varsets,
+static const Varset* find_varset(const VarsetIndex* index,
                                  const Variable& var, size_t step_id) {
-  for (const Chain<Varset>* vsc = varsets; vsc != 0; vsc = vsc->tail) {
-    const Varset& vs = vsc->head;
-    if (vs.includes(var, step_id)) {
-      return &vs;
-    }
-  }
-  return 0;
+  return VarsetIndex::find(index, varset_key(var, step_id));
 }
 
 
 /* Returns the varset containing the given term, or 0 if none do. */
-static const Varset* find_varset(const Chain<Varset>* varsets,
+static const Varset* find_varset(const VarsetIndex* index,
                                  const Term& term, size_t step_id) {
   if (term.object()) {
-    return find_varset(varsets, term.as_object());
+    return find_varset(index, term.as_object());
   } else {
-    return find_varset(varsets, term.as_variable(), step_id);
+    return find_varset(index, term.as_variable(), step_id);
   }
 }
 
@@ -392,13 +693,7 @@ struct StepDomain {
   /* Checks if this step domain includes the given object in the given
      column. */
   bool includes(const Object& obj, size_t column) const {
-    for (TupleList::const_iterator ti = domain().tuples().begin();
-         ti != domain().tuples().end(); ti++) {
-      if ((**ti)[column] == obj) {
-        return true;
-      }
-    }
-    return false;
+    return domain().includes(obj, column);
   }
 
   /* Returns the set of objects from the given column. */
@@ -508,39 +803,161 @@ find_step_domain(const Chain<StepDomain>* step_domains,
 }
 
 
+/* ====================================================================== */
+/* TupleTable */
+
+/*
+ * A table of parameter tuples, stored by column, with an index from
+ * the objects of each column to the bitset of rows holding them.
+ */
+struct TupleTable {
+  /* Register use of this object. */
+  static void register_use(const TupleTable* t) {
+    if (t != 0) {
+      Threads::Increment(t->ref_count_);
+    }
+  }
+
+  /* Unregister use of this object. */
+  static void unregister_use(const TupleTable* t) {
+    if (t != 0) {
+      if (Threads::Decrement(t->ref_count_) == 0) {
+        delete t;
+      }
+    }
+  }
+
+  /* Returns the number of words needed to hold n bits. */
+  static size_t words(size_t n) { return (n + 63)/64; }
+
+  /* Returns the number of set bits in the given word. */
+  static size_t count(uint64_t w) { return std::bitset<64>(w).count(); }
+
+  /* An index from objects to rows. */
+  typedef std::map<Object, std::vector<uint64_t> > ColumnIndex;
+
+  /* Constructs an empty table with the given number of columns. */
+  explicit TupleTable(size_t arity)
+    : columns_(arity), index_(arity), num_rows_(0), ref_count_(0) {}
+
+  /* Returns the number of columns of this table. */
+  size_t arity() const { return columns_.size(); }
+
+  /* Returns the number of rows of this table. */
+  size_t num_rows() const { return num_rows_; }
+
+  /* Returns the object in the given row and column. */
+  const Object& object(size_t row, size_t column) const {
+    return columns_[column][row];
+  }
+
+  /* Returns the index of the given column.  The bitset of an object
+     may be shorter than the bitsets of domains, with the missing
+     words being zero. */
+  const ColumnIndex& index(size_t column) const { return index_[column]; }
+
+  /* Returns the rows holding the given object in the given column, or
+     0 if there are none. */
+  const std::vector<uint64_t>* rows(const Object& obj, size_t column) const {
+    ColumnIndex::const_iterator ci = index_[column].find(obj);
+    return (ci != index_[column].end()) ? &(*ci).second : 0;
+  }
+
+  /* Adds a row to this table, and returns its number. */
+  size_t add(const std::vector<Object>& tuple) {
+    size_t row = num_rows_++;
+    for (size_t c = 0; c < columns_.size(); c++) {
+      columns_[c].push_back(tuple[c]);
+      std::vector<uint64_t>& bits = index_[c][tuple[c]];
+      bits.resize(words(num_rows_), 0);
+      bits[row/64] |= uint64_t(1) << (row%64);
+    }
+    return row;
+  }
+
+private:
+  /* Objects of each column. */
+  std::vector<std::vector<Object> > columns_;
+  /* Index of each column. */
+  std::vector<ColumnIndex> index_;
+  /* Number of rows. */
+  size_t num_rows_;
+  /* Reference counter. */
+  mutable std::atomic<size_t> ref_count_;
+};
+
+
 /* ====================================================================== */
 /* ActionDomain */
 
 /* Constructs an action domain with a single tuple. */
-ActionDomain::ActionDomain(const std::vector<Object>& tuple) : ref_count_(0) {
+ActionDomain::ActionDomain(const std::vector<Object>& tuple)
+  : table_(new TupleTable(tuple.size())), size_(0), ref_count_(0) {
+  TupleTable::register_use(table_);
   add(tuple);
 }
 
+
+/* Constructs an action domain with the given rows of the given
+   table; the vector of rows is consumed. */
+ActionDomain::ActionDomain(TupleTable& table, std::vector<uint64_t>& rows,
+                           size_t size)
+  : table_(&table), size_(size), ref_count_(0) {
+  TupleTable::register_use(table_);
+  rows_.swap(rows);
+}
+
+
 /* Deletes this action domain. */
 ActionDomain::~ActionDomain() {
   for (ProjectionMap::const_iterator pi = projections_.begin();
        pi != projections_.end(); pi++) {
     delete (*pi).second;
   }
+  TupleTable::unregister_use(table_);
 }
 
 
 /* Adds a tuple to this domain. */
 void ActionDomain::add(const std::vector<Object>& tuple) {
-  tuples_.push_back(&tuple);
+  size_t row = table_->add(tuple);
+  rows_.resize(TupleTable::words(row + 1), 0);
+  rows_[row/64] |= uint64_t(1) << (row%64);
+  size_++;
+}
+
+
+/* Checks if this domain includes the given object in the given
+   column. */
+bool ActionDomain::includes(const Object& obj, size_t column) const {
+  const std::vector<uint64_t>* bits = table_->rows(obj, column);
+  if (bits != 0) {
+    for (size_t w = 0; w < bits->size(); w++) {
+      if ((rows_[w] & (*bits)[w]) != 0) {
+        return true;
+      }
+    }
+  }
+  return false;
 }
 
+/* Mutex protecting the cached projections of action domains, which
+   may be shared by planners running in different threads. */
+static std::mutex projections_mutex;
+
 /* Returns the set of names from the given column. */
 const NameSet& ActionDomain::projection(size_t column) const {
+  Threads::Lock<std::mutex> lock(projections_mutex);
   ProjectionMap::const_iterator pi = projections_.find(column);
   if (pi != projections_.end()) {
     return *(*pi).second;
   } else {
     NameSet* projection = new NameSet();
-    for (TupleList::const_iterator ti = tuples().begin();
-         ti != tuples().end(); ti++) {
-      const std::vector<Object>& tuple = **ti;
-      projection->insert(tuple[column]);
+    for (size_t w = 0; w < rows_.size(); w++) {
+      for (uint64_t bits = rows_[w]; bits != 0; bits &= bits - 1) {
+        size_t row = 64*w + TupleTable::count((bits & -bits) - 1);
+        projection->insert(table_->object(row, column));
+      }
     }
     projections_.insert(std::make_pair(column, projection));
     return *projection;
@@ -550,7 +967,39 @@ const NameSet& ActionDomain::projection(size_t column) const {
 
 /* Returns the size of the projection of the given column. */
 const size_t ActionDomain::projection_size(size_t column) const {
-  return projection(column).size();
+  if (size() == table_->num_rows()) {
+    return table_->index(column).size();
+  }
+  size_t n = 0;
+  const TupleTable::ColumnIndex& index = table_->index(column);
+  for (TupleTable::ColumnIndex::const_iterator ci = index.begin();
+       ci != index.end(); ci++) {
+    const std::vector<uint64_t>& bits = (*ci).second;
+    for (size_t w = 0; w < bits.size(); w++) {
+      if ((rows_[w] & bits[w]) != 0) {
+        n++;
+        break;
+      }
+    }
+  }
+  return n;
+}
+
+
+/* Returns a domain with the given rows of the table of this domain,
+   or 0 if there are no rows; the vector of rows is consumed. */
+const ActionDomain* ActionDomain::make(std::vector<uint64_t>& rows) const {
+  size_t n = 0;
+  for (size_t w = 0; w < rows.size(); w++) {
+    n += TupleTable::count(rows[w]);
+  }
+  if (n == 0) {
+    return 0;
+  } else if (n == size()) {
+    return this;
+  } else {
+    return new ActionDomain(*table_, rows, n);
+  }
 }
 
 
@@ -558,25 +1007,15 @@ const size_t ActionDomain::projection_size(size_t column) const {
    the given object, or 0 if this would leave an empty domain. */
 const ActionDomain* ActionDomain::restrict(const Object& obj,
                                            size_t column) const {
-  ActionDomain* new_domain = 0;
-  for (TupleList::const_iterator ti = tuples().begin();
-       ti != tuples().end(); ti++) {
-    const std::vector<Object>& tuple = **ti;
-    if (tuple[column] == obj) {
-      if (new_domain == 0) {
-        new_domain = new ActionDomain(tuple);
-      } else {
-        new_domain->add(tuple);
-      }
-    }
+  const std::vector<uint64_t>* bits = table_->rows(obj, column);
+  if (bits == 0) {
+    return 0;
   }
-  if (new_domain != 0 && new_domain->size() == size()) {
-    ActionDomain::register_use(new_domain);
-    ActionDomain::unregister_use(new_domain);
-    return this;
-  } else {
-    return new_domain;
+  std::vector<uint64_t> rows(rows_.size(), 0);
+  for (size_t w = 0; w < bits->size(); w++) {
+    rows[w] = rows_[w] & (*bits)[w];
   }
+  return make(rows);
 }
 
 
@@ -585,25 +1024,19 @@ const ActionDomain* ActionDomain::restrict(const Object& obj,
    domain. */
 const ActionDomain* ActionDomain::restrict(const NameSet& names,
                                            size_t column) const {
-  ActionDomain* new_domain = 0;
-  for (TupleList::const_iterator ti = tuples().begin();
-       ti != tuples().end(); ti++) {
-    const std::vector<Object>& tuple = **ti;
-    if (names.find(tuple[column]) != names.end()) {
-      if (new_domain == 0) {
-        new_domain = new ActionDomain(tuple);
-      } else {
-        new_domain->add(tuple);
+  std::vector<uint64_t> mask(rows_.size(), 0);
+  for (NameSet::const_iterator ni = names.begin(); ni != names.end(); ni++) {
+    const std::vector<uint64_t>* bits = table_->rows(*ni, column);
+    if (bits != 0) {
+      for (size_t w = 0; w < bits->size(); w++) {
+        mask[w] |= (*bits)[w];
       }
     }
   }
-  if (new_domain != 0 && new_domain->size() == size()) {
-    ActionDomain::register_use(new_domain);
-    ActionDomain::unregister_use(new_domain);
-    return this;
-  } else {
-    return new_domain;
+  for (size_t w = 0; w < mask.size(); w++) {
+    mask[w] &= rows_[w];
   }
+  return make(mask);
 }
 
 
@@ -611,44 +1044,47 @@ const ActionDomain* ActionDomain::restrict(const NameSet& names,
    or 0 if this would leave an empty domain. */
 const ActionDomain* ActionDomain::exclude(const Object& obj,
                                           size_t column) const {
-  ActionDomain* new_domain = 0;
-  for (TupleList::const_iterator ti = tuples().begin();
-       ti != tuples().end(); ti++) {
-    const std::vector<Object>& tuple = **ti;
-    if (tuple[column] != obj) {
-      if (new_domain == 0) {
-        new_domain = new ActionDomain(tuple);
-      } else {
-        new_domain->add(tuple);
-      }
-    }
-  }
-  if (new_domain != 0 && new_domain->size() == size()) {
-    ActionDomain::register_use(new_domain);
-    ActionDomain::unregister_use(new_domain);
+  const std::vector<uint64_t>* bits = table_->rows(obj, column);
+  if (bits == 0) {
     return this;
-  } else {
-    return new_domain;
   }
+  std::vector<uint64_t> rows(rows_);
+  for (size_t w = 0; w < bits->size(); w++) {
+    rows[w] &= ~(*bits)[w];
+  }
+  return make(rows);
+}
+
+
+/* Prints the rows of the table included in this domain on the given
+   stream. */
+void ActionDomain::print_rows(std::ostream& os) const {
+  os << std::hex;
+  for (size_t w = 0; w < rows_.size(); w++) {
+    os << rows_[w] << ' ';
+  }
+  os << std::dec;
 }
 
 
 /* Prints this object on the given stream. */
 void ActionDomain::print(std::ostream& os) const {
   os << '{';
-  for (TupleList::const_iterator ti = tuples().begin();
-       ti != tuples().end(); ti++) {
-    if (ti != tuples().begin()) {
+  bool first = true;
+  for (size_t row = 0; row < table_->num_rows(); row++) {
+    if (((rows_[row/64] >> (row%64)) & 1) == 0) {
+      continue;
+    }
+    if (!first) {
       os << ' ';
     }
+    first = false;
     os << '<';
-    const std::vector<Object>& tuple = **ti;
-    for (std::vector<Object>::const_iterator ni = tuple.begin();
-         ni != tuple.end(); ni++) {
-      if (ni != tuple.begin()) {
+    for (size_t c = 0; c < table_->arity(); c++) {
+      if (c > 0) {
         os << ' ';
       }
-      os << *ni;
+      os << table_->object(row, c);
     }
     os << '>';
   }
@@ -656,11 +1092,181 @@ void ActionDomain::print(std::ostream& os) const {
 }
 
 
+/* ====================================================================== */
+/* UnifierCache */
+
+/*
+ * A bounded cache of unification results.  Entries are keyed by a
+ * pair of literals with step ids and the serial number of the
+ * binding collection they were unified under.  The cache is a
+ * set-associative table, and entries are evicted from a full set
+ * using the clock algorithm.  The cache holds a reference to the
+ * literals of each entry, so that a literal is not replaced by
+ * another at the same address while it is cached.
+ */
+struct UnifierCache {
+  /* Number of hits. */
+  size_t hits;
+  /* Number of misses. */
+  size_t misses;
+
+  /* Constructs an empty unifier cache. */
+  UnifierCache() : hits(0), misses(0) {}
+
+  /* Deletes this unifier cache. */
+  ~UnifierCache() {
+    clear();
+  }
+
+  /* Returns the entry for the given unification, or 0 if the
+     unification is not cached. */
+  const std::pair<bool, BindingList>* find(const Literal& l1, size_t id1,
+                                           const Literal& l2, size_t id2,
+                                           size_t serial) {
+    if (!slots_.empty()) {
+      Slot* set = &slots_[set_index(&l1, id1, &l2, id2, serial)*WAYS];
+      for (size_t w = 0; w < WAYS; w++) {
+        Slot& slot = set[w];
+        if (slot.l1 == &l1 && slot.l2 == &l2 && slot.id1 == id1
+            && slot.id2 == id2 && slot.serial == serial) {
+          hits++;
+          slot.referenced = true;
+          return &slot.result;
+        }
+      }
+    }
+    misses++;
+    return 0;
+  }
+
+  /* Caches the result of the given unification. */
+  void insert(const Literal& l1, size_t id1, const Literal& l2, size_t id2,
+              size_t serial, bool unifiable, const BindingList& mgu) {
+    if (slots_.empty()) {
+      slots_.resize(SETS*WAYS);
+      hands_.resize(SETS, 0);
+    }
+    size_t s = set_index(&l1, id1, &l2, id2, serial);
+    Slot* set = &slots_[s*WAYS];
+    unsigned char& hand = hands_[s];
+    while (set[hand].referenced) {
+      set[hand].referenced = false;
+      hand = (hand + 1) % WAYS;
+    }
+    Slot& slot = set[hand];
+    hand = (hand + 1) % WAYS;
+    Formula::register_use(&l1);
+    Formula::register_use(&l2);
+    release(slot);
+    slot.l1 = &l1;
+    slot.id1 = id1;
+    slot.l2 = &l2;
+    slot.id2 = id2;
+    slot.serial = serial;
+    slot.result.first = unifiable;
+    slot.result.second = mgu;
+  }
+
+  /* Removes all entries from this cache. */
+  void clear() {
+    for (size_t s = 0; s < slots_.size(); s++) {
+      release(slots_[s]);
+    }
+    slots_.clear();
+    hands_.clear();
+  }
+
+private:
+  /* Number of sets. */
+  static const size_t SETS = 1 << 12;
+  /* Number of entries in each set. */
+  static const size_t WAYS = 4;
+
+  /*
+   * A cache entry.
+   */
+  struct Slot {
+    /* The literals and step ids of this entry; the first literal is 0
+       if the entry is unused. */
+    const Literal* l1;
+    size_t id1;
+    const Literal* l2;
+    size_t id2;
+    /* The serial number of the binding collection of this entry. */
+    size_t serial;
+    /* Whether the literals unify, and the most general unifier. */
+    std::pair<bool, BindingList> result;
+    /* Whether this entry has been used since the clock hand of its
+       set last passed it. */
+    bool referenced;
+
+    /* Constructs an unused entry. */
+    Slot() : l1(0), id1(0), l2(0), id2(0), serial(0), referenced(false) {}
+  };
+
+  /* Cache entries, grouped by set; allocated on first use. */
+  std::vector<Slot> slots_;
+  /* Clock hand for each set. */
+  std::vector<unsigned char> hands_;
+
+  /* Returns the set for the given unification. */
+  static size_t set_index(const Literal* l1, size_t id1,
+                          const Literal* l2, size_t id2, size_t serial) {
+    size_t h = reinterpret_cast<size_t>(l1) >> 4;
+    h = 31*h + (reinterpret_cast<size_t>(l2) >> 4);
+    h = 31*h + id1;
+    h = 31*h + id2;
+    h = 31*h + serial;
+    h ^= h >> 17;
+    h *= 0x9e3779b97f4a7c15ULL;
+    return (h >> 32) & (SETS - 1);
+  }
+
+  /* Releases the literals of the given entry. */
+  static void release(Slot& slot) {
+    if (slot.l1 != 0) {
+      Formula::unregister_use(slot.l1);
+      Formula::unregister_use(slot.l2);
+      slot.l1 = slot.l2 = 0;
+    }
+  }
+};
+
+
+/* Unifier cache for the current thread. */
+static thread_local UnifierCache unifier_cache;
+
+
 /* ====================================================================== */
 /* Bindings */
 
+/* Next serial number for binding collections. */
+std::atomic<size_t> Bindings::next_serial(0);
+
 /* Empty bindings. */
 const Bindings Bindings::EMPTY = Bindings();
+/* Whether to cache unification results. */
+bool Bindings::cache_unifiers = false;
+
+
+/* Returns the number of unifications answered by the unifier cache of
+   the calling thread. */
+size_t Bindings::unifier_cache_hits() {
+  return unifier_cache.hits;
+}
+
+
+/* Returns the number of unifications not answered by the unifier
+   cache of the calling thread. */
+size_t Bindings::unifier_cache_misses() {
+  return unifier_cache.misses;
+}
+
+
+/* Removes all entries from the unifier cache of the calling thread. */
+void Bindings::clear_unifier_cache() {
+  unifier_cache.clear();
+}
 
 /* Checks if the given formulas can be unified. */
 bool Bindings::unifiable(const Literal& l1, size_t id1,
@@ -681,16 +1287,18 @@ bool Bindings::unifiable(BindingList& mgu,
 
 /* Constructs an empty binding collection. */
 Bindings::Bindings()
-  : varsets_(0), high_step_(0), step_domains_(0), ref_count_(1) {
+  : varsets_(0), index_(0), high_step_(0), step_domains_(0),
+    serial_(next_serial++), ref_count_(1) {
 }
 
 
 /* Constructs a binding collection. */
-Bindings::Bindings(const Chain<Varset>* varsets, size_t high_step,
-                   const Chain<StepDomain>* step_domains)
-  : varsets_(varsets), high_step_(high_step), step_domains_(step_domains),
-    ref_count_(0) {
+Bindings::Bindings(const Chain<Varset>* varsets, const VarsetIndex* index,
+                   size_t high_step, const Chain<StepDomain>* step_domains)
+  : varsets_(varsets), index_(index), high_step_(high_step),
+    step_domains_(step_domains), serial_(next_serial++), ref_count_(0) {
   RCObject::ref(varsets_);
+  VarsetIndex::register_use(index_);
   RCObject::ref(step_domains_);
 }
 
@@ -698,6 +1306,7 @@ Bindings::Bindings(const Chain<Varset>* varsets, size_t high_step,
 /* Deletes this binding collection. */
 Bindings::~Bindings() {
   RCObject::destructive_deref(varsets_);
+  VarsetIndex::unregister_use(index_);
   RCObject::destructive_deref(step_domains_);
 }
 
@@ -708,7 +1317,7 @@ Term Bindings::binding(const Term& term, size_t step_id) const {
   if (term.variable()) {
     const Varset* vs =
       ((step_id <= high_step_)
-       ? find_varset(varsets_, term.as_variable(), step_id) : 0);
+       ? find_varset(index_, term.as_variable(), step_id) : 0);
     if (vs != 0 && vs->constant() != 0) {
       return *vs->constant();
     }
@@ -730,13 +1339,13 @@ const NameSet& Bindings::domain(const Variable& var, size_t step_id,
     NameSet* names = new NameSet();
     names->insert(objects.begin(), objects.end());
     const Varset* vs =
-      (step_id <= high_step_) ? find_varset(varsets_, var, step_id) : 0;
+      (step_id <= high_step_) ? find_varset(index_, var, step_id) : 0;
     if (vs != 0) {
       for (const Chain<StepVariable>* vc = vs->ncd_set();
            vc != 0; vc = vc->tail) {
         const StepVariable& sv = vc->head;
         const Varset* vs2 = ((sv.second <= high_step_)
-                             ? find_varset(varsets_, sv.first, sv.second) : 0);
+                             ? find_varset(index_, sv.first, sv.second) : 0);
         if (vs2 != 0 && vs2->constant() != 0) {
           names->erase(*vs2->constant());
         }
@@ -796,7 +1405,29 @@ bool Bindings::unify(BindingList& mgu, const Literal& l1, size_t id1,
   } else if (l1.predicate() != l2.predicate()) {
     /* The predicates do not match. */
     return false;
-  } else if (l1.id() > 0 || l2.id() > 0) {
+  } else if (!cache_unifiers || !mgu.empty()) {
+    /* The result depends on the bindings already in the substitution
+       list, if any, so it cannot be cached. */
+    return unify_terms(mgu, l1, id1, l2, id2);
+  }
+  const std::pair<bool, BindingList>* result =
+    unifier_cache.find(l1, id1, l2, id2, serial_);
+  if (result != 0) {
+    mgu = result->second;
+    return result->first;
+  }
+  bool unifiable = unify_terms(mgu, l1, id1, l2, id2);
+  unifier_cache.insert(l1, id1, l2, id2, serial_, unifiable, mgu);
+  return unifiable;
+}
+
+
+/* Checks if the terms of the given formulas, which have the same
+   predicate and are not both fully instantiated, can be unified; the
+   most general unifier is added to the provided substitution list. */
+bool Bindings::unify_terms(BindingList& mgu, const Literal& l1, size_t id1,
+                           const Literal& l2, size_t id2) const {
+  if (l1.id() > 0 || l2.id() > 0) {
     /* One of the literals is fully instantiated. */
     const Literal* ll;
     const Literal* lg;
@@ -911,7 +1542,7 @@ bool Bindings::consistent_with(const Equality& eq, size_t step_id) const {
   size_t var_id = eq.step_id1(step_id);
   size_t term_id = eq.step_id2(step_id);
   const Varset* vs =
-    (term_id <= high_step_) ? find_varset(varsets_, eq.term(), term_id) : 0;
+    (term_id <= high_step_) ? find_varset(index_, eq.term(), term_id) : 0;
   if (vs == 0 || vs->includes(eq.variable(), var_id)) {
     return true;
   } else if (vs->excludes(eq.variable(), var_id)) {
@@ -933,7 +1564,7 @@ bool Bindings::consistent_with(const Inequality& neq, size_t step_id) const {
   size_t var_id = neq.step_id1(step_id);
   size_t term_id = neq.step_id2(step_id);
   const Varset* vs =
-    (term_id <= high_step_) ? find_varset(varsets_, neq.term(), term_id) : 0;
+    (term_id <= high_step_) ? find_varset(index_, neq.term(), term_id) : 0;
   return (vs == 0
           || !vs->includes(neq.variable(), var_id)
           || vs->excludes(neq.variable(), var_id));
@@ -967,11 +1598,9 @@ const Bindings* Bindings::add(const BindingList& new_bindings,
   }
 
   /* Varsets for new binding collection */
-  const Chain<Varset>* varsets = varsets_;
+  Varsets varsets(varsets_, index_);
   /* Highest step id of variable in varsets. */
   size_t high_step = high_step_;
-  /* Variables above previous high step. */
-  VariableSet high_step_vars;
   /* Step domains for new binding collection */
   const Chain<StepDomain>* step_domains = step_domains_;
 
@@ -991,34 +1620,14 @@ const Bindings* Bindings::add(const BindingList& new_bindings,
        * Adding equality binding.
        */
       /* Varset for variable. */
-      const Varset* vs1;
-      StepVariable sv(bind.var(), bind.var_id());
-      if (bind.var_id() <= high_step_
-          || high_step_vars.find(sv) != high_step_vars.end()) {
-        vs1 = find_varset(varsets, bind.var(), bind.var_id());
-      } else {
-        if (bind.var_id() > high_step) {
-          high_step = bind.var_id();
-        }
-        high_step_vars.insert(sv);
-        vs1 = 0;
+      const Varset* vs1 = varsets.find(bind.var(), bind.var_id());
+      if (bind.var_id() > high_step) {
+        high_step = bind.var_id();
       }
       /* Varset for term. */
-      const Varset* vs2;
-      if (bind.term().object()) {
-        vs2 = find_varset(varsets, bind.term().as_object());
-      } else {
-        StepVariable sv(bind.term().as_variable(), bind.term_id());
-        if (bind.term_id() <= high_step_
-            || high_step_vars.find(sv) != high_step_vars.end()) {
-          vs2 = find_varset(varsets, sv.first, bind.term_id());
-        } else {
-          if (bind.term_id() > high_step) {
-            high_step = bind.term_id();
-          }
-          high_step_vars.insert(sv);
-          vs2 = 0;
-        }
+      const Varset* vs2 = varsets.find(bind.term(), bind.term_id());
+      if (bind.term().variable() && bind.term_id() > high_step) {
+        high_step = bind.term_id();
       }
       /* Combined varset, or 0 if binding is inconsistent with
          current bindings. */
@@ -1049,8 +1658,6 @@ const Bindings* Bindings::add(const BindingList& new_bindings,
       }
       if (comb == 0) {
         /* Binding is inconsistent with current bindings. */
-        RCObject::ref(varsets);
-        RCObject::destructive_deref(varsets);
         RCObject::ref(step_domains);
         RCObject::destructive_deref(step_domains);
         return 0;
@@ -1120,8 +1727,6 @@ const Bindings* Bindings::add(const BindingList& new_bindings,
                     sd.first->restrict(step_domains, *obj, sd.second);
                   if (new_sd == 0) {
                     /* Domain became empty. */
-                    RCObject::ref(varsets);
-                    RCObject::destructive_deref(varsets);
                     RCObject::ref(step_domains);
                     RCObject::destructive_deref(step_domains);
                     if (new_intersection) {
@@ -1140,8 +1745,6 @@ const Bindings* Bindings::add(const BindingList& new_bindings,
                                          *intersection, sd.second);
                     if (new_sd == 0) {
                       /* Domain became empty. */
-                      RCObject::ref(varsets);
-                      RCObject::destructive_deref(varsets);
                       RCObject::ref(step_domains);
                       RCObject::destructive_deref(step_domains);
                       if (new_intersection) {
@@ -1168,8 +1771,6 @@ const Bindings* Bindings::add(const BindingList& new_bindings,
                     new_intersection = true;
                     if (intersection->empty()) {
                       /* Domain became empty. */
-                      RCObject::ref(varsets);
-                      RCObject::destructive_deref(varsets);
                       RCObject::ref(step_domains);
                       RCObject::destructive_deref(step_domains);
                       if (new_intersection) {
@@ -1192,39 +1793,17 @@ const Bindings* Bindings::add(const BindingList& new_bindings,
        * Adding inequality binding.
        */
       /* Varset for variable. */
-      const Varset* vs1;
-      StepVariable sv(bind.var(), bind.var_id());
-      if (bind.var_id() <= high_step_
-          || high_step_vars.find(sv) != high_step_vars.end()) {
-        vs1 = find_varset(varsets, bind.var(), bind.var_id());
-      } else {
-        if (bind.var_id() > high_step) {
-          high_step = bind.var_id();
-        }
-        high_step_vars.insert(sv);
-        vs1 = 0;
+      const Varset* vs1 = varsets.find(bind.var(), bind.var_id());
+      if (bind.var_id() > high_step) {
+        high_step = bind.var_id();
       }
       /* Varset for term. */
-      const Varset* vs2;
-      if (bind.term().object()) {
-        vs2 = find_varset(varsets, bind.term().as_object());
-      } else {
-        StepVariable sv(bind.term().as_variable(), bind.term_id());
-        if (bind.term_id() <= high_step_
-            || high_step_vars.find(sv) != high_step_vars.end()) {
-          vs2 = find_varset(varsets, sv.first, bind.term_id());
-        } else {
-          if (bind.term_id() > high_step) {
-            high_step = bind.term_id();
-          }
-          high_step_vars.insert(sv);
-          vs2 = 0;
-        }
+      const Varset* vs2 = varsets.find(bind.term(), bind.term_id());
+      if (bind.term().variable() && bind.term_id() > high_step) {
+        high_step = bind.term_id();
       }
       if (vs1 != 0 && vs2 != 0 && vs1 == vs2) {
         /* The terms are already bound to eachother. */
-        RCObject::ref(varsets);
-        RCObject::destructive_deref(varsets);
         RCObject::ref(step_domains);
         RCObject::destructive_deref(step_domains);
         return 0;
@@ -1275,8 +1854,6 @@ const Bindings* Bindings::add(const BindingList& new_bindings,
                   sd.first->exclude(step_domains, *vs1->constant(), sd.second);
                 if (new_sd == 0) {
                   /* Domain became empty. */
-                  RCObject::ref(varsets);
-                  RCObject::destructive_deref(varsets);
                   RCObject::ref(step_domains);
                   RCObject::destructive_deref(step_domains);
                   return 0;
@@ -1302,8 +1879,6 @@ const Bindings* Bindings::add(const BindingList& new_bindings,
                   sd.first->exclude(step_domains, *vs2->constant(), sd.second);
                 if (new_sd == 0) {
                   /* Domain became empty. */
-                  RCObject::ref(varsets);
-                  RCObject::destructive_deref(varsets);
                   RCObject::ref(step_domains);
                   RCObject::destructive_deref(step_domains);
                   return 0;
@@ -1323,15 +1898,14 @@ const Bindings* Bindings::add(const BindingList& new_bindings,
   }
   /* New bindings are consistent with the current bindings. */
   if (test_only
-      || (varsets == varsets_ && high_step == high_step_
+      || (varsets.chain() == varsets_ && high_step == high_step_
           && step_domains == step_domains_)) {
-    RCObject::ref(varsets);
-    RCObject::destructive_deref(varsets);
     RCObject::ref(step_domains);
     RCObject::destructive_deref(step_domains);
     return this;
   } else {
-    return new Bindings(varsets, high_step, step_domains);
+    return new Bindings(varsets.chain(), varsets.index(), high_step,
+                        step_domains);
   }
 }
 
@@ -1352,7 +1926,7 @@ const Bindings* Bindings::add(size_t step_id, const Action& step_action,
   const Chain<StepDomain>* step_domains =
     new Chain<StepDomain>(StepDomain(step_id, action->parameters(), *domain),
                           step_domains_);
-  const Chain<Varset>* varsets = varsets_;
+  Varsets varsets(varsets_, index_);
   size_t high_step = high_step_;
   const StepDomain& step_domain = step_domains->head;
   for (size_t c = 0; c < step_domain.parameters().size(); c++) {
@@ -1362,24 +1936,22 @@ const Bindings* Bindings::add(size_t step_id, const Action& step_action,
                                                step_domain.id()),
                                 0);
       Type type = TermTable::type(step_domain.parameters()[c]);
-      varsets = new Chain<Varset>(Varset(&*step_domain.projection(c).begin(),
-                                         cd_set, 0, type),
-                                  varsets);
+      varsets.add(Varset(&*step_domain.projection(c).begin(),
+                         cd_set, 0, type));
       if (step_id > high_step) {
         high_step = step_id;
       }
     }
   }
   if (test_only
-      || (varsets == varsets_ && high_step == high_step_
+      || (varsets.chain() == varsets_ && high_step == high_step_
           && step_domains == step_domains_)) {
-    RCObject::ref(varsets);
-    RCObject::destructive_deref(varsets);
     RCObject::ref(step_domains);
     RCObject::destructive_deref(step_domains);
     return this;
   } else {
-    return new Bindings(varsets, high_step, step_domains);
+    return new Bindings(varsets.chain(), varsets.index(), high_step,
+                        step_domains);
   }
 }
 
@@ -1439,6 +2011,99 @@ void Bindings::print(std::ostream& os) const {
 }
 
 
+/* Returns the given step variables with each step id i replaced by
+   step_ids[i], in sorted order. */
+static std::vector<StepVariable>
+canonical_step_vars(const Chain<StepVariable>* vc,
+                    const std::vector<size_t>& step_ids) {
+  std::vector<StepVariable> step_vars;
+  for (; vc != 0; vc = vc->tail) {
+    size_t id = vc->head.second;
+    step_vars.push_back(std::make_pair(vc->head.first,
+                                       (id < step_ids.size())
+                                       ? step_ids[id] : id));
+  }
+  std::sort(step_vars.begin(), step_vars.end());
+  return step_vars;
+}
+
+
+/* Prints the given step variables on the given stream. */
+static void print_step_vars(std::ostream& os,
+                            const std::vector<StepVariable>& step_vars) {
+  os << "{";
+  for (std::vector<StepVariable>::const_iterator vi = step_vars.begin();
+       vi != step_vars.end(); vi++) {
+    os << ' ' << (*vi).first << '(' << (*vi).second << ')';
+  }
+  os << " }";
+}
+
+
+/* Prints this object on the given stream with each step id i
+   replaced by step_ids[i], in a form that does not depend on the
+   order in which the bindings were added. */
+void Bindings::print_canonical(std::ostream& os,
+                               const std::vector<size_t>& step_ids) const {
+  std::map<size_t, std::vector<Variable> > seen_vars;
+  std::vector<Object> seen_objs;
+  /* Each live varset printed on its own. */
+  std::vector<std::string> varsets;
+  for (const Chain<Varset>* vsc = varsets_; vsc != 0; vsc = vsc->tail) {
+    const Varset& vs = vsc->head;
+    if (vs.cd_set() != 0) {
+      const Chain<StepVariable>* vc = vs.cd_set();
+      if (find(seen_vars[vc->head.second].begin(),
+               seen_vars[vc->head.second].end(), vc->head.first)
+          != seen_vars[vc->head.second].end()) {
+        continue;
+      }
+    }
+    if (vs.constant() != 0) {
+      const Object& obj = *vs.constant();
+      if (find(seen_objs.begin(), seen_objs.end(), obj) != seen_objs.end()) {
+        continue;
+      }
+      seen_objs.push_back(obj);
+    }
+    for (const Chain<StepVariable>* vc = vs.cd_set(); vc != 0;
+         vc = vc->tail) {
+      seen_vars[vc->head.second].push_back(vc->head.first);
+    }
+    std::ostringstream vos;
+    if (vs.cd_set() != 0) {
+      print_step_vars(vos, canonical_step_vars(vs.cd_set(), step_ids));
+    }
+    if (vs.constant() != 0) {
+      vos << " == " << *vs.constant();
+    }
+    if (vs.ncd_set() != 0) {
+      vos << " != ";
+      print_step_vars(vos, canonical_step_vars(vs.ncd_set(), step_ids));
+    }
+    varsets.push_back(vos.str());
+  }
+  std::sort(varsets.begin(), varsets.end());
+  for (std::vector<std::string>::const_iterator vi = varsets.begin();
+       vi != varsets.end(); vi++) {
+    os << *vi << ';';
+  }
+  std::map<size_t, const StepDomain*> step_domains;
+  for (const Chain<StepDomain>* sd = step_domains_; sd != 0; sd = sd->tail) {
+    size_t id = sd->head.id();
+    step_domains.insert(std::make_pair((id < step_ids.size())
+                                       ? step_ids[id] : id, &sd->head));
+  }
+  for (std::map<size_t, const StepDomain*>::const_iterator si =
+           step_domains.begin();
+       si != step_domains.end(); si++) {
+    os << (*si).first << ':';
+    (*si).second->domain().print_rows(os);
+    os << ';';
+  }
+}
+
+
 /* Prints the given term on the given stream. */
 void Bindings::print_term(std::ostream& os,
                           const Term& term, size_t step_id) const {
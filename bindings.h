@@ -22,11 +22,15 @@
 #ifndef BINDINGS_H
 #define BINDINGS_H
 
+#include <atomic>
+#include <cstdint>
 #include <set>
 
 #include "chain.h"
 #include "terms.h"
 
+#include "src/threads.h"
+
 struct Literal;
 struct Equality;
 struct Inequality;
@@ -103,33 +107,28 @@ struct NameSet : public std::set<Object> {
 };
 
 
-/* ====================================================================== */
-/* TupleList */
-
-/*
- * A list of parameter tuples.
- */
-struct TupleList : public std::vector<const std::vector<Object>*> {};
-
 /* ====================================================================== */
 /* ActionDomain */
 
+struct TupleTable;
+
 /*
- * Domain for action parameters.
+ * Domain for action parameters.  The domain is a set of rows of a
+ * table of parameter tuples, represented as a bitset.  Restricted
+ * domains share the table of the domain they were restricted from.
  */
 struct ActionDomain {
   /* Register use of this object. */
   static void register_use(const ActionDomain* a) {
     if (a != 0) {
-      a->ref_count_++;
+      Threads::Increment(a->ref_count_);
     }
   }
 
   /* Unregister use of this object. */
   static void unregister_use(const ActionDomain* a) {
     if (a != 0) {
-      a->ref_count_--;
-      if (a->ref_count_ == 0) {
+      if (Threads::Decrement(a->ref_count_) == 0) {
         delete a;
       }
     }
@@ -142,14 +141,16 @@ struct ActionDomain {
   ~ActionDomain();
 
   /* Number of tuples. */
-  size_t size() const { return tuples().size(); }
+  size_t size() const { return size_; }
 
-  /* Returns the tuples of this action domain. */
-  const TupleList& tuples() const { return tuples_; }
-
-  /* Adds a tuple to this domain. */
+  /* Adds a tuple to this domain; N.B. only domains that have not been
+     restricted can be added to. */
   void add(const std::vector<Object>& tuple);
 
+  /* Checks if this domain includes the given object in the given
+     column. */
+  bool includes(const Object& obj, size_t column) const;
+
   /* Returns the set of names from the given column. */
   const NameSet& projection(size_t column) const;
 
@@ -169,6 +170,10 @@ struct ActionDomain {
      or 0 if this would leave an empty domain. */
   const ActionDomain* exclude(const Object& obj, size_t column) const;
 
+  /* Prints the rows of the table included in this domain on the given
+     stream. */
+  void print_rows(std::ostream& os) const;
+
   /* Prints this object on the given stream. */
   void print(std::ostream& os) const;
 
@@ -177,12 +182,24 @@ private:
   struct ProjectionMap : public std::map<size_t, const NameSet*> {
   };
 
-  /* Possible parameter tuples. */
-  TupleList tuples_;
+  /* Table of parameter tuples. */
+  TupleTable* table_;
+  /* Rows of the table included in this domain. */
+  std::vector<uint64_t> rows_;
+  /* Number of rows included in this domain. */
+  size_t size_;
   /* Projections. */
   mutable ProjectionMap projections_;
   /* Reference counter. */
-  mutable size_t ref_count_;
+  mutable std::atomic<size_t> ref_count_;
+
+  /* Constructs an action domain with the given rows of the given
+     table; the vector of rows is consumed. */
+  ActionDomain(TupleTable& table, std::vector<uint64_t>& rows, size_t size);
+
+  /* Returns a domain with the given rows of the table of this domain,
+     or 0 if there are no rows; the vector of rows is consumed. */
+  const ActionDomain* make(std::vector<uint64_t>& rows) const;
 };
 
 
@@ -190,6 +207,7 @@ private:
 /* Bindings */
 
 struct Varset;
+struct VarsetIndex;
 struct StepDomain;
 
 /*
@@ -198,19 +216,20 @@ struct StepDomain;
 struct Bindings {
   /* Empty bindings. */
   static const Bindings EMPTY;
+  /* Whether to cache unification results. */
+  static bool cache_unifiers;
 
   /* Register use of this object. */
   static void register_use(const Bindings* b) {
     if (b != 0) {
-      b->ref_count_++;
+      Threads::Increment(b->ref_count_);
     }
   }
 
   /* Unregister use of this object. */
   static void unregister_use(const Bindings* b) {
     if (b != 0) {
-      b->ref_count_--;
-      if (b->ref_count_ == 0) {
+      if (Threads::Decrement(b->ref_count_) == 0) {
         delete b;
       }
     }
@@ -220,6 +239,18 @@ struct Bindings {
   static bool unifiable(const Literal& l1, size_t id1,
                         const Literal& l2, size_t id2);
 
+  /* Returns the number of unifications answered by the unifier cache
+     of the calling thread. */
+  static size_t unifier_cache_hits();
+
+  /* Returns the number of unifications not answered by the unifier
+     cache of the calling thread. */
+  static size_t unifier_cache_misses();
+
+  /* Removes all entries from the unifier cache of the calling
+     thread. */
+  static void clear_unifier_cache();
+
   /* Checks if the given formulas can be unified; the most general
      unifier is added to the provided substitution list. */
   static bool unifiable(BindingList& mgu,
@@ -280,25 +311,44 @@ struct Bindings {
   /* Prints this object on the given stream. */
   void print(std::ostream& os) const;
 
+  /* Prints this object on the given stream with each step id i
+     replaced by step_ids[i], in a form that does not depend on the
+     order in which the bindings were added. */
+  void print_canonical(std::ostream& os,
+                       const std::vector<size_t>& step_ids) const;
+
   /* Prints the given term on the given stream. */
   void print_term(std::ostream& os, const Term& term, size_t step_id) const;
 
 private:
+  /* Next serial number for binding collections. */
+  static std::atomic<size_t> next_serial;
+
   /* Varsets representing the transitive closure of the bindings. */
   const Chain<Varset>* varsets_;
+  /* Index from terms to the first varset including them. */
+  const VarsetIndex* index_;
   /* Highest step id of variable in varsets. */
   size_t high_step_;
   /* Step domains. */
   const Chain<StepDomain>* step_domains_;
+  /* Serial number, unique to this binding collection. */
+  size_t serial_;
   /* Reference counter. */
-  mutable size_t ref_count_;
+  mutable std::atomic<size_t> ref_count_;
 
   /* Constructs an empty binding collection. */
   Bindings();
 
   /* Constructs a binding collection. */
-  Bindings(const Chain<Varset>* varsets, size_t high_step,
-           const Chain<StepDomain>* step_domains);
+  Bindings(const Chain<Varset>* varsets, const VarsetIndex* index,
+           size_t high_step, const Chain<StepDomain>* step_domains);
+
+  /* Checks if the terms of the given formulas can be unified; the
+     most general unifier is added to the provided substitution
+     list. */
+  bool unify_terms(BindingList& mgu, const Literal& l1, size_t id1,
+                   const Literal& l2, size_t id2) const;
 };
 
 
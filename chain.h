@@ -23,6 +23,7 @@
 #define CHAIN_H_
 
 #include "refcount.h"
+#include "src/pool.h"
 
 // Template chain class.
 template <typename T>
@@ -41,6 +42,12 @@ class Chain : public RCObject {
   // Deletes this chain.
   ~Chain<T>() { destructive_deref(tail); }
 
+  // Allocates memory for a chain from the pool for chains of this type.
+  static void* operator new(size_t size) { return Pool<Chain<T> >::Allocate(); }
+
+  // Returns the memory for a chain to the pool for chains of this type.
+  static void operator delete(void* p) { Pool<Chain<T> >::Deallocate(p); }
+
   // Returns the size of this chain.
   int size() const {
     int result = 0;
@@ -22,35 +22,83 @@
 #include "formulas.h"
 #include "plans.h"
 #include "predicates.h"
+#include <atomic>
+#include <mutex>
+#include <utility>
+
+#include "src/threads.h"
+
+/* ====================================================================== */
+/* Flaw */
+
+/* Returns a new flaw id, larger than any id returned before. */
+size_t Flaw::next_id() {
+  static std::atomic<size_t> next_id(1);
+  return next_id++;
+}
+
 
 /* ====================================================================== */
 /* OpenCondition */
 
+/* Number of mutexes protecting cached heuristic values. */
+static const size_t NUM_VALUE_MUTEXES = 64;
+/* Mutexes protecting the cached heuristic values of open conditions,
+   which are shared by plans that may be searched in different
+   threads.  An open condition and its copies use the same mutex. */
+static std::mutex value_mutexes[NUM_VALUE_MUTEXES];
+
+
+/* Returns the mutex protecting the cached heuristic values of the
+   open condition with the given id. */
+static std::mutex& value_mutex(size_t id) {
+  return value_mutexes[id % NUM_VALUE_MUTEXES];
+}
+
+
 /* Constructs an open condition. */
 OpenCondition::OpenCondition(size_t step_id, const Formula& condition)
-  : step_id_(step_id), condition_(&condition) {
+  : id_(next_id()), step_id_(step_id), condition_(&condition),
+    when_(AT_START) {
   Formula::register_use(condition_);
+  for (int i = 0; i < NUM_CACHED_VALUES; i++) {
+    values_[i].cached = false;
+    values_[i].bindings = NULL;
+  }
 }
 
 
 /* Constructs an open condition. */
 OpenCondition::OpenCondition(size_t step_id, const Literal& condition,
                              FormulaTime when)
-  : step_id_(step_id), condition_(&condition), when_(when) {
+  : id_(next_id()), step_id_(step_id), condition_(&condition), when_(when) {
   Formula::register_use(condition_);
+  for (int i = 0; i < NUM_CACHED_VALUES; i++) {
+    values_[i].cached = false;
+    values_[i].bindings = NULL;
+  }
 }
 
 
 /* Constructs an open condition. */
 OpenCondition::OpenCondition(const OpenCondition& oc)
-  : step_id_(oc.step_id_), condition_(oc.condition_), when_(oc.when_) {
+  : id_(oc.id_), step_id_(oc.step_id_), condition_(oc.condition_),
+    when_(oc.when_) {
   Formula::register_use(condition_);
+  Threads::Lock<std::mutex> lock(value_mutex(id_));
+  for (int i = 0; i < NUM_CACHED_VALUES; i++) {
+    values_[i] = oc.values_[i];
+    Bindings::register_use(values_[i].bindings);
+  }
 }
 
 
 /* Deletes this open condition. */
 OpenCondition::~OpenCondition() {
   Formula::unregister_use(condition_);
+  for (int i = 0; i < NUM_CACHED_VALUES; i++) {
+    Bindings::unregister_use(values_[i].bindings);
+  }
 }
 
 
@@ -83,6 +131,45 @@ const Disjunction* OpenCondition::disjunction() const {
 }
 
 
+/* Retrieves the heuristic value of this open condition, and returns
+   true iff a value has been cached for the given bindings. */
+bool OpenCondition::cached_value(HeuristicValue& h, HeuristicValue& hs,
+                                 const Bindings* bindings) const {
+  Threads::Lock<std::mutex> lock(value_mutex(id_));
+  for (int i = 0; i < NUM_CACHED_VALUES; i++) {
+    if (values_[i].cached && values_[i].bindings == bindings) {
+      h = values_[i].value;
+      hs = values_[i].start_value;
+      if (i > 0) {
+        std::swap(values_[i], values_[0]);
+      }
+      return true;
+    }
+  }
+  return false;
+}
+
+
+/* Caches the heuristic value of this open condition for the given
+   bindings, replacing the least recently used value.  A reference to
+   the bindings is kept so that their address cannot be reused for
+   other bindings while the value is cached. */
+void OpenCondition::cache_value(const HeuristicValue& h,
+                                const HeuristicValue& hs,
+                                const Bindings* bindings) const {
+  Threads::Lock<std::mutex> lock(value_mutex(id_));
+  Bindings::register_use(bindings);
+  Bindings::unregister_use(values_[NUM_CACHED_VALUES - 1].bindings);
+  for (int i = NUM_CACHED_VALUES - 1; i > 0; i--) {
+    values_[i] = values_[i - 1];
+  }
+  values_[0].cached = true;
+  values_[0].bindings = bindings;
+  values_[0].value = h;
+  values_[0].start_value = hs;
+}
+
+
 /* Prints this object on the given stream. */
 void OpenCondition::print(std::ostream& os, const Bindings& bindings) const {
   os << "#<OPEN ";
@@ -25,6 +25,7 @@
 #include <config.h>
 #include "formulas.h"
 #include "chain.h"
+#include "heuristics.h"
 #include <iostream>
 
 struct Domain;
@@ -41,6 +42,10 @@ struct Link;
 struct Flaw {
   /* Prints this object on the given stream. */
   virtual void print(std::ostream& os, const Bindings& bindings) const = 0;
+
+protected:
+  /* Returns a new flaw id, larger than any id returned before. */
+  static size_t next_id();
 };
 
 
@@ -63,6 +68,9 @@ struct OpenCondition : public Flaw {
   /* Deletes this open condition. */
   virtual ~OpenCondition();
 
+  /* Returns the id of this open condition. */
+  size_t id() const { return id_; }
+
   /* Returns the step id. */
   size_t step_id() const { return step_id_; }
 
@@ -87,16 +95,47 @@ struct OpenCondition : public Flaw {
      condition. */
   const Disjunction* disjunction() const;
 
+  /* Retrieves the heuristic value of this open condition, and returns
+     true iff a value has been cached for the given bindings. */
+  bool cached_value(HeuristicValue& h, HeuristicValue& hs,
+                    const Bindings* bindings) const;
+
+  /* Caches the heuristic value of this open condition for the given
+     bindings. */
+  void cache_value(const HeuristicValue& h, const HeuristicValue& hs,
+                   const Bindings* bindings) const;
+
   /* Prints this object on the given stream. */
   virtual void print(std::ostream& os, const Bindings& bindings) const;
 
 private:
+  /* A heuristic value cached for some bindings. */
+  struct CachedValue {
+    /* Whether a heuristic value has been cached. */
+    bool cached;
+    /* Bindings used to compute the cached heuristic value. */
+    const Bindings* bindings;
+    /* Cached heuristic value. */
+    HeuristicValue value;
+    /* Cached heuristic value for the start of a durative step. */
+    HeuristicValue start_value;
+  };
+
+  /* Number of heuristic values cached for different bindings.  An
+     open condition is shared by all plans refined from the plan that
+     added it, and sibling plans often have different bindings. */
+  static const int NUM_CACHED_VALUES = 2;
+
+  /* Id of this open condition. */
+  size_t id_;
   /* Id of step to which this open condition belongs. */
   size_t step_id_;
   /* The open condition. */
   const Formula* condition_;
   /* Time stamp associated with a literal open condition. */
   FormulaTime when_;
+  /* Cached heuristic values, most recently used first. */
+  mutable CachedValue values_[NUM_CACHED_VALUES];
 };
 
 /* Equality operator for open conditions. */
@@ -114,7 +153,10 @@ inline bool operator==(const OpenCondition& oc1, const OpenCondition& oc2) {
 struct Unsafe : public Flaw {
   /* Constructs a threatened causal link. */
   Unsafe(const Link& link, size_t step_id, const Effect& effect)
-    : link_(&link), step_id_(step_id), effect_(&effect) {}
+    : id_(next_id()), link_(&link), step_id_(step_id), effect_(&effect) {}
+
+  /* Returns the id of this threatened causal link. */
+  size_t id() const { return id_; }
 
   /* Returns the threatened link. */
   const Link& link() const { return *link_; }
@@ -129,6 +171,8 @@ struct Unsafe : public Flaw {
   virtual void print(std::ostream& os, const Bindings& bindings) const;
 
 private:
+  /* Id of this threatened causal link. */
+  size_t id_;
   /* Threatened link. */
   const Link* link_;
   /* Id of threatening step. */
@@ -0,0 +1,235 @@
+// Copyright (C) 2019 Google Inc
+//
+// This file is part of VHPOP.
+//
+// VHPOP is free software; you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// VHPOP is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+// or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+// License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with VHPOP; if not, write to the Free Software Foundation,
+// Inc., #59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+//
+// Template persistent flaw set class.
+
+#ifndef FLAWSET_H_
+#define FLAWSET_H_
+
+#include <cstdint>
+#include <vector>
+
+#include "refcount.h"
+#include "src/pool.h"
+
+// Template persistent set of flaws.
+//
+// The flaws are kept in a treap ordered by flaw id, and are visited from the
+// most to the least recently created flaw, which is the order in which they
+// would appear in a chain where new flaws are added at the front.  The
+// priority of a node is a hash of the flaw id, so the shape of the tree only
+// depends on its contents.  Adding or removing a flaw copies only the nodes on
+// a path from the root, sharing the rest of the tree with the original set.
+// The flaws themselves are never copied, but shared by all nodes holding them.
+// The empty set is represented by a null pointer.
+//
+// Flaws must have an id() that is unique and larger than the id of any flaw
+// created before it.
+template <typename T>
+class FlawSet : public RCObject {
+ public:
+  // Iterator over the flaws in a set, most recently created flaw first.
+  class const_iterator {
+   public:
+    // Constructs an iterator past the end of a set.
+    const_iterator() : size_(0) {}
+
+    // Constructs an iterator at the first flaw of the given set.
+    explicit const_iterator(const FlawSet<T>* set) : size_(0) {
+      push_newer(set);
+    }
+
+    const T& operator*() const { return top()->flaw(); }
+
+    const T* operator->() const { return &top()->flaw(); }
+
+    const_iterator& operator++() {
+      const FlawSet<T>* node = top();
+      if (size_ > kInlinePathSize) {
+        overflow_path_.pop_back();
+      }
+      size_--;
+      push_newer(node->older_);
+      return *this;
+    }
+
+    bool operator==(const const_iterator& other) const {
+      return (size_ == 0 ? other.size_ == 0
+              : other.size_ != 0 && top() == other.top());
+    }
+
+    bool operator!=(const const_iterator& other) const {
+      return !(*this == other);
+    }
+
+   private:
+    // Number of path nodes stored without allocating memory.  The expected
+    // depth of a treap is logarithmic in its size, so longer paths are rare.
+    static const size_t kInlinePathSize = 16;
+
+    // Returns the last node on the path.
+    const FlawSet<T>* top() const {
+      return ((size_ > kInlinePathSize) ? overflow_path_.back()
+              : inline_path_[size_ - 1]);
+    }
+
+    // Pushes the given node and its chain of newer descendants.
+    void push_newer(const FlawSet<T>* node) {
+      for (; node != 0; node = node->newer_) {
+        if (size_ < kInlinePathSize) {
+          inline_path_[size_] = node;
+        } else {
+          overflow_path_.push_back(node);
+        }
+        size_++;
+      }
+    }
+
+    // Nodes whose flaw and older flaws have yet to be visited; the first
+    // ones are stored inline, and the rest in a vector.
+    const FlawSet<T>* inline_path_[kInlinePathSize];
+    std::vector<const FlawSet<T>*> overflow_path_;
+    // Number of nodes on the path.
+    size_t size_;
+  };
+
+  // Returns an iterator past the end of any set.
+  static const_iterator end() { return const_iterator(); }
+
+  // Returns the set obtained by adding the given flaw to the given set.  The
+  // flaw must have been created after every flaw in the set.  Like a chain
+  // constructed on top of it, the new set takes over an unreferenced set.
+  static const FlawSet<T>* add(const T& flaw, const FlawSet<T>* set) {
+    ref(set);
+    const FlawSet<T>* result = insert(new Entry(flaw), set);
+    destructive_deref(set);
+    return result;
+  }
+
+  // Deletes this set.
+  ~FlawSet<T>() {
+    destructive_deref(entry_);
+    destructive_deref(newer_);
+    destructive_deref(older_);
+  }
+
+  // Allocates memory for a set from the pool for sets of this type.
+  static void* operator new(size_t size) {
+    return Pool<FlawSet<T> >::Allocate();
+  }
+
+  // Returns the memory for a set to the pool for sets of this type.
+  static void operator delete(void* p) { Pool<FlawSet<T> >::Deallocate(p); }
+
+  // Returns a set with the given flaw removed.
+  const FlawSet<T>* remove(const T& flaw) const {
+    if (flaw.id() == id()) {
+      return merge(newer_, older_);
+    } else if (flaw.id() > id()) {
+      if (newer_ == 0) {
+        return this;
+      }
+      const FlawSet<T>* newer = newer_->remove(flaw);
+      return (newer == newer_) ? this : new FlawSet<T>(entry_, newer, older_);
+    } else {
+      if (older_ == 0) {
+        return this;
+      }
+      const FlawSet<T>* older = older_->remove(flaw);
+      return (older == older_) ? this : new FlawSet<T>(entry_, newer_, older);
+    }
+  }
+
+ private:
+  // A flaw shared by the nodes holding it.
+  class Entry : public RCObject {
+   public:
+    // The flaw.
+    const T flaw;
+
+    // Constructs an entry for the given flaw.
+    explicit Entry(const T& flaw) : flaw(flaw) {}
+
+    // Allocates memory for an entry from the pool for entries of this type.
+    static void* operator new(size_t size) {
+      return Pool<Entry>::Allocate();
+    }
+
+    // Returns the memory for an entry to the pool for entries of this type.
+    static void operator delete(void* p) { Pool<Entry>::Deallocate(p); }
+  };
+
+  // The flaw at this node.
+  const Entry* entry_;
+  // Flaws created after the flaw at this node.
+  const FlawSet<T>* newer_;
+  // Flaws created before the flaw at this node.
+  const FlawSet<T>* older_;
+
+  // Constructs a node with the given flaw and subtrees.
+  FlawSet<T>(const Entry* entry, const FlawSet<T>* newer,
+             const FlawSet<T>* older)
+      : entry_(entry), newer_(newer), older_(older) {
+    ref(entry);
+    ref(newer);
+    ref(older);
+  }
+
+  // Returns the flaw at this node.
+  const T& flaw() const { return entry_->flaw; }
+
+  // Returns the id of the flaw at this node.
+  size_t id() const { return entry_->flaw.id(); }
+
+  // Returns the treap priority of the given flaw id.
+  static uint64_t priority(size_t id) {
+    uint64_t x = id + 0x9e3779b97f4a7c15ULL;
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    x = (x ^ (x >> 27)) * 0x94d049bb133111ebULL;
+    return x ^ (x >> 31);
+  }
+
+  // Returns the set obtained by adding the given entry to the given set.
+  static const FlawSet<T>* insert(const Entry* entry, const FlawSet<T>* set) {
+    if (set == 0 || priority(entry->flaw.id()) > priority(set->id())) {
+      return new FlawSet<T>(entry, 0, set);
+    } else {
+      return new FlawSet<T>(set->entry_, insert(entry, set->newer_),
+                            set->older_);
+    }
+  }
+
+  // Returns the union of the given sets, where every flaw in the first set
+  // was created after every flaw in the second set.
+  static const FlawSet<T>* merge(const FlawSet<T>* newer,
+                                 const FlawSet<T>* older) {
+    if (newer == 0) {
+      return older;
+    } else if (older == 0) {
+      return newer;
+    } else if (priority(newer->id()) > priority(older->id())) {
+      return new FlawSet<T>(newer->entry_, newer->newer_,
+                            merge(newer->older_, older));
+    } else {
+      return new FlawSet<T>(older->entry_, merge(newer, older->newer_),
+                            older->older_);
+    }
+  }
+};
+
+#endif  // FLAWSET_H_
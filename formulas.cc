@@ -20,7 +20,9 @@
 #include "formulas.h"
 
 #include <iostream>
+#include <mutex>
 #include <stack>
+#include <vector>
 
 #include "bindings.h"
 #include "debug.h"
@@ -208,6 +210,42 @@ const Formula& Constant::negation() const {
 /* Next id for ground literals. */
 size_t Literal::next_id = 1;
 
+/* Mutex protecting the tables of ground literals and the next id. */
+static std::mutex literal_tables_mutex;
+
+/* Ground literals created while several planner threads may be
+   running.  Each holds an extra reference until no planner runs
+   anymore, so that no thread is handed a literal that another thread
+   is deleting.  Ground literals that exist before the threads start
+   are owned by the problem, its actions, or the planning graph, and
+   outlive the threads. */
+static std::vector<const Literal*> pinned_literals;
+
+
+/* Pins the given new ground literal if several planner threads may be
+   running; the caller holds literal_tables_mutex. */
+static void pin_literal(const Literal* literal) {
+  if (Threads::Concurrent()) {
+    Formula::register_use(literal);
+    pinned_literals.push_back(literal);
+  }
+}
+
+
+/* Releases the ground literals that were kept alive while several
+   planner threads may have been running. */
+void Literal::release_pinned() {
+  std::vector<const Literal*> literals;
+  {
+    std::lock_guard<std::mutex> lock(literal_tables_mutex);
+    literals.swap(pinned_literals);
+  }
+  for (std::vector<const Literal*>::const_iterator li = literals.begin();
+       li != literals.end(); li++) {
+    Formula::unregister_use(*li);
+  }
+}
+
 
 /* Assigns an id to this literal. */
 void Literal::assign_id(bool ground) {
@@ -325,21 +363,28 @@ const Atom& Atom::make(const Predicate& predicate,
     atom->assign_id(ground);
     return *atom;
   } else {
-    std::pair<AtomTable::const_iterator, bool> result = atoms.insert(atom);
-    if (!result.second) {
+    const Atom* result;
+    {
+      Threads::Lock<std::mutex> lock(literal_tables_mutex);
+      std::pair<AtomTable::const_iterator, bool> ai = atoms.insert(atom);
+      result = *ai.first;
+      if (ai.second) {
+        atom->assign_id(ground);
+        pin_literal(atom);
+      }
+    }
+    if (result != atom) {
       delete atom;
-      return **result.first;
-    } else {
-      atom->assign_id(ground);
-      return *atom;
     }
+    return *result;
   }
 }
 
 /* Deletes this atomic formula. */
 Atom::~Atom() {
+  Threads::Lock<std::mutex> lock(literal_tables_mutex);
   AtomTable::const_iterator ai = atoms.find(this);
-  if (*ai == this) {
+  if (ai != atoms.end() && *ai == this) {
     atoms.erase(ai);
   }
 }
@@ -467,15 +512,21 @@ const Negation& Negation::make(const Atom& atom) {
     negation->assign_id(ground);
     return *negation;
   } else {
-    std::pair<NegationTable::const_iterator, bool> result =
-      negations.insert(negation);
-    if (!result.second) {
+    const Negation* result;
+    {
+      Threads::Lock<std::mutex> lock(literal_tables_mutex);
+      std::pair<NegationTable::const_iterator, bool> ni =
+        negations.insert(negation);
+      result = *ni.first;
+      if (ni.second) {
+        negation->assign_id(ground);
+        pin_literal(negation);
+      }
+    }
+    if (result != negation) {
       delete negation;
-      return **result.first;
-    } else {
-      negation->assign_id(ground);
-      return *negation;
     }
+    return *result;
   }
 }
 
@@ -489,11 +540,14 @@ Negation::Negation(const Atom& atom)
 
 /* Deletes this negated atom. */
 Negation::~Negation() {
-  unregister_use(atom_);
-  NegationTable::const_iterator ni = negations.find(this);
-  if (*ni == this) {
-    negations.erase(ni);
+  {
+    Threads::Lock<std::mutex> lock(literal_tables_mutex);
+    NegationTable::const_iterator ni = negations.find(this);
+    if (ni != negations.end() && *ni == this) {
+      negations.erase(ni);
+    }
   }
+  unregister_use(atom_);
 }
 
 
@@ -1502,9 +1556,14 @@ const Formula& Forall::instantiation(const std::map<Variable, Term>& subst,
   }
 }
 
+/* Mutex protecting the cached universal bases of universally
+   quantified formulas. */
+static std::recursive_mutex universal_base_mutex;
+
 /* Returns the universal base of this formula. */
 const Formula& Forall::universal_base(const std::map<Variable, Term>& subst,
                                       const Problem& problem) const {
+  Threads::Lock<std::recursive_mutex> lock(universal_base_mutex);
   if (universal_base_ != NULL) {
     return *universal_base_;
   }
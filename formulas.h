@@ -22,6 +22,7 @@
 #ifndef FORMULAS_H
 #define FORMULAS_H
 
+#include <atomic>
 #include <iostream>
 #include <set>
 #include <vector>
@@ -29,6 +30,8 @@
 #include "predicates.h"
 #include "terms.h"
 
+#include "src/threads.h"
+
 #ifdef TRUE
 #undef TRUE
 #endif
@@ -61,15 +64,14 @@ struct Formula {
   /* Register use of the given formula. */
   static void register_use(const Formula* f) {
     if (f != NULL) {
-      f->ref_count_++;
+      Threads::Increment(f->ref_count_);
     }
   }
 
   /* Unregister use of the given formula. */
   static void unregister_use(const Formula* f) {
     if (f != NULL) {
-      f->ref_count_--;
-      if (f->ref_count_ == 0) {
+      if (Threads::Decrement(f->ref_count_) == 0) {
         delete f;
       }
     }
@@ -119,7 +121,7 @@ protected:
 
 private:
   /* Reference counter. */
-  mutable size_t ref_count_;
+  mutable std::atomic<size_t> ref_count_;
 
   friend const Formula& operator!(const Formula& f);
 };
@@ -206,6 +208,11 @@ struct Atom;
  * An abstract literal.
  */
 struct Literal : public Formula {
+  /* Releases the ground literals that were kept alive while several
+     planner threads may have been running.  Must only be called when
+     no planner is running. */
+  static void release_pinned();
+
   /* Returns the id for this literal (zero if lifted). */
   size_t id() const { return id_; }
 
@@ -875,15 +882,14 @@ struct Condition {
   /* Register use of the given condition. */
   static void register_use(const Condition* c) {
     if (c != NULL) {
-      c->ref_count_++;
+      Threads::Increment(c->ref_count_);
     }
   }
 
   /* Unregister use of the given condition. */
   static void unregister_use(const Condition* c) {
     if (c != NULL) {
-      c->ref_count_--;
-      if (c->ref_count_ == 0) {
+      if (Threads::Decrement(c->ref_count_) == 0) {
         delete c;
       }
     }
@@ -939,7 +945,7 @@ private:
   /* End condition. */
   const Formula* at_end_;
   /* Reference counter. */
-  mutable size_t ref_count_;
+  mutable std::atomic<size_t> ref_count_;
 
   /* Constructs a Boolean condition. */
   Condition(bool b);
@@ -21,6 +21,7 @@
 
 #include <string.h>
 #include <strings.h>
+#include <algorithm>
 #include <limits>
 #include <set>
 #include <typeinfo>
@@ -31,12 +32,15 @@
 #include "debug.h"
 #include "domains.h"
 #include "flaws.h"
+#include "flawset.h"
 #include "orderings.h"
 #include "parameters.h"
 #include "plans.h"
 #include "problems.h"
 #include "terms.h"
 
+#include "src/timer.h"
+
 /* Generates a random number in the interval [0,1). */
 static double rand01ex() {
   return rand()/(RAND_MAX + 1.0);
@@ -50,11 +54,14 @@ static int sum(int n, int m) {
 }
 
 
-/* Computes the heuristic value of the given formula. */
+/* Computes the heuristic value of the given formula.  If the formula
+   is the condition of the given open condition, the value computed
+   without reuse is cached with the open condition. */
 static void formula_value(HeuristicValue& h, HeuristicValue& hs,
                           const Formula& formula, size_t step_id,
                           const Plan& plan, const PlanningGraph& pg,
-                          bool reuse = false) {
+                          bool reuse = false,
+                          const OpenCondition* open_cond = NULL) {
   const Bindings* bindings = plan.bindings();
   if (reuse) {
     const Literal* literal;
@@ -142,7 +149,70 @@ static void formula_value(HeuristicValue& h, HeuristicValue& hs,
       return;
     }
   }
-  formula.heuristic_value(h, hs, pg, step_id, bindings);
+  if (open_cond != NULL) {
+    if (!open_cond->cached_value(h, hs, bindings)) {
+      formula.heuristic_value(h, hs, pg, step_id, bindings);
+      open_cond->cache_value(h, hs, bindings);
+    }
+  } else {
+    formula.heuristic_value(h, hs, pg, step_id, bindings);
+  }
+}
+
+
+/* Computes the heuristic value of the given open condition. */
+static void open_cond_value(HeuristicValue& h, HeuristicValue& hs,
+                            const OpenCondition& open_cond,
+                            const Plan& plan, const PlanningGraph& pg,
+                            bool reuse = false) {
+  formula_value(h, hs, open_cond.condition(), open_cond.step_id(),
+                plan, pg, reuse, &open_cond);
+}
+
+
+/* Adds the ids of the atoms whose values the heuristic value of the
+   given formula depends on to the given vector.  Returns false if
+   the dependencies cannot be determined statically. */
+static bool collect_atom_ids(std::vector<size_t>& ids,
+                             const Formula& formula) {
+  const std::type_info& type = typeid(formula);
+  if (type == typeid(Atom)) {
+    ids.push_back(static_cast<const Atom&>(formula).id());
+    return true;
+  } else if (type == typeid(TimedLiteral)) {
+    return collect_atom_ids(ids,
+                            static_cast<const TimedLiteral&>(formula).literal());
+  } else if (type == typeid(Negation)) {
+    ids.push_back(static_cast<const Negation&>(formula).atom().id());
+    return true;
+  } else if (type == typeid(Conjunction)) {
+    const FormulaList& conjuncts =
+      static_cast<const Conjunction&>(formula).conjuncts();
+    for (FormulaList::const_iterator fi = conjuncts.begin();
+         fi != conjuncts.end(); fi++) {
+      if (!collect_atom_ids(ids, **fi)) {
+        return false;
+      }
+    }
+    return true;
+  } else if (type == typeid(Disjunction)) {
+    const FormulaList& disjuncts =
+      static_cast<const Disjunction&>(formula).disjuncts();
+    for (FormulaList::const_iterator fi = disjuncts.begin();
+         fi != disjuncts.end(); fi++) {
+      if (!collect_atom_ids(ids, **fi)) {
+        return false;
+      }
+    }
+    return true;
+  } else if (type == typeid(Exists)) {
+    return collect_atom_ids(ids, static_cast<const Exists&>(formula).body());
+  } else {
+    /* Constants and binding literals have fixed values; universally
+       quantified formulas are instantiated on each evaluation. */
+    return (type == typeid(Constant) || type == typeid(Equality)
+            || type == typeid(Inequality));
+  }
 }
 
 
@@ -411,7 +481,9 @@ PlanningGraph::PlanningGraph(const Problem& problem, const Parameters& params)
    * Find all consistent action instantiations.
    */
   std::vector<const GroundAction*> actions;
+  Timer<> grounding_timer;
   problem.instantiated_actions(actions);
+  grounding_time_ = grounding_timer.ElapsedTime();
   if (verbosity > 0) {
     std::cerr << std::endl << "Instantiated actions: " << actions.size()
               << std::endl;
@@ -469,18 +541,51 @@ PlanningGraph::PlanningGraph(const Problem& problem, const Parameters& params)
   }
 
   /*
-   * Add initial conditions at level 0.
+   * Index the literals that the actions can achieve.  Literal ids are
+   * shared by all problems and keep growing, so the vectors of this
+   * planning graph are indexed by dense literal indices instead.
    */
   const GroundAction& ia = problem.init_action();
+  for (EffectList::const_iterator ei = ia.effects().begin();
+       ei != ia.effects().end(); ei++) {
+    add_literal((*ei)->literal());
+  }
+  for (TimedActionTable::const_iterator ai = problem.timed_actions().begin();
+       ai != problem.timed_actions().end(); ai++) {
+    const GroundAction& action = *(*ai).second;
+    for (EffectList::const_iterator ei = action.effects().begin();
+         ei != action.effects().end(); ei++) {
+      add_literal((*ei)->literal());
+    }
+  }
+  for (std::vector<const GroundAction*>::const_iterator ai = actions.begin();
+       ai != actions.end(); ai++) {
+    const GroundAction& action = **ai;
+    for (EffectList::const_iterator ei = action.effects().begin();
+         ei != action.effects().end(); ei++) {
+      add_literal((*ei)->literal());
+    }
+  }
+  size_t num_literals = literal_indices_.size();
+  atom_values_.assign(num_literals, HeuristicValue::INFINITE);
+  negation_values_.assign(num_literals, HeuristicValue::INFINITE);
+  atoms_.assign(num_literals, NULL);
+  achievers_.resize(num_literals);
+
+  /*
+   * Add initial conditions at level 0.
+   */
   for (EffectList::const_iterator ei = ia.effects().begin();
        ei != ia.effects().end(); ei++) {
     const Atom& atom = dynamic_cast<const Atom&>((*ei)->literal());
-    achievers_[&atom].insert(std::make_pair(&ia, *ei));
+    achievers(atom).insert(std::make_pair(&ia, *ei));
+    if (!find_value(atom_values_, atom).infinite()) {
+      continue;
+    }
     if (PredicateTable::static_predicate(atom.predicate())) {
-      atom_values_.insert(std::make_pair(&atom, HeuristicValue::ZERO));
+      set_value(atom_values_, atom, HeuristicValue::ZERO);
     } else {
-      atom_values_.insert(std::make_pair(&atom,
-                                         HeuristicValue::ZERO_COST_UNIT_WORK));
+      set_value(atom_values_, atom, HeuristicValue::ZERO_COST_UNIT_WORK);
     }
   }
   for (TimedActionTable::const_iterator ai = problem.timed_actions().begin();
@@ -490,7 +595,7 @@ PlanningGraph::PlanningGraph(const Problem& problem, const Parameters& params)
     for (EffectList::const_iterator ei = action.effects().begin();
          ei != action.effects().end(); ei++) {
       const Literal& literal = (*ei)->literal();
-      achievers_[&literal].insert(std::make_pair(&action, *ei));
+      achievers(literal).insert(std::make_pair(&action, *ei));
       float d = (params.action_cost == Parameters::UNIT_COST) ? 1.0f : time;
       std::map<const Literal*, float>::const_iterator di =
         duration_factor.find(&literal);
@@ -499,26 +604,68 @@ PlanningGraph::PlanningGraph(const Problem& problem, const Parameters& params)
       }
       const Atom* atom = dynamic_cast<const Atom*>(&literal);
       if (atom != NULL) {
-        if (atom_values_.find(atom) == atom_values_.end()) {
-          atom_values_.insert(std::make_pair(atom,
-                                             HeuristicValue(d, 1, time)));
+        if (find_value(atom_values_, *atom).infinite()) {
+          set_value(atom_values_, *atom, HeuristicValue(d, 1, time));
         }
       } else {
         const Negation& negation = dynamic_cast<const Negation&>(literal);
-        if (negation_values_.find(&negation.atom()) == negation_values_.end()
+        if (find_value(negation_values_, negation.atom()).infinite()
             && heuristic_value(negation.atom(), 0).zero()) {
-          negation_values_.insert(std::make_pair(&negation.atom(),
-                                                 HeuristicValue(d, 1, time)));
+          set_value(negation_values_, negation.atom(),
+                    HeuristicValue(d, 1, time));
         }
       }
     }
   }
 
+  /*
+   * Record, for each atom, the actions whose precondition or effect
+   * conditions depend on the value of the atom or its negation.  An
+   * action only needs to be reconsidered at a level if one of these
+   * values changed at the previous level; otherwise it would achieve
+   * exactly what it achieved before.  Actions with conditions that
+   * cannot be analyzed are reconsidered at every level.
+   */
+  std::vector<std::vector<size_t> > dependent_actions(num_literals);
+  std::vector<size_t> unanalyzed_actions;
+  std::vector<size_t> ids;
+  for (size_t i = 0; i < actions.size(); i++) {
+    const GroundAction& action = *actions[i];
+    ids.clear();
+    bool analyzed = collect_atom_ids(ids, action.condition());
+    for (EffectList::const_iterator ei = action.effects().begin();
+         analyzed && ei != action.effects().end(); ei++) {
+      analyzed = collect_atom_ids(ids, (*ei)->condition());
+    }
+    if (!analyzed) {
+      unanalyzed_actions.push_back(i);
+      continue;
+    }
+    for (std::vector<size_t>::const_iterator ii = ids.begin();
+         ii != ids.end(); ii++) {
+      /* Atoms without an index never change value. */
+      LiteralIndexMap::const_iterator li = literal_indices_.find(*ii);
+      if (li != literal_indices_.end()) {
+        dependent_actions[(*li).second].push_back(i);
+      }
+    }
+  }
+
   /*
    * Generate the rest of the levels until no change occurs.
    */
   bool changed;
   int level = 0;
+  /* Actions to consider at the current level, in order of index. */
+  std::vector<size_t> active_actions(actions.size());
+  for (size_t i = 0; i < actions.size(); i++) {
+    active_actions[i] = i;
+  }
+  /* Indices of atoms whose value or negated value changed at this
+     level. */
+  std::vector<size_t> changed_atoms;
+  /* Whether an action has been scheduled for the next level. */
+  std::vector<bool> scheduled(actions.size(), false);
   /*
    * Keep track of both applicable and useful actions.  When planning
    * with durative actions, it is possible that there are useful
@@ -534,18 +681,7 @@ PlanningGraph::PlanningGraph(const Problem& problem, const Parameters& params)
        * Print literal values at this level.
        */
       std::cerr << "Literal values at level " << level << ":" << std::endl;
-      for (AtomValueMap::const_iterator vi = atom_values_.begin();
-           vi != atom_values_.end(); vi++) {
-        std::cerr << "  ";
-        (*vi).first->print(std::cerr, 0, Bindings::EMPTY);
-        std::cerr << " -- " << (*vi).second << std::endl;
-      }
-      for (AtomValueMap::const_iterator vi = negation_values_.begin();
-           vi != negation_values_.end(); vi++) {
-        std::cerr << "  (not ";
-        (*vi).first->print(std::cerr, 0, Bindings::EMPTY);
-        std::cerr << ") -- " << (*vi).second << std::endl;
-      }
+      print_values(std::cerr);
     }
     level++;
     changed = false;
@@ -554,11 +690,12 @@ PlanningGraph::PlanningGraph(const Problem& problem, const Parameters& params)
      * Find applicable actions at current level and add effects to the
      * next level.
      */
-    AtomValueMap new_atom_values;
-    AtomValueMap new_negation_values;
-    for (std::vector<const GroundAction*>::const_iterator ai = actions.begin();
-         ai != actions.end(); ai++) {
-      const GroundAction& action = **ai;
+    AtomValueVector new_atom_values(atom_values_);
+    AtomValueVector new_negation_values(negation_values_);
+    changed_atoms.clear();
+    for (std::vector<size_t>::const_iterator ai = active_actions.begin();
+         ai != active_actions.end(); ai++) {
+      const GroundAction& action = *actions[*ai];
       HeuristicValue pre_value;
       HeuristicValue start_value;
       action.condition().heuristic_value(pre_value, start_value, *this, 0);
@@ -608,7 +745,7 @@ PlanningGraph::PlanningGraph(const Problem& problem, const Parameters& params)
             cond_value.increase_cost(d);
             if (!find(achievers_, literal, action, effect)) {
               if (!pre_value.infinite()) {
-                achievers_[&literal].insert(std::make_pair(&action, &effect));
+                achievers(literal).insert(std::make_pair(&action, &effect));
               }
               if (useful_actions.find(&action) == useful_actions.end()) {
                 useful_actions.insert(&action);
@@ -625,56 +762,51 @@ PlanningGraph::PlanningGraph(const Problem& problem, const Parameters& params)
             }
             const Atom* atom = dynamic_cast<const Atom*>(&literal);
             if (atom != NULL) {
-              AtomValueMap::const_iterator vi = new_atom_values.find(atom);
-              if (vi == new_atom_values.end()) {
-                vi = atom_values_.find(atom);
-                if (vi == atom_values_.end()) {
-                  /* First level this atom is achieved. */
-                  HeuristicValue new_value = cond_value;
-                  new_value.increment_work();
-                  new_atom_values.insert(std::make_pair(atom, new_value));
-                  changed = true;
-                  continue;
-                }
+              HeuristicValue old_value = find_value(new_atom_values, *atom);
+              if (old_value.infinite()) {
+                /* First level this atom is achieved. */
+                HeuristicValue new_value = cond_value;
+                new_value.increment_work();
+                set_value(new_atom_values, *atom, new_value);
+                changed_atoms.push_back(literal_index(*atom));
+                changed = true;
+                continue;
               }
               /* This atom has been achieved earlier. */
-              HeuristicValue old_value = (*vi).second;
               HeuristicValue new_value = cond_value;
               new_value.increment_work();
               new_value = min(new_value, old_value);
               if (new_value != old_value) {
-                new_atom_values[atom] = new_value;
+                set_value(new_atom_values, *atom, new_value);
+                changed_atoms.push_back(literal_index(*atom));
                 changed = true;
               }
             } else {
               const Negation& negation =
                 dynamic_cast<const Negation&>(literal);
-              AtomValueMap::const_iterator vi =
-                new_negation_values.find(&negation.atom());
-              if (vi == new_negation_values.end()) {
-                vi = negation_values_.find(&negation.atom());
-                if (vi == negation_values_.end()) {
-                  if (heuristic_value(negation.atom(), 0).zero()) {
-                    /* First level this negated atom is achieved. */
-                    HeuristicValue new_value = cond_value;
-                    new_value.increment_work();
-                    new_negation_values.insert(std::make_pair(&negation.atom(),
-                                                              new_value));
-                    changed = true;
-                    continue;
-                  } else {
-                    /* Closed world assumption. */
-                    continue;
-                  }
+              HeuristicValue old_value =
+                find_value(new_negation_values, negation.atom());
+              if (old_value.infinite()) {
+                if (heuristic_value(negation.atom(), 0).zero()) {
+                  /* First level this negated atom is achieved. */
+                  HeuristicValue new_value = cond_value;
+                  new_value.increment_work();
+                  set_value(new_negation_values, negation.atom(), new_value);
+                  changed_atoms.push_back(literal_index(negation.atom()));
+                  changed = true;
+                  continue;
+                } else {
+                  /* Closed world assumption. */
+                  continue;
                 }
               }
               /* This negated atom has been achieved earlier. */
-              HeuristicValue old_value = (*vi).second;
               HeuristicValue new_value = cond_value;
               new_value.increment_work();
               new_value = min(new_value, old_value);
               if (new_value != old_value) {
-                new_negation_values[&negation.atom()] = new_value;
+                set_value(new_negation_values, negation.atom(), new_value);
+                changed_atoms.push_back(literal_index(negation.atom()));
                 changed = true;
               }
             }
@@ -684,38 +816,40 @@ PlanningGraph::PlanningGraph(const Problem& problem, const Parameters& params)
     }
 
     /*
-     * Add achieved atoms to previously achieved atoms.
+     * Replace previously achieved atoms and negated atoms with the
+     * ones achieved at this level.
      */
-    for (AtomValueMap::const_iterator vi = new_atom_values.begin();
-         vi != new_atom_values.end(); vi++) {
-      atom_values_[(*vi).first] = (*vi).second;
-    }
+    atom_values_.swap(new_atom_values);
+    negation_values_.swap(new_negation_values);
+
     /*
-     * Add achieved negated atoms to previously achieved negated atoms.
+     * Schedule the actions that depend on a changed value for the
+     * next level.
      */
-    for (AtomValueMap::const_iterator vi = new_negation_values.begin();
-         vi != new_negation_values.end(); vi++) {
-      negation_values_[(*vi).first] = (*vi).second;
+    active_actions = unanalyzed_actions;
+    for (std::vector<size_t>::const_iterator ii = changed_atoms.begin();
+         ii != changed_atoms.end(); ii++) {
+      const std::vector<size_t>& dependents = dependent_actions[*ii];
+      for (std::vector<size_t>::const_iterator di = dependents.begin();
+           di != dependents.end(); di++) {
+        if (!scheduled[*di]) {
+          scheduled[*di] = true;
+          active_actions.push_back(*di);
+        }
+      }
     }
+    for (std::vector<size_t>::const_iterator ai = active_actions.begin();
+         ai != active_actions.end(); ai++) {
+      scheduled[*ai] = false;
+    }
+    std::sort(active_actions.begin(), active_actions.end());
   } while (changed);
 
   /*
-   * Map predicates to achievable ground atoms.
+   * Map predicates to achievable ground atoms and negated ground atoms.
    */
-  for (AtomValueMap::const_iterator vi = atom_values_.begin();
-       vi != atom_values_.end(); vi++) {
-    const Atom& atom = *(*vi).first;
-    predicate_atoms_.insert(std::make_pair(atom.predicate(), &atom));
-  }
-
-  /*
-   * Map predicates to achievable negated ground atoms.
-   */
-  for (AtomValueMap::const_iterator vi = negation_values_.begin();
-       vi != negation_values_.end(); vi++) {
-    const Atom& atom = *(*vi).first;
-    predicate_negations_.insert(std::make_pair(atom.predicate(), &atom));
-  }
+  index_atoms(predicate_atoms_, atom_values_);
+  index_atoms(predicate_negations_, negation_values_);
 
   /*
    * Collect actions that are both applicable and useful.  Create
@@ -760,6 +894,8 @@ PlanningGraph::PlanningGraph(const Problem& problem, const Parameters& params)
        ai != actions.end(); ai++) {
     if (useful_actions.find(*ai) == useful_actions.end()) {
       delete *ai;
+    } else {
+      useful_actions_.push_back(*ai);
     }
   }
 
@@ -777,18 +913,7 @@ PlanningGraph::PlanningGraph(const Problem& problem, const Parameters& params)
      * Print literal values.
      */
     std::cerr << "Achievable literals:" << std::endl;
-    for (AtomValueMap::const_iterator vi = atom_values_.begin();
-         vi != atom_values_.end(); vi++) {
-      std::cerr << "  ";
-      (*vi).first->print(std::cerr, 0, Bindings::EMPTY);
-      std::cerr << " -- " << (*vi).second << std::endl;
-    }
-    for (AtomValueMap::const_iterator vi = negation_values_.begin();
-         vi != negation_values_.end(); vi++) {
-      std::cerr << "  (not ";
-      (*vi).first->print(std::cerr, 0, Bindings::EMPTY);
-      std::cerr << ") -- " << (*vi).second << std::endl;
-    }
+    print_values(std::cerr);
   }
 }
 
@@ -799,18 +924,11 @@ PlanningGraph::~PlanningGraph() {
        di != action_domains_.end(); di++) {
     ActionDomain::unregister_use((*di).second);
   }
-  GroundActionSet useful_actions;
-  for (LiteralAchieverMap::const_iterator lai = achievers_.begin();
-       lai != achievers_.end(); lai++) {
-    for (ActionEffectMap::const_iterator aei = (*lai).second.begin();
-         aei != (*lai).second.end(); aei++) {
-      if ((*aei).first->name().substr(0, 1) != "<") {
-        useful_actions.insert(dynamic_cast<const GroundAction*>((*aei).first));
-      }
-    }
-  }
-  for (GroundActionSet::const_iterator ai = useful_actions.begin();
-       ai != useful_actions.end(); ai++) {
+  /* The problem may already have been deleted, so its actions must
+     not be touched here. */
+  for (std::vector<const GroundAction*>::const_iterator ai =
+           useful_actions_.begin();
+       ai != useful_actions_.end(); ai++) {
     delete *ai;
   }
 }
@@ -821,18 +939,18 @@ HeuristicValue PlanningGraph::heuristic_value(const Atom& atom, size_t step_id,
                                               const Bindings* bindings) const {
   if (bindings == NULL) {
     /* Assume ground atom. */
-    AtomValueMap::const_iterator vi = atom_values_.find(&atom);
-    return ((vi != atom_values_.end())
-            ? (*vi).second : HeuristicValue::INFINITE);
+    return find_value(atom_values_, atom);
   } else {
     /* Take minimum value of ground atoms that unify. */
     HeuristicValue value = HeuristicValue::INFINITE;
-    std::pair<PredicateAtomsMap::const_iterator,
-      PredicateAtomsMap::const_iterator> bounds =
-      predicate_atoms_.equal_range(atom.predicate());
-    for (PredicateAtomsMap::const_iterator gi = bounds.first;
-         gi != bounds.second; gi++) {
-      const Atom& a = *(*gi).second;
+    const AtomList* atoms =
+      candidate_atoms(predicate_atoms_, atom, step_id, *bindings);
+    if (atoms == NULL) {
+      return value;
+    }
+    for (AtomList::const_iterator gi = atoms->begin();
+         gi != atoms->end(); gi++) {
+      const Atom& a = **gi;
       if (bindings->unify(atom, step_id, a, 0)) {
         HeuristicValue v = heuristic_value(a, 0);
         value = min(value, v);
@@ -852,12 +970,12 @@ HeuristicValue PlanningGraph::heuristic_value(const Negation& negation,
                                               const Bindings* bindings) const {
   if (bindings == NULL) {
     /* Assume ground negated atom. */
-    AtomValueMap::const_iterator vi = negation_values_.find(&negation.atom());
-    if (vi != negation_values_.end()) {
-      return (*vi).second;
+    const HeuristicValue& value =
+      find_value(negation_values_, negation.atom());
+    if (!value.infinite()) {
+      return value;
     } else {
-      vi = atom_values_.find(&negation.atom());
-      return ((vi == atom_values_.end() || !(*vi).second.zero())
+      return (!find_value(atom_values_, negation.atom()).zero()
               ? HeuristicValue::ZERO_COST_UNIT_WORK
               : HeuristicValue::INFINITE);
     }
@@ -868,12 +986,14 @@ HeuristicValue PlanningGraph::heuristic_value(const Negation& negation,
       return HeuristicValue::ZERO;
     }
     HeuristicValue value = HeuristicValue::INFINITE;
-    std::pair<PredicateAtomsMap::const_iterator,
-      PredicateAtomsMap::const_iterator> bounds =
-      predicate_negations_.equal_range(negation.predicate());
-    for (PredicateAtomsMap::const_iterator gi = bounds.first;
-         gi != bounds.second; gi++) {
-      const Atom& a = *(*gi).second;
+    const AtomList* atoms =
+      candidate_atoms(predicate_negations_, atom, step_id, *bindings);
+    if (atoms == NULL) {
+      return value;
+    }
+    for (AtomList::const_iterator gi = atoms->begin();
+         gi != atoms->end(); gi++) {
+      const Atom& a = **gi;
       if (bindings->unify(atom, step_id, a, 0)) {
         HeuristicValue v = heuristic_value(a, 0);
         value = min(value, v);
@@ -890,8 +1010,9 @@ HeuristicValue PlanningGraph::heuristic_value(const Negation& negation,
 /* Returns a set of achievers for the given literal. */
 const ActionEffectMap*
 PlanningGraph::literal_achievers(const Literal& literal) const {
-  LiteralAchieverMap::const_iterator lai = achievers_.find(&literal);
-  return (lai != achievers_.end()) ? & (*lai).second : NULL;
+  size_t i = literal_index(literal);
+  return ((i < achievers_.size() && !achievers_[i].empty())
+          ? &achievers_[i] : NULL);
 }
 
 
@@ -904,14 +1025,173 @@ PlanningGraph::action_domain(const std::string& name) const {
 }
 
 
-/* Finds an element in a LiteralActionsMap. */
-bool PlanningGraph::find(const PlanningGraph::LiteralAchieverMap& m,
+/* Gives the given literal an index, unless it already has one. */
+void PlanningGraph::add_literal(const Literal& literal) {
+  literal_indices_.insert(std::make_pair(literal.id(),
+                                         literal_indices_.size()));
+  const Negation* negation = dynamic_cast<const Negation*>(&literal);
+  if (negation != NULL) {
+    add_literal(negation->atom());
+  }
+}
+
+
+/* Returns the index of the given literal, or the number of indexed
+   literals if the literal has no index. */
+size_t PlanningGraph::literal_index(const Literal& literal) const {
+  LiteralIndexMap::const_iterator li = literal_indices_.find(literal.id());
+  return ((li != literal_indices_.end())
+          ? (*li).second : literal_indices_.size());
+}
+
+
+/* Returns the value of the given atom in the given vector. */
+const HeuristicValue&
+PlanningGraph::find_value(const AtomValueVector& values,
+                          const Atom& atom) const {
+  size_t i = literal_index(atom);
+  return (i < values.size()) ? values[i] : HeuristicValue::INFINITE;
+}
+
+
+/* Sets the value of the given atom in the given vector. */
+void PlanningGraph::set_value(AtomValueVector& values, const Atom& atom,
+                              const HeuristicValue& value) {
+  size_t i = literal_index(atom);
+  values[i] = value;
+  atoms_[i] = &atom;
+}
+
+
+/* Returns the achievers of the given literal. */
+ActionEffectMap& PlanningGraph::achievers(const Literal& literal) {
+  return achievers_[literal_index(literal)];
+}
+
+
+/* Prints the values of achieved literals on the given stream. */
+void PlanningGraph::print_values(std::ostream& os) const {
+  for (AtomVector::const_iterator ai = atoms_.begin(); ai != atoms_.end();
+       ai++) {
+    if (*ai != NULL && !find_value(atom_values_, **ai).infinite()) {
+      os << "  ";
+      (*ai)->print(os, 0, Bindings::EMPTY);
+      os << " -- " << find_value(atom_values_, **ai) << std::endl;
+    }
+  }
+  for (AtomVector::const_iterator ai = atoms_.begin(); ai != atoms_.end();
+       ai++) {
+    if (*ai != NULL && !find_value(negation_values_, **ai).infinite()) {
+      os << "  (not ";
+      (*ai)->print(os, 0, Bindings::EMPTY);
+      os << ") -- " << find_value(negation_values_, **ai) << std::endl;
+    }
+  }
+}
+
+
+/*
+ * Less-than function object ordering ground atoms by increasing
+ * heuristic value.
+ */
+struct AtomValueLess {
+  /* Constructs a function object for the given values, indexed by
+     the given literal indices. */
+  AtomValueLess(const std::vector<HeuristicValue>& values,
+                const std::unordered_map<size_t, size_t>& indices)
+    : values_(&values), indices_(&indices) {}
+
+  /* Comparison function operator. */
+  bool operator()(const Atom* a1, const Atom* a2) const {
+    const HeuristicValue& v1 =
+      (*values_)[(*indices_->find(a1->id())).second];
+    const HeuristicValue& v2 =
+      (*values_)[(*indices_->find(a2->id())).second];
+    if (v1.add_cost() != v2.add_cost()) {
+      return v1.add_cost() < v2.add_cost();
+    } else if (v1.add_work() != v2.add_work()) {
+      return v1.add_work() < v2.add_work();
+    } else if (v1.makespan() != v2.makespan()) {
+      return v1.makespan() < v2.makespan();
+    } else {
+      return a1->id() < a2->id();
+    }
+  }
+
+private:
+  /* Heuristic values, indexed by literal index. */
+  const std::vector<HeuristicValue>* values_;
+  /* Maps literal ids to literal indices. */
+  const std::unordered_map<size_t, size_t>* indices_;
+};
+
+
+/* Fills the given map with an index of the ground atoms that have a
+   finite value in the given vector. */
+void PlanningGraph::index_atoms(PredicateAtomsMap& index,
+                                const AtomValueVector& values) const {
+  for (AtomVector::const_iterator ai = atoms_.begin(); ai != atoms_.end();
+       ai++) {
+    const Atom* atom = *ai;
+    if (atom != NULL && !find_value(values, *atom).infinite()) {
+      index[atom->predicate()].atoms.push_back(atom);
+    }
+  }
+  for (PredicateAtomsMap::iterator pi = index.begin(); pi != index.end();
+       pi++) {
+    AtomIndex& atom_index = (*pi).second;
+    std::sort(atom_index.atoms.begin(), atom_index.atoms.end(),
+              AtomValueLess(values, literal_indices_));
+    size_t arity = atom_index.atoms.front()->arity();
+    atom_index.arguments.resize(arity);
+    for (AtomList::const_iterator ai = atom_index.atoms.begin();
+         ai != atom_index.atoms.end(); ai++) {
+      for (size_t i = 0; i < arity; i++) {
+        atom_index.arguments[i][(*ai)->term(i)].push_back(*ai);
+      }
+    }
+  }
+}
+
+
+/* Returns the ground atoms in the given map that can possibly unify
+   with the given atom, or NULL if no ground atom can. */
+const PlanningGraph::AtomList*
+PlanningGraph::candidate_atoms(const PredicateAtomsMap& index,
+                               const Atom& atom, size_t step_id,
+                               const Bindings& bindings) {
+  PredicateAtomsMap::const_iterator pi = index.find(atom.predicate());
+  if (pi == index.end()) {
+    return NULL;
+  }
+  const AtomIndex& atom_index = (*pi).second;
+  /* Use the shortest list of ground atoms that agree with the atom on
+     an argument already bound to an object. */
+  const AtomList* atoms = &atom_index.atoms;
+  for (size_t i = 0; i < atom_index.arguments.size(); i++) {
+    Term term = bindings.binding(atom.term(i), step_id);
+    if (term.object()) {
+      std::map<Term, AtomList>::const_iterator ai =
+        atom_index.arguments[i].find(term);
+      if (ai == atom_index.arguments[i].end()) {
+        return NULL;
+      } else if ((*ai).second.size() < atoms->size()) {
+        atoms = &(*ai).second;
+      }
+    }
+  }
+  return atoms;
+}
+
+
+/* Finds an element in a LiteralAchieverVector. */
+bool PlanningGraph::find(const PlanningGraph::LiteralAchieverVector& m,
                          const Literal &l, const Action& a,
                          const Effect& e) const {
-  LiteralAchieverMap::const_iterator lai = m.find(&l);
-  if (lai != m.end()) {
+  size_t i = literal_index(l);
+  if (i < m.size()) {
     std::pair<ActionEffectMap::const_iterator,
-      ActionEffectMap::const_iterator> bounds = (*lai).second.equal_range(&a);
+      ActionEffectMap::const_iterator> bounds = m[i].equal_range(&a);
     for (ActionEffectMap::const_iterator i = bounds.first;
          i != bounds.second; i++) {
       if ((*i).second == &e) {
@@ -1048,12 +1328,11 @@ void Heuristic::plan_rank(std::vector<float>& rank, const Plan& plan,
     case ADD_WORK:
       if (!add_done) {
         add_done = true;
-        for (const Chain<OpenCondition>* occ = plan.open_conds();
-             occ != NULL; occ = occ->tail) {
-          const OpenCondition& open_cond = occ->head;
+        for (FlawSet<OpenCondition>::const_iterator oci(plan.open_conds());
+             oci != FlawSet<OpenCondition>::end(); ++oci) {
+          const OpenCondition& open_cond = *oci;
           HeuristicValue v, vs;
-          formula_value(v, vs, open_cond.condition(), open_cond.step_id(),
-                        plan, *planning_graph);
+          open_cond_value(v, vs, open_cond, plan, *planning_graph);
           add_cost += v.add_cost();
           add_work = sum(add_work, v.add_work());
         }
@@ -1083,12 +1362,11 @@ void Heuristic::plan_rank(std::vector<float>& rank, const Plan& plan,
     case ADDR_WORK:
       if (!addr_done) {
         addr_done = true;
-        for (const Chain<OpenCondition>* occ = plan.open_conds();
-             occ != NULL; occ = occ->tail) {
-          const OpenCondition& open_cond = occ->head;
+        for (FlawSet<OpenCondition>::const_iterator oci(plan.open_conds());
+             oci != FlawSet<OpenCondition>::end(); ++oci) {
+          const OpenCondition& open_cond = *oci;
           HeuristicValue v, vs;
-          formula_value(v, vs, open_cond.condition(), open_cond.step_id(),
-                        plan, *planning_graph, true);
+          open_cond_value(v, vs, open_cond, plan, *planning_graph, true);
           addr_cost += v.add_cost();
           addr_work = sum(addr_work, v.add_work());
         }
@@ -1115,12 +1393,11 @@ void Heuristic::plan_rank(std::vector<float>& rank, const Plan& plan,
       break;
     case MAKESPAN:
       std::map<std::pair<size_t, StepTime::StepPoint>, float> min_times;
-      for (const Chain<OpenCondition>* occ = plan.open_conds();
-           occ != NULL; occ = occ->tail) {
-        const OpenCondition& open_cond = occ->head;
+      for (FlawSet<OpenCondition>::const_iterator oci(plan.open_conds());
+           oci != FlawSet<OpenCondition>::end(); ++oci) {
+        const OpenCondition& open_cond = *oci;
         HeuristicValue v, vs;
-        formula_value(v, vs, open_cond.condition(), open_cond.step_id(),
-                      plan, *planning_graph);
+        open_cond_value(v, vs, open_cond, plan, *planning_graph);
         std::map<std::pair<size_t, StepTime::StepPoint>, float>::iterator di =
           min_times.find(std::make_pair(open_cond.step_id(), StepTime::START));
         if (di != min_times.end()) {
@@ -1627,9 +1904,10 @@ int FlawSelectionOrder::select_unsafe(FlawSelection& selection,
     return std::numeric_limits<int>::max();
   }
   /* Loop through usafes. */
-  for (const Chain<Unsafe>* uc = plan.unsafes();
-       uc != NULL && first_criterion <= last_criterion; uc = uc->tail) {
-    const Unsafe& unsafe = uc->head;
+  for (FlawSet<Unsafe>::const_iterator ui(plan.unsafes());
+       ui != FlawSet<Unsafe>::end() && first_criterion <= last_criterion;
+       ++ui) {
+    const Unsafe& unsafe = *ui;
     if (verbosity > 1) {
       std::cerr << "(considering ";
       unsafe.print(std::cerr, Bindings::EMPTY);
@@ -1761,9 +2039,10 @@ int FlawSelectionOrder::select_open_cond(FlawSelection& selection,
   }
   size_t local_id = 0;
   /* Loop through open conditions. */
-  for (const Chain<OpenCondition>* occ = plan.open_conds();
-       occ != NULL && first_criterion <= last_criterion; occ = occ->tail) {
-    const OpenCondition& open_cond = occ->head;
+  for (FlawSet<OpenCondition>::const_iterator oci(plan.open_conds());
+       oci != FlawSet<OpenCondition>::end()
+         && first_criterion <= last_criterion; ++oci) {
+    const OpenCondition& open_cond = *oci;
     if (verbosity > 1) {
       std::cerr << "(considering ";
       open_cond.print(std::cerr, Bindings::EMPTY);
@@ -1943,8 +2222,7 @@ int FlawSelectionOrder::select_open_cond(FlawSelection& selection,
           case SelectionCriterion::LC:
             {
               HeuristicValue h, hs;
-              formula_value(h, hs, open_cond.condition(), open_cond.step_id(),
-                            plan, *pg, criterion.reuse);
+              open_cond_value(h, hs, open_cond, plan, *pg, criterion.reuse);
               float rank = ((criterion.heuristic == SelectionCriterion::ADD)
                             ? h.add_cost() : h.makespan());
               if (c < selection.criterion || rank < selection.rank) {
@@ -1964,8 +2242,7 @@ int FlawSelectionOrder::select_open_cond(FlawSelection& selection,
           case SelectionCriterion::MC:
             {
               HeuristicValue h, hs;
-              formula_value(h, hs, open_cond.condition(), open_cond.step_id(),
-                            plan, *pg, criterion.reuse);
+              open_cond_value(h, hs, open_cond, plan, *pg, criterion.reuse);
               float rank = ((criterion.heuristic == SelectionCriterion::ADD)
                             ? h.add_cost() : h.makespan() + 0.5);
               if (c < selection.criterion || rank > selection.rank) {
@@ -1985,8 +2262,7 @@ int FlawSelectionOrder::select_open_cond(FlawSelection& selection,
           case SelectionCriterion::LW:
             {
               HeuristicValue h, hs;
-              formula_value(h, hs, open_cond.condition(), open_cond.step_id(),
-                            plan, *pg, criterion.reuse);
+              open_cond_value(h, hs, open_cond, plan, *pg, criterion.reuse);
               int rank = h.add_work();
               if (c < selection.criterion || rank < selection.rank) {
                 selection.flaw = &open_cond;
@@ -2005,8 +2281,7 @@ int FlawSelectionOrder::select_open_cond(FlawSelection& selection,
           case SelectionCriterion::MW:
             {
               HeuristicValue h, hs;
-              formula_value(h, hs, open_cond.condition(), open_cond.step_id(),
-                            plan, *pg, criterion.reuse);
+              open_cond_value(h, hs, open_cond, plan, *pg, criterion.reuse);
               int rank = h.add_work();
               if (c < selection.criterion || rank > selection.rank) {
                 selection.flaw = &open_cond;
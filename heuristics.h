@@ -22,7 +22,10 @@
 #ifndef HEURISTICS_H
 #define HEURISTICS_H
 
+#include <chrono>
 #include <stdexcept>
+#include <unordered_map>
+#include <vector>
 
 #include "domains.h"
 #include "formulas.h"
@@ -42,10 +45,21 @@ struct Parameters;
 /* ====================================================================== */
 /* ActionEffectMap */
 
+/*
+ * Less than function object for action pointers.
+ */
+struct ActionPtrLess {
+  /* Comparison function operator. */
+  bool operator()(const Action* a1, const Action* a2) const {
+    return a1->id() < a2->id();
+  }
+};
+
 /*
  * Mapping from actions to effects.
  */
-struct ActionEffectMap : public std::multimap<const Action*, const Effect*> {
+struct ActionEffectMap
+  : public std::multimap<const Action*, const Effect*, ActionPtrLess> {
 };
 
 
@@ -149,6 +163,10 @@ struct PlanningGraph {
   /* Returns the problem associated with this planning graph. */
   const Problem& problem() const { return *problem_; }
 
+  /* Returns the time spent instantiating actions for this planning
+     graph. */
+  std::chrono::nanoseconds grounding_time() const { return grounding_time_; }
+
   /* Returns the heurisitc value of an atom. */
   HeuristicValue heuristic_value(const Atom& atom, size_t step_id,
                                  const Bindings* bindings = NULL) const;
@@ -165,17 +183,37 @@ struct PlanningGraph {
   const ActionDomain* action_domain(const std::string& name) const;
 
 private:
-  /* Atom value map. */
-  struct AtomValueMap : public std::map<const Atom*, HeuristicValue> {
+  /* Mapping of literal ids to literal indices. */
+  struct LiteralIndexMap : public std::unordered_map<size_t, size_t> {
+  };
+
+  /* Heuristic values of ground atoms, indexed by literal index. */
+  struct AtomValueVector : public std::vector<HeuristicValue> {
+  };
+
+  /* Ground atoms, indexed by literal index. */
+  struct AtomVector : public std::vector<const Atom*> {
+  };
+
+  /* Actions achieving ground literals, indexed by literal index. */
+  struct LiteralAchieverVector : public std::vector<ActionEffectMap> {
   };
 
-  /* Mapping of literals to actions. */
-  struct LiteralAchieverMap
-    : public std::map<const Literal*, ActionEffectMap> {
+  /* List of ground atoms. */
+  struct AtomList : public std::vector<const Atom*> {
   };
 
-  /* Mapping of predicate names to ground atoms. */
-  struct PredicateAtomsMap : public std::multimap<Predicate, const Atom*> {
+  /* Index of the ground atoms of a predicate. */
+  struct AtomIndex {
+    /* All ground atoms, in order of increasing heuristic value. */
+    AtomList atoms;
+    /* For each argument position, maps objects to the ground atoms
+       with that object at the position, in the same order. */
+    std::vector<std::map<Term, AtomList> > arguments;
+  };
+
+  /* Mapping of predicate names to indexed ground atoms. */
+  struct PredicateAtomsMap : public std::map<Predicate, AtomIndex> {
   };
 
   /* Mapping of action name to parameter domain. */
@@ -184,21 +222,63 @@ private:
 
   /* Problem associated with this planning graph. */
   const Problem* problem_;
-  /* Atom values. */
-  AtomValueMap atom_values_;
-  /* Negated atom values. */
-  AtomValueMap negation_values_;
-  /* Maps formulas to actions that achieve those formulas. */
-  LiteralAchieverMap achievers_;
+  /* Time spent instantiating actions. */
+  std::chrono::nanoseconds grounding_time_;
+  /* Maps the ids of the literals that actions of this planning graph
+     can achieve, and of the atoms they negate, to dense indices. */
+  LiteralIndexMap literal_indices_;
+  /* Atom values (infinite for atoms not yet achieved). */
+  AtomValueVector atom_values_;
+  /* Negated atom values (infinite for negated atoms not yet achieved). */
+  AtomValueVector negation_values_;
+  /* Atoms that have been given a value or a negated value. */
+  AtomVector atoms_;
+  /* Maps literals to actions that achieve those literals. */
+  LiteralAchieverVector achievers_;
   /* Maps predicates to ground atoms. */
   PredicateAtomsMap predicate_atoms_;
   /* Maps predicates to negated ground atoms. */
   PredicateAtomsMap predicate_negations_;
   /* Maps action names to possible parameter lists. */
   ActionDomainMap action_domains_;
+  /* Instantiated actions kept by this planning graph; the initial and
+     timed actions belong to the problem. */
+  std::vector<const GroundAction*> useful_actions_;
+
+  /* Gives the given literal an index, unless it already has one. */
+  void add_literal(const Literal& literal);
+
+  /* Returns the index of the given literal, or the number of indexed
+     literals if the literal has no index. */
+  size_t literal_index(const Literal& literal) const;
+
+  /* Returns the value of the given atom in the given vector. */
+  const HeuristicValue& find_value(const AtomValueVector& values,
+                                   const Atom& atom) const;
+
+  /* Sets the value of the given atom in the given vector. */
+  void set_value(AtomValueVector& values, const Atom& atom,
+                 const HeuristicValue& value);
+
+  /* Returns the achievers of the given literal. */
+  ActionEffectMap& achievers(const Literal& literal);
+
+  /* Prints the values of achieved literals on the given stream. */
+  void print_values(std::ostream& os) const;
+
+  /* Fills the given map with an index of the ground atoms that have
+     a finite value in the given vector. */
+  void index_atoms(PredicateAtomsMap& index,
+                   const AtomValueVector& values) const;
+
+  /* Returns the ground atoms in the given map that can possibly unify
+     with the given atom, or NULL if no ground atom can. */
+  static const AtomList* candidate_atoms(const PredicateAtomsMap& index,
+                                         const Atom& atom, size_t step_id,
+                                         const Bindings& bindings);
 
-  /* Finds an element in a LiteralActionsMap. */
-  bool find(const LiteralAchieverMap& m, const Literal& l,
+  /* Finds an element in a LiteralAchieverVector. */
+  bool find(const LiteralAchieverVector& m, const Literal& l,
             const Action& a, const Effect& e) const;
 };
 
@@ -20,6 +20,8 @@
 #include "orderings.h"
 
 #include <limits.h>
+#include <stdint.h>
+#include <algorithm>
 #include <limits>
 
 #include "debug.h"
@@ -100,42 +102,54 @@ StepTime start_time(FormulaTime ft) {
 
 
 /* ====================================================================== */
-/* BoolVector */
+/* BitVector */
 
 /*
- * A collectible bool vector.
+ * A collectible vector of bits packed into 64-bit words.
  */
-struct BoolVector : public std::vector<bool> {
+struct BitVector : public std::vector<uint64_t> {
   /* Register use of the given vector. */
-  static void register_use(const BoolVector* v) {
+  static void register_use(const BitVector* v) {
     if (v != NULL) {
-      v->ref_count_++;
+      Threads::Increment(v->ref_count_);
     }
   }
 
   /* Unregister use of the given vector. */
-  static void unregister_use(const BoolVector* v) {
+  static void unregister_use(const BitVector* v) {
     if (v != NULL) {
-      v->ref_count_--;
-      if (v->ref_count_ == 0) {
+      if (Threads::Decrement(v->ref_count_) == 0) {
         delete v;
       }
     }
   }
 
-  /* Constructs a vector with n copies of b. */
-  BoolVector(size_t n, bool b)
-    : std::vector<bool>(n, b), ref_count_(0) {
+  /* Returns the number of words needed to hold n bits. */
+  static size_t words(size_t n) { return (n + 63)/64; }
+
+  /* Constructs a vector with n cleared words. */
+  explicit BitVector(size_t n)
+    : std::vector<uint64_t>(n, 0), ref_count_(0) {
   }
 
-  /* Constructs a copy of the given vector. */
-  BoolVector(const BoolVector& v)
-    : std::vector<bool>(v), ref_count_(0) {
+  /* Constructs a copy of the given vector with n words. */
+  BitVector(const BitVector& v, size_t n)
+    : std::vector<uint64_t>(n, 0), ref_count_(0) {
+    std::copy(v.begin(), v.begin() + std::min(n, v.size()), begin());
   }
 
+  /* Checks if the given bit is set. */
+  bool test(size_t i) const {
+    size_t w = i/64;
+    return w < size() && ((*this)[w] >> (i%64)) & 1;
+  }
+
+  /* Sets the given bit. */
+  void set(size_t i) { (*this)[i/64] |= uint64_t(1) << (i%64); }
+
 private:
   /* Reference counter. */
-  mutable size_t ref_count_;
+  mutable std::atomic<size_t> ref_count_;
 };
 
 
@@ -149,15 +163,14 @@ struct IntVector : public std::vector<int> {
   /* Register use of the given vector. */
   static void register_use(const IntVector* v) {
     if (v != NULL) {
-      v->ref_count_++;
+      Threads::Increment(v->ref_count_);
     }
   }
 
   /* Unregister use of the given vector. */
   static void unregister_use(const IntVector* v) {
     if (v != NULL) {
-      v->ref_count_--;
-      if (v->ref_count_ == 0) {
+      if (Threads::Decrement(v->ref_count_) == 0) {
         delete v;
       }
     }
@@ -173,9 +186,12 @@ struct IntVector : public std::vector<int> {
     : std::vector<int>(v), ref_count_(0) {
   }
 
+  /* Checks if more than one object uses this vector. */
+  bool shared() const { return ref_count_ > 1; }
+
 private:
   /* Reference counter. */
-  mutable size_t ref_count_;
+  mutable std::atomic<size_t> ref_count_;
 };
 
 
@@ -215,7 +231,11 @@ std::ostream& operator<<(std::ostream& os, const Orderings& o) {
 
 
 /* Constructs an empty ordering collection. */
-BinaryOrderings::BinaryOrderings() {}
+BinaryOrderings::BinaryOrderings() {
+  BitVector* bv = new BitVector(BitVector::words(1));
+  before_.push_back(bv);
+  BitVector::register_use(bv);
+}
 
 
 /* Constructs a copy of this ordering collection. */
@@ -223,7 +243,7 @@ BinaryOrderings::BinaryOrderings(const BinaryOrderings& o)
   : Orderings(o), before_(o.before_) {
   size_t n = before_.size();
   for (size_t i = 0; i < n; i++) {
-    BoolVector::register_use(before_[i]);
+    BitVector::register_use(before_[i]);
   }
 }
 
@@ -232,7 +252,7 @@ BinaryOrderings::BinaryOrderings(const BinaryOrderings& o)
 BinaryOrderings::~BinaryOrderings() {
   size_t n = before_.size();
   for (size_t i = 0; i < n; i++) {
-    BoolVector::unregister_use(before_[i]);
+    BitVector::unregister_use(before_[i]);
   }
 }
 
@@ -306,8 +326,8 @@ BinaryOrderings::refine(const Ordering& new_ordering) const {
                              new_ordering.after_id(),
                              new_ordering.after_time())) {
     BinaryOrderings& orderings = *new BinaryOrderings(*this);
-    std::map<size_t, BoolVector*> own_data;
-    orderings.fill_transitive(own_data, new_ordering);
+    std::vector<bool> own_rows(orderings.before_.size(), false);
+    orderings.fill_transitive(own_rows, new_ordering);
     return &orderings;
   } else {
     return this;
@@ -322,18 +342,16 @@ BinaryOrderings::refine(const Ordering& new_ordering,
                         const Bindings* bindings) const {
   if (new_step.id() != 0 && new_step.id() != Plan::GOAL_ID) {
     BinaryOrderings& orderings = *new BinaryOrderings(*this);
-    std::map<size_t, BoolVector*> own_data;
-    if (new_step.id() > before_.size() + 1) {
-      if (new_step.id() > 1) {
-        BoolVector* bv = new BoolVector(2*new_step.id() - 2, false);
-        own_data.insert(std::make_pair(orderings.before_.size(), bv));
-        orderings.before_.push_back(bv);
-        BoolVector::register_use(bv);
-      }
+    std::vector<bool> own_rows(orderings.before_.size(), false);
+    if (new_step.id() > before_.size()) {
+      BitVector* bv = new BitVector(BitVector::words(new_step.id()));
+      orderings.before_.push_back(bv);
+      BitVector::register_use(bv);
+      own_rows.push_back(true);
     }
     if (new_ordering.before_id() != 0
         && new_ordering.after_id() != Plan::GOAL_ID) {
-      orderings.fill_transitive(own_data, new_ordering);
+      orderings.fill_transitive(own_rows, new_ordering);
     }
     return &orderings;
   } else {
@@ -347,7 +365,7 @@ BinaryOrderings::refine(const Ordering& new_ordering,
 float BinaryOrderings::schedule(std::map<size_t, float>& start_times,
                                 std::map<size_t, float>& end_times) const {
   float max_dist = 0.0f;
-  size_t n = before_.size() + 1;
+  size_t n = before_.size();
   for (size_t i = 1; i <= n; i++) {
     float ed = schedule(start_times, end_times, i);
     if (ed > max_dist) {
@@ -364,7 +382,7 @@ BinaryOrderings::makespan(const std::map<std::pair<size_t,
                           StepTime::StepPoint>, float>& min_times) const {
   std::map<size_t, float> start_times, end_times;
   float max_dist = 0.0f;
-  size_t n = before_.size() + 1;
+  size_t n = before_.size();
   for (size_t i = 1; i <= n; i++) {
     float ed = schedule(start_times, end_times, i, min_times);
     if (ed > max_dist) {
@@ -391,7 +409,7 @@ float BinaryOrderings::schedule(std::map<size_t, float>& start_times,
     return (*d).second;
   } else {
     float sd = 1.0f;
-    size_t n = before_.size() + 1;
+    size_t n = before_.size();
     for (size_t j = 1; j <= n; j++) {
       if (step_id != j && before(j, step_id)) {
         float ed = 1.0f + schedule(start_times, end_times, j);
@@ -418,7 +436,7 @@ BinaryOrderings::schedule(std::map<size_t, float>& start_times,
     return (*d).second;
   } else {
     float sd = threshold;
-    size_t n = before_.size() + 1;
+    size_t n = before_.size();
     for (size_t j = 1; j <= n; j++) {
       if (step_id != j && before(j, step_id)) {
         float ed = threshold + schedule(start_times, end_times, j, min_times);
@@ -446,45 +464,28 @@ BinaryOrderings::schedule(std::map<size_t, float>& start_times,
 
 /* Returns true iff the first step is ordered before the second step. */
 bool BinaryOrderings::before(size_t id1, size_t id2) const {
-  if (id1 == id2) {
-    return false;
-  } else if (id1 < id2) {
-    return (*before_[id2 - 2])[id1 - 1];
-  } else {
-    return (*before_[id1 - 2])[2*id1 - 2 - id2];
-  }
+  return id1 <= before_.size() && before_[id1 - 1]->test(id2 - 1);
 }
 
 
-/* Orders the first step before the second step. */
-void
-BinaryOrderings::set_before(std::map<size_t, BoolVector*>& own_data,
-                            size_t id1, size_t id2) {
-  if (id1 != id2) {
-    size_t i = std::max(id1, id2) - 2;
-    BoolVector* bv;
-    std::map<size_t, BoolVector*>::const_iterator vi = own_data.find(i);
-    if (vi != own_data.end()) {
-      bv = (*vi).second;
-    } else {
-      const BoolVector* old_bv = before_[i];
-      bv = new BoolVector(*old_bv);
-      BoolVector::register_use(bv);
-      BoolVector::unregister_use(old_bv);
-      before_[i] = bv;
-      own_data.insert(std::make_pair(i, bv));
-    }
-    if (id1 < id2) {
-      (*bv)[id1 - 1] = true;
-    } else {
-      (*bv)[2*id1 - 2 - id2] = true;
-    }
+/* Returns the successors of the given step, copying them first
+   unless they are already owned by this ordering collection. */
+BitVector& BinaryOrderings::own_row(std::vector<bool>& own_rows, size_t id) {
+  if (own_rows[id - 1]) {
+    return *const_cast<BitVector*>(before_[id - 1]);
   }
+  const BitVector* old_bv = before_[id - 1];
+  BitVector* bv = new BitVector(*old_bv, BitVector::words(before_.size()));
+  BitVector::register_use(bv);
+  BitVector::unregister_use(old_bv);
+  before_[id - 1] = bv;
+  own_rows[id - 1] = true;
+  return *bv;
 }
 
 
 /* Updates the transitive closure given a new ordering constraint. */
-void BinaryOrderings::fill_transitive(std::map<size_t, BoolVector*>& own_data,
+void BinaryOrderings::fill_transitive(std::vector<bool>& own_rows,
                                       const Ordering& ordering) {
   size_t i = ordering.before_id();
   size_t j = ordering.after_id();
@@ -493,13 +494,14 @@ void BinaryOrderings::fill_transitive(std::map<size_t, BoolVector*>& own_data,
      * All steps ordered before i (and i itself) must be ordered
      * before j and all steps ordered after j.
      */
-    size_t n = before_.size() + 1;
+    size_t n = before_.size();
+    BitVector after_j(*before_[j - 1], BitVector::words(n));
+    after_j.set(j - 1);
     for (size_t k = 1; k <= n; k++) {
-      if ((k == i || before(k, i)) && !before(k, j)) {
-        for (size_t l = 1; l <= n; l++) {
-          if ((j == l || before(j, l)) && !before(k, l)) {
-            set_before(own_data, k, l);
-          }
+      if (k != j && (k == i || before(k, i)) && !before(k, j)) {
+        BitVector& row = own_row(own_rows, k);
+        for (size_t w = 0; w < row.size(); w++) {
+          row[w] |= after_j[w];
         }
       }
     }
@@ -510,7 +512,7 @@ void BinaryOrderings::fill_transitive(std::map<size_t, BoolVector*>& own_data,
 /* Prints this ordering collection on the given stream. */
 void BinaryOrderings::print(std::ostream& os) const {
   os << "{";
-  size_t n = before_.size() + 1;
+  size_t n = before_.size();
   for (size_t i = 1; i <= n; i++) {
     for (size_t j = 1; j <= n; j++) {
       if (before(i, j)) {
@@ -522,6 +524,30 @@ void BinaryOrderings::print(std::ostream& os) const {
 }
 
 
+/* Prints this object on the given stream with each step id i
+   replaced by step_ids[i], in a form that does not depend on the
+   order in which the ordering constraints were added. */
+void BinaryOrderings::print_canonical(std::ostream& os,
+                                      const std::vector<size_t>& step_ids)
+  const {
+  std::vector<std::pair<size_t, size_t> > pairs;
+  size_t n = before_.size();
+  for (size_t i = 1; i <= n; i++) {
+    for (size_t j = 1; j <= n; j++) {
+      if (before(i, j)) {
+        pairs.push_back(std::make_pair(step_ids[i], step_ids[j]));
+      }
+    }
+  }
+  std::sort(pairs.begin(), pairs.end());
+  os << "{";
+  for (size_t k = 0; k < pairs.size(); k++) {
+    os << ' ' << pairs[k].first << '<' << pairs[k].second;
+  }
+  os << " }";
+}
+
+
 /* ====================================================================== */
 /* TemporalOrderings */
 
@@ -653,9 +679,8 @@ const TemporalOrderings* TemporalOrderings::refine(size_t step_id,
       return NULL;
     } else {
       TemporalOrderings& orderings = *new TemporalOrderings(*this);
-      std::map<size_t, IntVector*> own_data;
-      if (orderings.fill_transitive(own_data, 0, i, start)
-          && orderings.fill_transitive(own_data, 0, j, end)) {
+      if (orderings.fill_transitive(0, i, start)
+          && orderings.fill_transitive(0, j, end)) {
         return &orderings;
       } else {
         delete &orderings;
@@ -717,7 +742,6 @@ TemporalOrderings::refine(const Ordering& new_ordering) const {
                              new_ordering.after_id(),
                              new_ordering.after_time())) {
     TemporalOrderings& orderings = *new TemporalOrderings(*this);
-    std::map<size_t, IntVector*> own_data;
     size_t i = time_node(new_ordering.before_id(), new_ordering.before_time());
     size_t j = time_node(new_ordering.after_id(), new_ordering.after_time());
     int dist;
@@ -726,7 +750,7 @@ TemporalOrderings::refine(const Ordering& new_ordering) const {
     } else {
       dist = 1;
     }
-    if (orderings.fill_transitive(own_data, i, j, dist)) {
+    if (orderings.fill_transitive(i, j, dist)) {
       return &orderings;
     } else {
       delete &orderings;
@@ -745,7 +769,6 @@ TemporalOrderings::refine(const Ordering& new_ordering,
                           const Bindings* bindings) const {
   if (new_step.id() != 0 && new_step.id() != Plan::GOAL_ID) {
     TemporalOrderings& orderings = *new TemporalOrderings(*this);
-    std::map<size_t, IntVector*> own_data;
     if (new_step.id() > distance_.size()/2) {
       const Value* min_v =
         dynamic_cast<const Value*>(&new_step.action().min_duration());
@@ -776,7 +799,6 @@ TemporalOrderings::refine(const Ordering& new_ordering,
       IntVector* fv = new IntVector(4*new_step.id() - 2, std::numeric_limits<int>::max());
       /* Earliest time for start of new step. */
       (*fv)[4*new_step.id() - 3] = -int(start_time/threshold + 0.5);
-      own_data.insert(std::make_pair(orderings.distance_.size(), fv));
       orderings.distance_.push_back(fv);
       IntVector::register_use(fv);
       fv = new IntVector(4*new_step.id(), std::numeric_limits<int>::max());
@@ -786,7 +808,6 @@ TemporalOrderings::refine(const Ordering& new_ordering,
         (*fv)[2*new_step.id() - 1] = int(max_v->value()/threshold + 0.5);
       }
       (*fv)[2*new_step.id()] = -int(min_v->value()/threshold + 0.5);
-      own_data.insert(std::make_pair(orderings.distance_.size(), fv));
       orderings.distance_.push_back(fv);
       IntVector::register_use(fv);
     }
@@ -802,7 +823,7 @@ TemporalOrderings::refine(const Ordering& new_ordering,
         } else {
           dist = 1;
         }
-        if (orderings.fill_transitive(own_data, i, j, dist)) {
+        if (orderings.fill_transitive(i, j, dist)) {
           return &orderings;
         } else {
           delete &orderings;
@@ -872,22 +893,18 @@ int TemporalOrderings::distance(size_t t1, size_t t2) const {
 }
 
 
-/* Sets the maximum distance from the first and the second time node. */
-void TemporalOrderings::set_distance(std::map<size_t, IntVector*>& own_data,
-                                     size_t t1, size_t t2, int d) {
+/* Sets the maximum distance from the first and the second time
+   node, copying the row holding the distance first if it is shared
+   with another ordering collection. */
+void TemporalOrderings::set_distance(size_t t1, size_t t2, int d) {
   if (t1 != t2) {
     size_t i = std::max(t1, t2) - 1;
-    IntVector* fv;
-    std::map<size_t, IntVector*>::const_iterator vi = own_data.find(i);
-    if (vi != own_data.end()) {
-      fv = (*vi).second;
-    } else {
-      const IntVector* old_fv = distance_[i];
-      fv = new IntVector(*old_fv);
+    IntVector* fv = distance_[i];
+    if (fv->shared()) {
+      fv = new IntVector(*fv);
       IntVector::register_use(fv);
-      IntVector::unregister_use(old_fv);
+      IntVector::unregister_use(distance_[i]);
       distance_[i] = fv;
-      own_data.insert(std::make_pair(i, fv));
     }
     if (t1 < t2) {
       (*fv)[t1] = d;
@@ -899,27 +916,48 @@ void TemporalOrderings::set_distance(std::map<size_t, IntVector*>& own_data,
 
 
 /* Updates the transitive closure given a new ordering constraint. */
-bool
-TemporalOrderings::fill_transitive(std::map<size_t, IntVector*>& own_data,
-                                   size_t i, size_t j, int dist) {
+bool TemporalOrderings::fill_transitive(size_t i, size_t j, int dist) {
   if (distance(j, i) > -dist) {
     /*
      * Update the temporal constraints.
      *
-     * Make sure that -d_ij <= d_ji always holds.
+     * Make sure that -d_ij <= d_ji always holds.  Only distances
+     * from time nodes whose distance to i decreases, to time nodes
+     * whose distance from j decreases, need to be updated.
      */
+    const int inf = std::numeric_limits<int>::max();
     size_t n = distance_.size();
+    /* Time nodes whose distance from j decreases, with their distance
+       from i. */
+    std::vector<std::pair<size_t, int> > after;
     for (size_t k = 0; k <= n; k++) {
       int d_ik = distance(i, k);
-      if (d_ik < std::numeric_limits<int>::max() && distance(j, k) > d_ik - dist) {
-        for (size_t l = 0; l <= n; l++) {
-          int d_lj = distance(l, j);
-          int new_d = d_ik + d_lj - dist;
-          if (d_lj < std::numeric_limits<int>::max() && distance(l, k) > new_d) {
-            set_distance(own_data, l, k, new_d);
-            if (-distance(k, l) > new_d) {
-              return false;
-            }
+      if (d_ik < inf && distance(j, k) > d_ik - dist) {
+        after.push_back(std::make_pair(k, d_ik));
+      }
+    }
+    if (after.empty()) {
+      return true;
+    }
+    /* Time nodes whose distance to i decreases, with their distance
+       to j. */
+    std::vector<std::pair<size_t, int> > before;
+    for (size_t l = 0; l <= n; l++) {
+      int d_lj = distance(l, j);
+      if (d_lj < inf && distance(l, i) > d_lj - dist) {
+        before.push_back(std::make_pair(l, d_lj));
+      }
+    }
+    for (size_t a = 0; a < after.size(); a++) {
+      size_t k = after[a].first;
+      int d_ik = after[a].second;
+      for (size_t b = 0; b < before.size(); b++) {
+        size_t l = before[b].first;
+        int new_d = d_ik + before[b].second - dist;
+        if (distance(l, k) > new_d) {
+          set_distance(l, k, new_d);
+          if (-distance(k, l) > new_d) {
+            return false;
           }
         }
       }
@@ -945,3 +983,35 @@ void TemporalOrderings::print(std::ostream& os) const {
     }
   }
 }
+
+
+/* Prints this object on the given stream with each step id i
+   replaced by step_ids[i], in a form that does not depend on the
+   order in which the ordering constraints were added. */
+void TemporalOrderings::print_canonical(std::ostream& os,
+                                        const std::vector<size_t>& step_ids)
+  const {
+  size_t n = distance_.size();
+  std::vector<size_t> nodes(n + 1, 0);
+  for (size_t t = 1; t <= n; t++) {
+    nodes[t] = time_node(step_ids[(t + 1)/2],
+                         (t % 2 == 1) ? StepTime::AT_START : StepTime::AT_END);
+  }
+  std::vector<int> distances((n + 1)*(n + 1));
+  for (size_t r = 0; r <= n; r++) {
+    for (size_t c = 0; c <= n; c++) {
+      distances[nodes[r]*(n + 1) + nodes[c]] = distance(r, c);
+    }
+  }
+  for (size_t k = 0; k < distances.size(); k++) {
+    os << distances[k] << ' ';
+  }
+  std::vector<size_t> achievers;
+  for (const Chain<size_t>* gc = goal_achievers_; gc != NULL; gc = gc->tail) {
+    achievers.push_back(step_ids[gc->head]);
+  }
+  std::sort(achievers.begin(), achievers.end());
+  for (size_t k = 0; k < achievers.size(); k++) {
+    os << '>' << achievers[k];
+  }
+}
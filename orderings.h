@@ -22,12 +22,15 @@
 #ifndef ORDERINGS_H
 #define ORDERINGS_H
 
+#include <atomic>
 #include <map>
 #include <vector>
 
 #include "chain.h"
 #include "formulas.h"
 
+#include "src/threads.h"
+
 struct Effect;
 struct Step;
 
@@ -130,15 +133,14 @@ struct Orderings {
   /* Register use of this object. */
   static void register_use(const Orderings* o) {
     if (o != NULL) {
-      o->ref_count_++;
+      Threads::Increment(o->ref_count_);
     }
   }
 
   /* Unregister use of this object. */
   static void unregister_use(const Orderings* o) {
     if (o != NULL) {
-      o->ref_count_--;
-      if (o->ref_count_ == 0) {
+      if (Threads::Decrement(o->ref_count_) == 0) {
         delete o;
       }
     }
@@ -187,6 +189,12 @@ struct Orderings {
   virtual float makespan(const std::map<std::pair<size_t,
                          StepTime::StepPoint>, float>& min_times) const = 0;
 
+  /* Prints this object on the given stream with each step id i
+     replaced by step_ids[i], in a form that does not depend on the
+     order in which the ordering constraints were added. */
+  virtual void print_canonical(std::ostream& os,
+                               const std::vector<size_t>& step_ids) const = 0;
+
 protected:
   /* Constructs an empty ordering collection. */
   Orderings();
@@ -199,7 +207,7 @@ protected:
 
 private:
   /* Reference counter. */
-  mutable size_t ref_count_;
+  mutable std::atomic<size_t> ref_count_;
 
   friend std::ostream& operator<<(std::ostream& os, const Orderings& o);
 };
@@ -211,7 +219,7 @@ std::ostream& operator<<(std::ostream& os, const Orderings& o);
 /* ====================================================================== */
 /* BinaryOrderings */
 
-struct BoolVector;
+struct BitVector;
 
 /*
  * Collection of binary ordering constraints.
@@ -263,14 +271,21 @@ struct BinaryOrderings : public Orderings {
   virtual float makespan(const std::map<std::pair<size_t,
                          StepTime::StepPoint>, float>& min_times) const;
 
+  /* Prints this object on the given stream with each step id i
+     replaced by step_ids[i], in a form that does not depend on the
+     order in which the ordering constraints were added. */
+  virtual void print_canonical(std::ostream& os,
+                               const std::vector<size_t>& step_ids) const;
+
 protected:
   /* Prints this object on the given stream. */
   virtual void print(std::ostream& os) const;
 
 private:
   /* Matrix representing the transitive closure of the ordering
-     constraints. */
-  std::vector<const BoolVector*> before_;
+     constraints, with a row of successors for each step.  Rows are
+     shared between ordering collections until modified. */
+  std::vector<const BitVector*> before_;
 
   /* Constructs a copy of this ordering collection. */
   BinaryOrderings(const BinaryOrderings& o);
@@ -288,12 +303,12 @@ private:
   /* Returns true iff the first step is ordered before the second step. */
   bool before(size_t id1, size_t id2) const;
 
-  /* Orders the first step before the second step. */
-  void set_before(std::map<size_t, BoolVector*>& own_data,
-                  size_t id1, size_t id2);
+  /* Returns the successors of the given step, copying them first
+     unless they are already owned by this ordering collection. */
+  BitVector& own_row(std::vector<bool>& own_rows, size_t id);
 
   /* Updates the transitive closure given a new ordering constraint. */
-  void fill_transitive(std::map<size_t, BoolVector*>& own_data,
+  void fill_transitive(std::vector<bool>& own_rows,
                        const Ordering& ordering);
 };
 
@@ -360,13 +375,22 @@ struct TemporalOrderings : public Orderings {
   virtual float makespan(const std::map<std::pair<size_t,
                          StepTime::StepPoint>, float>& min_times) const;
 
+  /* Prints this object on the given stream with each step id i
+     replaced by step_ids[i], in a form that does not depend on the
+     order in which the ordering constraints were added. */
+  virtual void print_canonical(std::ostream& os,
+                               const std::vector<size_t>& step_ids) const;
+
 protected:
   /* Prints this opbject on the given stream. */
   virtual void print(std::ostream& os) const;
 
 private:
-  /* Matrix representing the minimal network for the ordering constraints. */
-  std::vector<const IntVector*> distance_;
+  /* Matrix representing the minimal network for the ordering
+     constraints.  Row t holds the distances between time node t + 1
+     and the time nodes before it, and rows are shared between
+     ordering collections until they are modified. */
+  std::vector<IntVector*> distance_;
   /* Steps that are linked to the goal. */
   const Chain<size_t>* goal_achievers_;
 
@@ -381,13 +405,13 @@ private:
   /* Returns the maximum distance from the first and the second time node. */
   int distance(size_t t1, size_t t2) const;
 
-  /* Sets the maximum distance from the first and the second time node. */
-  void set_distance(std::map<size_t, IntVector*>& own_data,
-                    size_t t1, size_t t2, int d);
+  /* Sets the maximum distance from the first and the second time
+     node, copying the row holding the distance first if it is shared
+     with another ordering collection. */
+  void set_distance(size_t t1, size_t t2, int d);
 
   /* Updates the transitive closure given a new ordering constraint. */
-  bool fill_transitive(std::map<size_t, IntVector*>& own_data,
-                       size_t i, size_t j, int dist);
+  bool fill_transitive(size_t i, size_t j, int dist);
 };
 
 
@@ -38,6 +38,14 @@ InvalidActionCost::InvalidActionCost(const std::string& name)
   : std::runtime_error("invalid action cost `" + name + "'") {}
 
 
+/* ====================================================================== */
+/* InvalidStatisticsFormat */
+
+/* Constructs an invalid statistics format exception. */
+InvalidStatisticsFormat::InvalidStatisticsFormat(const std::string& name)
+  : std::runtime_error("invalid statistics format `" + name + "'") {}
+
+
 /* ====================================================================== */
 /* Parameters */
 
@@ -51,7 +59,14 @@ Parameters::Parameters()
       random_open_conditions(false),
       ground_actions(false),
       domain_constraints(false),
-      keep_static_preconditions(true) {
+      keep_static_preconditions(true),
+      detect_duplicates(false),
+      lazy_refinements(false),
+      memory_limit(std::numeric_limits<size_t>::max()),
+      portfolio(false),
+      search_threads(1),
+      anytime(false),
+      statistics_format(NO_STATISTICS) {
   flaw_orders.push_back(FlawSelectionOrder("UCPOP")),
   search_limits.push_back(std::numeric_limits<unsigned int>::max());
 }
@@ -62,6 +77,20 @@ bool Parameters::strip_static_preconditions() const {
 }
 
 
+/* Whether to spill pending plans to disk when over the memory limit. */
+bool Parameters::spill_plans() const {
+  return memory_limit != std::numeric_limits<size_t>::max();
+}
+
+
+/* Whether to distribute the search over several threads. */
+bool Parameters::parallel_search() const {
+  return (search_threads > 1 && flaw_orders.size() == 1
+          && search_algorithm != IDA_STAR && !spill_plans()
+          && !lazy_refinements);
+}
+
+
 /* Selects a search algorithm from a name. */
 void Parameters::set_search_algorithm(const std::string& name) {
   const char* n = name.c_str();
@@ -92,3 +121,16 @@ void Parameters::set_action_cost(const std::string& name) {
     throw InvalidActionCost(name);
   }
 }
+
+
+/* Selects a statistics format from a name. */
+void Parameters::set_statistics_format(const std::string& name) {
+  const char* n = name.c_str();
+  if (strcasecmp(n, "JSON") == 0) {
+    statistics_format = JSON;
+  } else if (strcasecmp(n, "CSV") == 0) {
+    statistics_format = CSV;
+  } else {
+    throw InvalidStatisticsFormat(name);
+  }
+}
@@ -53,6 +53,18 @@ struct InvalidActionCost : public std::runtime_error {
 };
 
 
+/* ====================================================================== */
+/* InvalidStatisticsFormat */
+
+/*
+ * An invalid statistics format exception.
+ */
+struct InvalidStatisticsFormat : public std::runtime_error {
+  /* Constructs an invalid statistics format exception. */
+  InvalidStatisticsFormat(const std::string& name);
+};
+
+
 /* ====================================================================== */
 /* Parameters */
 
@@ -64,6 +76,8 @@ struct Parameters {
   typedef enum { A_STAR, IDA_STAR, HILL_CLIMBING, GBFS } SearchAlgorithm;
   /* Valid action costs. */
   typedef enum { UNIT_COST, DURATION, RELATIVE } ActionCost;
+  /* Valid formats for machine-readable statistics. */
+  typedef enum { NO_STATISTICS, JSON, CSV } StatisticsFormat;
 
   /* Time limit. */
   std::chrono::nanoseconds time_limit;
@@ -87,6 +101,24 @@ struct Parameters {
   bool domain_constraints;
   /* Whether to keep static preconditions when using domain constraints. */
   bool keep_static_preconditions;
+  /* Whether to discard plans that have already been generated. */
+  bool detect_duplicates;
+  /* Whether to build the refinements of a plan one at a time, when
+     they are dequeued. */
+  bool lazy_refinements;
+  /* Memory limit in megabytes, beyond which pending plans are spilled
+     to disk. */
+  size_t memory_limit;
+  /* Whether to search with each flaw selection order in its own thread. */
+  bool portfolio;
+  /* Number of threads sharing the search with a single flaw selection
+     order. */
+  size_t search_threads;
+  /* Whether to keep searching for cheaper plans after the first
+     complete plan is found. */
+  bool anytime;
+  /* Format of machine-readable statistics, if any. */
+  StatisticsFormat statistics_format;
 
   /* Constructs default planning parameters. */
   Parameters();
@@ -94,11 +126,23 @@ struct Parameters {
   /* Whether to strip static preconditions. */
   bool strip_static_preconditions() const;
 
+  /* Whether to spill pending plans to disk when over the memory limit. */
+  bool spill_plans() const;
+
+  /* Whether to distribute the search over several threads. */
+  bool parallel_search() const;
+
   /* Selects a search algorithm from a name. */
   void set_search_algorithm(const std::string& name);
 
   /* Selects an action cost from a name. */
   void set_action_cost(const std::string& name);
+
+  /* Selects a statistics format from a name. */
+  void set_statistics_format(const std::string& name);
+
+  /* Whether to collect phase timings during planning. */
+  bool timing() const { return statistics_format != NO_STATISTICS; }
 };
 
 
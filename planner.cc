@@ -0,0 +1,296 @@
+// Copyright (C) 2002--2005 Carnegie Mellon University
+// Copyright (C) 2019 Google Inc
+//
+// This file is part of VHPOP.
+//
+// VHPOP is free software; you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// VHPOP is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+// or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+// License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with VHPOP; if not, write to the Free Software Foundation,
+// Inc., #59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+#include "planner.h"
+
+#include <algorithm>
+#include <cerrno>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <iostream>
+#include <limits>
+#include <map>
+#include <mutex>
+#include <shared_mutex>
+#include <sstream>
+#include <stdexcept>
+
+#include "actions.h"
+#include "bindings.h"
+#include "debug.h"
+#include "domains.h"
+#include "parameters.h"
+#include "plans.h"
+#include "problems.h"
+
+#include "src/threads.h"
+
+/* The parse function. */
+extern int yyparse();
+/* File to parse. */
+extern FILE* yyin;
+/* Discards any buffered input and starts scanning the given file. */
+extern void yyrestart(FILE* file);
+
+/* Name of current file. */
+std::string current_file;
+/* Level of warnings. */
+int warning_level = 1;
+/* Verbosity level. */
+int verbosity = 0;
+
+/* Held exclusively while parsing or clearing, and shared while
+   planning. */
+static std::shared_mutex planner_mutex;
+
+
+/* Parses the given file, naming it with the given name in error
+   messages, and closes it.  Returns true on success. */
+static bool parse(FILE* file, const std::string& name) {
+  yyin = file;
+  current_file = name;
+  yyrestart(yyin);
+  bool success = (yyparse() == 0);
+  fclose(yyin);
+  return success;
+}
+
+
+/* Returns the value of the given flag option. */
+static bool flag_value(const std::string& name, const std::string& value) {
+  if (value.empty() || value == "1") {
+    return true;
+  } else if (value == "0") {
+    return false;
+  }
+  throw std::runtime_error("invalid value `" + value + "' for option `"
+                           + name + "'");
+}
+
+
+/* Returns the value of the given numeric option. */
+static double number_value(const std::string& name,
+                           const std::string& value) {
+  char* end;
+  double x = strtod(value.c_str(), &end);
+  if (value.empty() || *end != '\0' || x < 0) {
+    throw std::runtime_error("invalid value `" + value + "' for option `"
+                             + name + "'");
+  }
+  return x;
+}
+
+
+/* ====================================================================== */
+/* Planner */
+
+/* Parses domains and problems from the given file. */
+bool Planner::parse_file(const std::string& name) {
+  std::unique_lock<std::shared_mutex> lock(planner_mutex);
+  FILE* file = fopen(name.c_str(), "r");
+  if (file == NULL) {
+    std::cerr << PACKAGE << ':' << name << ": " << strerror(errno)
+              << std::endl;
+    return false;
+  }
+  return parse(file, name);
+}
+
+
+/* Parses domains and problems from the given text. */
+bool Planner::parse_text(const std::string& text, const std::string& name) {
+  if (text.empty()) {
+    return true;
+  }
+  std::unique_lock<std::shared_mutex> lock(planner_mutex);
+  FILE* file = fmemopen(const_cast<char*>(text.data()), text.size(), "r");
+  if (file == NULL) {
+    std::cerr << PACKAGE ": " << strerror(errno) << std::endl;
+    return false;
+  }
+  return parse(file, name);
+}
+
+
+/* Returns the names of the problems parsed so far. */
+std::vector<std::string> Planner::problems() {
+  std::shared_lock<std::shared_mutex> lock(planner_mutex);
+  std::vector<std::string> names;
+  for (Problem::ProblemMap::const_iterator pi = Problem::begin();
+       pi != Problem::end(); pi++) {
+    names.push_back((*pi).first);
+  }
+  return names;
+}
+
+
+/* Deletes all domains and problems parsed so far. */
+void Planner::clear() {
+  std::unique_lock<std::shared_mutex> lock(planner_mutex);
+  Problem::clear();
+  Domain::clear();
+}
+
+
+/* Constructs a planner with the default parameters. */
+Planner::Planner()
+  : params_(new Parameters()), default_flaw_orders_(true),
+    default_search_limits_(true) {}
+
+
+/* Constructs a copy of the given planner. */
+Planner::Planner(const Planner& planner)
+  : params_(new Parameters(*planner.params_)),
+    default_flaw_orders_(planner.default_flaw_orders_),
+    default_search_limits_(planner.default_search_limits_) {}
+
+
+/* Deletes this planner. */
+Planner::~Planner() {
+  delete params_;
+}
+
+
+/* Sets the option with the given long command line name. */
+void Planner::set_option(const std::string& name, const std::string& value) {
+  Parameters& params = *params_;
+  if (name == "action-cost") {
+    params.set_action_cost(value);
+  } else if (name == "anytime") {
+    params.anytime = flag_value(name, value);
+  } else if (name == "detect-duplicates") {
+    params.detect_duplicates = flag_value(name, value);
+  } else if (name == "domain-constraints") {
+    params.domain_constraints = true;
+    params.keep_static_preconditions =
+      (value.empty() || number_value(name, value) != 0);
+  } else if (name == "flaw-order") {
+    FlawSelectionOrder flaw_order(value);
+    if (default_flaw_orders_) {
+      params.flaw_orders.clear();
+      default_flaw_orders_ = false;
+    }
+    params.flaw_orders.push_back(flaw_order);
+  } else if (name == "ground-actions") {
+    params.ground_actions = flag_value(name, value);
+  } else if (name == "heuristic") {
+    params.heuristic = value;
+  } else if (name == "lazy-refinements") {
+    params.lazy_refinements = flag_value(name, value);
+  } else if (name == "limit") {
+    size_t limit = ((value == "unlimited")
+                    ? std::numeric_limits<unsigned int>::max()
+                    : size_t(number_value(name, value)));
+    if (default_search_limits_) {
+      params.search_limits.clear();
+      default_search_limits_ = false;
+    }
+    params.search_limits.push_back(limit);
+  } else if (name == "memory-limit") {
+    params.memory_limit = size_t(number_value(name, value));
+  } else if (name == "parallel") {
+    params.search_threads = std::max<size_t>(number_value(name, value), 1);
+  } else if (name == "portfolio") {
+    params.portfolio = flag_value(name, value);
+  } else if (name == "random-open-conditions") {
+    params.random_open_conditions = flag_value(name, value);
+  } else if (name == "search-algorithm") {
+    params.set_search_algorithm(value);
+  } else if (name == "time-limit") {
+    params.time_limit = std::chrono::duration_cast<std::chrono::nanoseconds>(
+        std::chrono::duration<double, std::ratio<60> >(
+            number_value(name, value)));
+  } else if (name == "weight") {
+    params.weight = number_value(name, value);
+  } else {
+    throw std::runtime_error("unknown option `" + name + "'");
+  }
+}
+
+
+/* Plans for the problem with the given name. */
+PlanResult Planner::plan(const std::string& name) const {
+  std::shared_lock<std::shared_mutex> lock(planner_mutex);
+  /* Other threads may plan at the same time. */
+  Threads::Scope threads_scope;
+  const Problem* problem = Problem::find(name);
+  if (problem == NULL) {
+    throw std::runtime_error("no problem `" + name + "'");
+  }
+  if (params_->spill_plans() && params_->random_open_conditions) {
+    throw std::runtime_error("cannot use memory-limit with "
+                             "random-open-conditions");
+  }
+  if (params_->spill_plans() && params_->lazy_refinements) {
+    throw std::runtime_error("cannot use memory-limit with "
+                             "lazy-refinements");
+  }
+  /* The last search limit applies to the remaining flaw orders. */
+  Parameters params(*params_);
+  while (params.search_limits.size() < params.flaw_orders.size()) {
+    params.search_limits.push_back(params.search_limits.back());
+  }
+  PlanResult result;
+  result.makespan = 0.0f;
+  SearchStatistics stats;
+  const Plan* plan = NULL;
+  try {
+    plan = Plan::plan(*problem, params, false, stats);
+    if (plan == NULL) {
+      result.outcome = PlanResult::UNSOLVABLE;
+    } else if (!plan->complete()) {
+      result.outcome = PlanResult::LIMIT;
+    } else {
+      result.outcome = PlanResult::SOLVED;
+      std::vector<const Step*> ordered_steps;
+      std::map<size_t, float> start_times;
+      std::map<size_t, float> end_times;
+      result.makespan = plan->schedule(ordered_steps, start_times, end_times);
+      const Bindings& bindings =
+        (plan->bindings() != NULL) ? *plan->bindings() : Bindings::EMPTY;
+      for (std::vector<const Step*>::const_iterator si =
+               ordered_steps.begin();
+           si != ordered_steps.end(); si++) {
+        const Step& s = **si;
+        if (s.action().name().substr(0, 1) != "<") {
+          PlanStep step;
+          step.start_time = start_times[s.id()];
+          step.duration = (s.action().durative()
+                           ? end_times[s.id()] - start_times[s.id()] : 0.0f);
+          std::ostringstream action;
+          s.action().print(action, s.id(), bindings);
+          step.action = action.str();
+          result.steps.push_back(step);
+        }
+      }
+    }
+  } catch (...) {
+    delete plan;
+    Plan::cleanup();
+    throw;
+  }
+  delete plan;
+  Plan::cleanup();
+  result.num_generated_plans = stats.num_generated_plans;
+  result.num_visited_plans = stats.num_visited_plans;
+  result.num_dead_ends = stats.num_dead_ends;
+  result.optimal = stats.optimal;
+  return result;
+}
@@ -0,0 +1,136 @@
+// Copyright (C) 2002--2005 Carnegie Mellon University
+// Copyright (C) 2019 Google Inc
+//
+// This file is part of VHPOP.
+//
+// VHPOP is free software; you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// VHPOP is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+// or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+// License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with VHPOP; if not, write to the Free Software Foundation,
+// Inc., #59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+//
+// Interface for embedding the planner in other programs.
+
+#ifndef PLANNER_H
+#define PLANNER_H
+
+#include <cstddef>
+#include <string>
+#include <vector>
+
+struct Parameters;
+
+
+/* ====================================================================== */
+/* PlanStep */
+
+/*
+ * A scheduled step of a plan.
+ */
+struct PlanStep {
+  /* Time at which the step starts. */
+  float start_time;
+  /* Duration of the step, or zero for an action that is not durative. */
+  float duration;
+  /* The ground action of the step, e.g. "(pick ball1 rooma left)". */
+  std::string action;
+};
+
+
+/* ====================================================================== */
+/* PlanResult */
+
+/*
+ * Result of planning for a problem.
+ */
+struct PlanResult {
+  /* Possible outcomes of planning. */
+  typedef enum { SOLVED, LIMIT, UNSOLVABLE } Outcome;
+
+  /* Outcome of planning. */
+  Outcome outcome;
+  /* Makespan of the plan, if solved. */
+  float makespan;
+  /* Steps of the plan in order of start time, if solved. */
+  std::vector<PlanStep> steps;
+  /* Whether an anytime search proved the plan optimal. */
+  bool optimal;
+  /* Number of plans generated. */
+  size_t num_generated_plans;
+  /* Number of plans visited. */
+  size_t num_visited_plans;
+  /* Number of dead ends encountered. */
+  size_t num_dead_ends;
+};
+
+
+/* ====================================================================== */
+/* Planner */
+
+/*
+ * A planner for the domains and problems parsed through this
+ * interface.  Only standard library types appear in the interface, so
+ * it does not change with the internals of the planner.  Different
+ * threads can plan at the same time, with the same planner or with
+ * different ones; parsing and clearing wait until no thread is
+ * planning.
+ */
+struct Planner {
+  /* Parses domains and problems from the given file, and returns
+     true on success.  Errors are reported on standard error. */
+  static bool parse_file(const std::string& name);
+
+  /* Parses domains and problems from the given text, naming it with
+     the given name in error messages, and returns true on success. */
+  static bool parse_text(const std::string& text, const std::string& name);
+
+  /* Returns the names of the problems parsed so far. */
+  static std::vector<std::string> problems();
+
+  /* Deletes all domains and problems parsed so far. */
+  static void clear();
+
+  /* Constructs a planner with the default parameters. */
+  Planner();
+
+  /* Constructs a copy of the given planner. */
+  Planner(const Planner& planner);
+
+  /* Deletes this planner. */
+  ~Planner();
+
+  /* Sets the option with the given long command line name, e.g.
+     "heuristic" or "limit", to the given value.  Options that are
+     flags on the command line are set by an empty value or "1", and
+     cleared by "0"; other values are as on the command line.  Throws
+     std::runtime_error for an unknown option or an invalid value. */
+  void set_option(const std::string& name, const std::string& value);
+
+  /* Plans for the problem with the given name.  With the "anytime"
+     option, the cheapest plan found within the time limit is
+     returned.  Throws std::runtime_error if no such problem has been
+     parsed. */
+  PlanResult plan(const std::string& problem) const;
+
+private:
+  /* Planning parameters. */
+  Parameters* params_;
+  /* Whether the flaw selection orders are the default ones. */
+  bool default_flaw_orders_;
+  /* Whether the search limits are the default ones. */
+  bool default_search_limits_;
+
+  /* Assignment is not supported. */
+  Planner& operator=(const Planner&);
+};
+
+
+#endif /* PLANNER_H */
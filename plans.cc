@@ -20,9 +20,19 @@
 #include "plans.h"
 
 #include <algorithm>
+#include <array>
+#include <condition_variable>
+#include <cstdint>
+#include <cstdio>
+#include <exception>
+#include <fstream>
 #include <limits>
+#include <mutex>
 #include <queue>
+#include <sstream>
+#include <thread>
 #include <typeinfo>
+#include <unordered_map>
 
 #include "bindings.h"
 #include "debug.h"
@@ -36,8 +46,15 @@
 #include "terms.h"
 #include "types.h"
 
+#include "src/pool.h"
+#include "src/threads.h"
 #include "src/timer.h"
 
+#if HAVE_MALLOC_H
+#include <malloc.h>
+#endif
+#include <unistd.h>
+
 /*
  * Mapping of predicate names to achievers.
  */
@@ -45,22 +62,66 @@ struct PredicateAchieverMap : public std::map<Predicate, ActionEffectMap> {
 };
 
 
-/* Planning parameters. */
-static const Parameters* params;
-/* Domain of problem currently being solved. */
-static const Domain* domain = NULL;
-/* Problem currently being solved. */
-static const Problem* problem = NULL;
-/* Planning graph. */
-static const PlanningGraph* planning_graph;
-/* The goal action. */
-static Action* goal_action;
-/* Maps predicates to actions. */
-static PredicateAchieverMap achieves_pred;
-/* Maps negated predicates to actions. */
-static PredicateAchieverMap achieves_neg_pred;
-/* Whether last flaw was a static predicate. */
-static bool static_pred_flaw;
+/*
+ * State of the planner solving a problem, from Plan::plan until
+ * Plan::cleanup.
+ */
+struct PlannerContext {
+  /* Planning parameters. */
+  const Parameters* params;
+  /* Domain of problem being solved. */
+  const Domain* domain;
+  /* Problem being solved. */
+  const Problem* problem;
+  /* Planning graph. */
+  const PlanningGraph* planning_graph;
+  /* Whether the planning graph is deleted by Plan::cleanup. */
+  bool own_planning_graph;
+  /* The goal action. */
+  Action* goal_action;
+  /* Maps predicates to actions. */
+  PredicateAchieverMap achieves_pred;
+  /* Maps negated predicates to actions. */
+  PredicateAchieverMap achieves_neg_pred;
+  /* Receiver of improved plans in an anytime search, or NULL. */
+  PlanObserver* observer;
+  /* Mutex protecting the best plan of an anytime search. */
+  std::mutex best_mutex;
+  /* Cheapest complete plan found so far in an anytime search. */
+  const Plan* best_plan;
+  /* Cost of the best plan, or infinity if none has been found. */
+  std::atomic<float> best_cost;
+};
+
+
+/* Planner state used by the current thread; the threads of a
+   portfolio search share the state of the thread that started them. */
+static thread_local PlannerContext* context = NULL;
+/* Mutex protecting the number of active planners. */
+static std::mutex planners_mutex;
+/* Number of planners between Plan::plan and Plan::cleanup. */
+static size_t num_active_planners = 0;
+/* Number of variables that existed before the active planners
+   started; the variables added during the search are released when
+   the last active planner is cleaned up. */
+static size_t num_problem_variables = 0;
+/* Mutex serializing the construction of planning graphs, which
+   share the table of ground fluents. */
+static std::mutex planning_graph_mutex;
+/* Whether last flaw was a static predicate (in the current thread). */
+static thread_local bool static_pred_flaw;
+
+
+/* Releases the pool slabs left empty by the plans discarded after a
+   search, and returns the memory to the operating system where
+   possible. */
+static void release_search_memory() {
+  if (Pools::Trim() > 0) {
+#if HAVE_MALLOC_TRIM
+    malloc_trim(0);
+#endif
+  }
+}
 
 
 /* ====================================================================== */
@@ -89,6 +150,214 @@ Link::~Link() {
 }
 
 
+/* ====================================================================== */
+/* ThreatIndex */
+
+/* Returns the position of the given literal in a threat index. */
+static size_t literal_key(const Literal& literal) {
+  return 2*literal.predicate().index()
+    + ((typeid(literal) == typeid(Negation)) ? 1 : 0);
+}
+
+
+/*
+ * A causal link in a threat index.
+ */
+struct IndexedLink {
+  /* Constructs an indexed link. */
+  IndexedLink(const Link& link, size_t position)
+    : link(&link), position(position) {}
+
+  /* The link, owned by the chain of causal links of a plan. */
+  const Link* link;
+  /* Position of the link in the chain of causal links, counting
+     from the oldest link. */
+  size_t position;
+};
+
+
+/* Checks if the first link was added to a plan after the second. */
+static bool later_link(const IndexedLink& l1, const IndexedLink& l2) {
+  return l1.position > l2.position;
+}
+
+
+/*
+ * Persistent index from literal predicate and polarity to the steps
+ * with a matching effect and the causal links with a matching
+ * condition.  The index is shared by plans with the same steps and
+ * links, and extended for plans that add to them, so that threats
+ * are only looked for among steps and links that can interfere.
+ */
+struct ThreatIndex : public RCObject {
+  /* Returns an index of the given steps and links, extending the
+     given index if the steps and links extend the ones it covers. */
+  static const ThreatIndex* make(const ThreatIndex* base,
+                                 const Chain<Step>* steps,
+                                 const Chain<Link>* links);
+
+  /* Deletes this index. */
+  ~ThreatIndex();
+
+  /* Steps covered by this index. */
+  const Chain<Step>* steps;
+  /* Causal links covered by this index. */
+  const Chain<Link>* links;
+  /* Number of causal links covered by this index. */
+  size_t num_links;
+  /* Steps with an effect of each predicate and polarity. */
+  std::vector<const Chain<Step>*> producers;
+  /* Causal links with a condition of each predicate and polarity. */
+  std::vector<const Chain<IndexedLink>*> consumers;
+
+private:
+  /* Constructs an empty index. */
+  ThreatIndex() : steps(NULL), links(NULL), num_links(0) {}
+
+  /* Adds the given step to this index. */
+  void add_step(const Step& step);
+
+  /* Adds the given causal link to this index. */
+  void add_link(const Link& link);
+};
+
+
+/* Returns an index of the given steps and links. */
+const ThreatIndex* ThreatIndex::make(const ThreatIndex* base,
+                                     const Chain<Step>* steps,
+                                     const Chain<Link>* links) {
+  if (base != NULL && base->steps == steps && base->links == links) {
+    return base;
+  }
+  std::vector<const Step*> new_steps;
+  const Chain<Step>* sc = steps;
+  for (; sc != NULL && (base == NULL || sc != base->steps); sc = sc->tail) {
+    new_steps.push_back(&sc->head);
+  }
+  std::vector<const Link*> new_links;
+  const Chain<Link>* lc = links;
+  for (; lc != NULL && (base == NULL || lc != base->links); lc = lc->tail) {
+    new_links.push_back(&lc->head);
+  }
+  if (base != NULL && (sc != base->steps || lc != base->links)) {
+    /* The steps or links do not extend the ones covered by base. */
+    return make(NULL, steps, links);
+  }
+  ThreatIndex* index = new ThreatIndex();
+  index->steps = steps;
+  index->links = links;
+  if (base != NULL) {
+    index->num_links = base->num_links;
+    index->producers = base->producers;
+    for (size_t i = 0; i < index->producers.size(); i++) {
+      RCObject::ref(index->producers[i]);
+    }
+    index->consumers = base->consumers;
+    for (size_t i = 0; i < index->consumers.size(); i++) {
+      RCObject::ref(index->consumers[i]);
+    }
+  }
+  for (size_t i = new_steps.size(); i > 0; i--) {
+    index->add_step(*new_steps[i - 1]);
+  }
+  for (size_t i = new_links.size(); i > 0; i--) {
+    index->add_link(*new_links[i - 1]);
+  }
+  return index;
+}
+
+
+/* Deletes this index. */
+ThreatIndex::~ThreatIndex() {
+  for (size_t i = 0; i < producers.size(); i++) {
+    RCObject::destructive_deref(producers[i]);
+  }
+  for (size_t i = 0; i < consumers.size(); i++) {
+    RCObject::destructive_deref(consumers[i]);
+  }
+}
+
+
+/* Adds the given step to this index. */
+void ThreatIndex::add_step(const Step& step) {
+  const EffectList& effects = step.action().effects();
+  for (EffectList::const_iterator ei = effects.begin();
+       ei != effects.end(); ei++) {
+    size_t key = literal_key((*ei)->literal());
+    if (key >= producers.size()) {
+      producers.resize(key + 1, NULL);
+    }
+    const Chain<Step>* old_chain = producers[key];
+    if (old_chain == NULL || old_chain->head.id() != step.id()) {
+      producers[key] = new Chain<Step>(step, old_chain);
+      RCObject::ref(producers[key]);
+      RCObject::destructive_deref(old_chain);
+    }
+  }
+}
+
+
+/* Adds the given causal link to this index. */
+void ThreatIndex::add_link(const Link& link) {
+  size_t key = literal_key(link.condition());
+  if (key >= consumers.size()) {
+    consumers.resize(key + 1, NULL);
+  }
+  num_links++;
+  const Chain<IndexedLink>* old_chain = consumers[key];
+  consumers[key] =
+    new Chain<IndexedLink>(IndexedLink(link, num_links), old_chain);
+  RCObject::ref(consumers[key]);
+  RCObject::destructive_deref(old_chain);
+}
+
+
+/* ====================================================================== */
+/* SearchStatistics */
+
+/* Constructs empty search statistics. */
+SearchStatistics::SearchStatistics()
+  : num_visited_plans(0), num_generated_plans(0), num_static(0),
+    num_dead_ends(0), num_duplicates(0), peak_queue_size(0),
+    num_unifier_hits(0), num_unifier_misses(0), num_spilled_plans(0),
+    num_reloaded_plans(0), grounding_time(0), planning_graph_time(0),
+    flaw_selection_time(0), refinement_time(0), ranking_time(0),
+    optimal(false) {}
+
+
+/* Adds the given statistics to these statistics. */
+SearchStatistics& SearchStatistics::operator+=(const SearchStatistics& stats) {
+  num_visited_plans += stats.num_visited_plans;
+  num_generated_plans += stats.num_generated_plans;
+  num_static += stats.num_static;
+  num_dead_ends += stats.num_dead_ends;
+  num_duplicates += stats.num_duplicates;
+  peak_queue_size += stats.peak_queue_size;
+  num_unifier_hits += stats.num_unifier_hits;
+  num_unifier_misses += stats.num_unifier_misses;
+  num_spilled_plans += stats.num_spilled_plans;
+  num_reloaded_plans += stats.num_reloaded_plans;
+  if (flaw_orders.size() < stats.flaw_orders.size()) {
+    flaw_orders.resize(stats.flaw_orders.size());
+  }
+  for (size_t i = 0; i < stats.flaw_orders.size(); i++) {
+    FlawOrderStatistics& fs = flaw_orders[i];
+    const FlawOrderStatistics& other = stats.flaw_orders[i];
+    fs.num_generated_plans += other.num_generated_plans;
+    fs.num_visited_plans += other.num_visited_plans;
+    fs.num_dead_ends += other.num_dead_ends;
+    fs.peak_queue_size = std::max(fs.peak_queue_size, other.peak_queue_size);
+  }
+  grounding_time += stats.grounding_time;
+  planning_graph_time += stats.planning_graph_time;
+  flaw_selection_time += stats.flaw_selection_time;
+  refinement_time += stats.refinement_time;
+  ranking_time += stats.ranking_time;
+  optimal = optimal || stats.optimal;
+  return *this;
+}
+
+
 /* ====================================================================== */
 /* Plan */
 
@@ -114,13 +383,329 @@ struct PlanQueue : public std::priority_queue<const Plan*> {
 };
 
 
+/*
+ * A visited plan that is queued in place of its refinements, which
+ * are built one at a time when the plan is dequeued.
+ */
+struct PendingRefinements {
+  /* Flaw repaired by the refinements. */
+  const Flaw* flaw;
+  /* Index of the next refinement to build. */
+  size_t next;
+  /* Whether the flaw is a static open condition. */
+  bool static_flaw;
+  /* Whether a refinement has been added to the search space. */
+  bool added;
+};
+
+
+/*
+ * Visited plans of a queue whose refinements have not all been built.
+ */
+struct PendingRefinementsMap
+  : public std::unordered_map<const Plan*, PendingRefinements> {
+};
+
+
+/*
+ * A pending plan stored on disk as its rank, id, and refinement path
+ * from the initial plan.
+ */
+struct SpilledPlan {
+  /* Rank of the plan. */
+  std::vector<float> rank;
+  /* Id of the plan. */
+  size_t id;
+  /* Refinement path, root first, as pairs of flaw position and
+     refinement index. */
+  std::vector<uint32_t> path;
+};
+
+
+/* Checks if the first rank is more promising than the second, using
+   the same order as the plan queue. */
+static bool rank_less(const std::vector<float>& r1,
+                      const std::vector<float>& r2) {
+  float diff = r1[0] - r2[0];
+  for (size_t i = 1; i < r1.size() && diff == 0.0; i++) {
+    diff = r1[i] - r2[i];
+  }
+  return diff < 0.0;
+}
+
+
+/* Checks if the first spilled plan is more promising than the
+   second. */
+static bool more_promising(const SpilledPlan& p1, const SpilledPlan& p2) {
+  return rank_less(p1.rank, p2.rank);
+}
+
+
+/*
+ * A temporary file of spilled plans.
+ */
+struct PlanSpillFile {
+  /* Constructs an empty spill file. */
+  PlanSpillFile() : file_(NULL), size_(0) {}
+
+  PlanSpillFile(const PlanSpillFile&) = delete;
+
+  /* Deletes this spill file. */
+  ~PlanSpillFile() {
+    if (file_ != NULL) {
+      fclose(file_);
+    }
+  }
+
+  /* Returns the number of plans in this file. */
+  size_t size() const { return size_; }
+
+  /* Returns the rank of the most promising plan in this file. */
+  const std::vector<float>& front() const { return front_; }
+
+  /* Adds the given plan to this file. */
+  void write(const SpilledPlan& plan) {
+    if (file_ == NULL) {
+      file_ = tmpfile();
+      if (file_ == NULL) {
+        throw std::runtime_error("cannot create spill file");
+      }
+    }
+    uint32_t rank_size = plan.rank.size();
+    uint32_t path_size = plan.path.size();
+    if (fwrite(&plan.id, sizeof plan.id, 1, file_) != 1
+        || fwrite(&rank_size, sizeof rank_size, 1, file_) != 1
+        || fwrite(&path_size, sizeof path_size, 1, file_) != 1
+        || fwrite(plan.rank.data(), sizeof(float), rank_size,
+                  file_) != rank_size
+        || fwrite(plan.path.data(), sizeof(uint32_t), path_size,
+                  file_) != path_size) {
+      throw std::runtime_error("cannot write spill file");
+    }
+    if (size_ == 0 || rank_less(plan.rank, front_)) {
+      front_ = plan.rank;
+    }
+    size_++;
+  }
+
+  /* Removes all plans from this file, and adds them to the given
+     list. */
+  void read(std::vector<SpilledPlan>& plans) {
+    if (file_ == NULL) {
+      return;
+    }
+    rewind(file_);
+    for (size_t i = 0; i < size_; i++) {
+      plans.push_back(SpilledPlan());
+      SpilledPlan& plan = plans.back();
+      uint32_t rank_size, path_size;
+      if (fread(&plan.id, sizeof plan.id, 1, file_) != 1
+          || fread(&rank_size, sizeof rank_size, 1, file_) != 1
+          || fread(&path_size, sizeof path_size, 1, file_) != 1) {
+        throw std::runtime_error("cannot read spill file");
+      }
+      plan.rank.resize(rank_size);
+      plan.path.resize(path_size);
+      if (fread(plan.rank.data(), sizeof(float), rank_size,
+                file_) != rank_size
+          || fread(plan.path.data(), sizeof(uint32_t), path_size,
+                   file_) != path_size) {
+        throw std::runtime_error("cannot read spill file");
+      }
+    }
+    clear();
+  }
+
+  /* Removes all plans from this file. */
+  void clear() {
+    if (file_ != NULL) {
+      fclose(file_);
+      file_ = NULL;
+    }
+    size_ = 0;
+  }
+
+private:
+  /* The underlying file, or NULL if no plan has been written. */
+  FILE* file_;
+  /* Number of plans in the file. */
+  size_t size_;
+  /* Rank of the most promising plan in the file. */
+  std::vector<float> front_;
+};
+
+
+/* Returns the resident memory of this process in megabytes, or 0 if
+   it cannot be determined. */
+static size_t resident_megabytes() {
+  std::ifstream statm("/proc/self/statm");
+  size_t size, resident;
+  if (statm >> size >> resident) {
+    return resident*sysconf(_SC_PAGESIZE)/(1024*1024);
+  }
+  return 0;
+}
+
+
+/* Returns the cost of the given plan in an anytime search: the
+   makespan if the domain has durative actions, and the number of steps
+   otherwise.  Refining a plan never lowers its cost. */
+static float plan_cost(const Plan& plan) {
+  if (context->domain->requirements.durative_actions()) {
+    std::map<size_t, float> start_times;
+    std::map<size_t, float> end_times;
+    return plan.orderings().schedule(start_times, end_times);
+  } else {
+    return plan.num_steps() - context->problem->timed_actions().size();
+  }
+}
+
+
+/* Checks if the given plan cannot be refined into a plan that is
+   cheaper than the best plan found so far in an anytime search. */
+static bool cannot_improve(const Plan& plan) {
+  return (context->params->anytime
+          && context->best_cost < std::numeric_limits<float>::infinity()
+          && plan_cost(plan) >= context->best_cost);
+}
+
+
+/* Returns the best plan found by an anytime search in place of the
+   given plan returned by the search, which is deleted unless it is the
+   given initial plan.  The best plan is optimal if the search was
+   exhausted.  The given plan is returned if no plan was found. */
+static const Plan* best_plan(const Plan* plan, const Plan* initial_plan,
+                             bool exhausted, SearchStatistics& stats) {
+  const Plan* best = context->best_plan;
+  if (best == NULL) {
+    return plan;
+  }
+  context->best_plan = NULL;
+  if (plan != initial_plan) {
+    delete plan;
+  }
+  stats.optimal = exhausted;
+  return best;
+}
+
+
+/*
+ * The visit of a plan in a parallel search, shared by the children of
+ * the plan until each of them is added to the search space of its
+ * owning thread or discarded.  The visit is counted like in the serial
+ * search once all children are accounted for.
+ */
+struct PlanVisit {
+  /* Number of children not yet added or discarded. */
+  std::atomic<size_t> num_pending;
+  /* Whether a child was added to the search space. */
+  std::atomic<bool> added;
+  /* Whether the repaired flaw was a static open condition. */
+  const bool static_flaw;
+
+  /* Constructs a visit with the given number of children. */
+  PlanVisit(size_t num_children, bool static_flaw)
+    : num_pending(num_children), added(false), static_flaw(static_flaw) {}
+};
+
+
+/*
+ * A mailbox of plans sent to a thread of a parallel search.  Any
+ * thread can send plans to the mailbox, but only the owning thread
+ * receives them.  The mailbox is a lock-free stack, so sending never
+ * waits for other threads; the mutex is only taken to wake the owner
+ * when it waits for plans.
+ */
+struct PlanMailbox {
+  /* Constructs an empty mailbox. */
+  PlanMailbox() : head_(NULL), waiting_(false) {}
+
+  PlanMailbox(const PlanMailbox&) = delete;
+
+  /* Deletes this mailbox, but not the plans left in it. */
+  ~PlanMailbox() {
+    std::vector<std::pair<const Plan*, PlanVisit*> > messages;
+    receive(messages);
+  }
+
+  /* Sends the given plan, generated by the given visit, to this
+     mailbox. */
+  void send(const Plan* plan, PlanVisit* visit) {
+    Message* message = new Message();
+    message->plan = plan;
+    message->visit = visit;
+    message->next = head_.load(std::memory_order_relaxed);
+    while (!head_.compare_exchange_weak(message->next, message)) {
+    }
+    /* The owner sets the flag before it checks for messages, so it
+       either sees this message or is woken up. */
+    if (waiting_) {
+      notify();
+    }
+  }
+
+  /* Removes all plans from this mailbox, and adds them together with
+     the visits that generated them to the given list. */
+  void receive(std::vector<std::pair<const Plan*, PlanVisit*> >& messages) {
+    Message* message = head_.exchange(NULL, std::memory_order_acquire);
+    while (message != NULL) {
+      messages.push_back(std::make_pair(message->plan, message->visit));
+      Message* next = message->next;
+      delete message;
+      message = next;
+    }
+  }
+
+  /* Blocks the owning thread until a plan is sent to this mailbox or
+     the given condition holds; the condition must be followed by a
+     call to notify when it starts to hold. */
+  template<typename Condition>
+  void wait(Condition condition) {
+    std::unique_lock<std::mutex> lock(mutex_);
+    waiting_ = true;
+    ready_.wait(lock, [&]() {
+        return head_.load() != NULL || condition();
+      });
+    waiting_ = false;
+  }
+
+  /* Wakes up the owning thread if it waits for plans. */
+  void notify() {
+    std::lock_guard<std::mutex> lock(mutex_);
+    ready_.notify_one();
+  }
+
+private:
+  /*
+   * A plan sent to a mailbox.
+   */
+  struct Message {
+    /* The plan. */
+    const Plan* plan;
+    /* Visit that generated the plan, or NULL for the initial plan. */
+    PlanVisit* visit;
+    /* Next message in the mailbox. */
+    Message* next;
+  };
+
+  /* Most recently sent message, or NULL if the mailbox is empty. */
+  std::atomic<Message*> head_;
+  /* Whether the owning thread waits for plans. */
+  std::atomic<bool> waiting_;
+  /* Mutex for waiting and waking up the owning thread. */
+  std::mutex mutex_;
+  /* Signaled when a plan is sent to a waiting owner. */
+  std::condition_variable ready_;
+};
+
+
 /* Id of goal step. */
 const size_t Plan::GOAL_ID = std::numeric_limits<size_t>::max();
 
 
 /* Adds goal to chain of open conditions, and returns true if and only
    if the goal is consistent. */
-static bool add_goal(const Chain<OpenCondition>*& open_conds,
+static bool add_goal(const FlawSet<OpenCondition>*& open_conds,
                      size_t& num_open_conds, BindingList& new_bindings,
                      const Formula& goal, size_t step_id,
                      bool test_only = false) {
@@ -145,11 +730,11 @@ static bool add_goal(const Chain<OpenCondition>*& open_conds,
     }
     if (l != NULL) {
       if (!test_only
-          && !(params->strip_static_preconditions()
+          && !(context->params->strip_static_preconditions()
                && PredicateTable::static_predicate(l->predicate()))) {
         open_conds =
-          new Chain<OpenCondition>(OpenCondition(step_id, *l, when),
-                                   open_conds);
+          FlawSet<OpenCondition>::add(OpenCondition(step_id, *l, when),
+                                      open_conds);
       }
       num_open_conds++;
     } else {
@@ -158,7 +743,7 @@ static bool add_goal(const Chain<OpenCondition>*& open_conds,
         const FormulaList& gs = conj->conjuncts();
         for (FormulaList::const_iterator fi = gs.begin();
              fi != gs.end(); fi++) {
-          if (params->random_open_conditions) {
+          if (context->params->random_open_conditions) {
             size_t pos = size_t((goals.size() + 1.0)*rand()/(RAND_MAX + 1.0));
             if (pos == goals.size()) {
               goals.push_back(*fi);
@@ -176,8 +761,8 @@ static bool add_goal(const Chain<OpenCondition>*& open_conds,
         if (disj != NULL) {
           if (!test_only) {
             open_conds =
-              new Chain<OpenCondition>(OpenCondition(step_id, *disj),
-                                       open_conds);
+              FlawSet<OpenCondition>::add(OpenCondition(step_id, *disj),
+                                          open_conds);
           }
           num_open_conds++;
         } else {
@@ -190,13 +775,13 @@ static bool add_goal(const Chain<OpenCondition>*& open_conds,
                                            bl->step_id2(step_id), is_eq));
 #ifdef BRANCH_ON_INEQUALITY
             const Inequality* neq = dynamic_cast<const Inequality*>(bl);
-            if (params->domain_constraints
+            if (context->params->domain_constraints
                 && neq != NULL && bl.term().variable()) {
               /* Both terms are variables, so handle specially. */
               if (!test_only) {
                 open_conds =
-                  new Chain<OpenCondition>(OpenCondition(step_id, *neq),
-                                           open_conds);
+                  FlawSet<OpenCondition>::add(OpenCondition(step_id, *neq),
+                                              open_conds);
               }
               num_open_conds++;
               new_bindings.pop_back();
@@ -205,7 +790,7 @@ static bool add_goal(const Chain<OpenCondition>*& open_conds,
           } else {
             const Exists* exists = dynamic_cast<const Exists*>(goal);
             if (exists != NULL) {
-              if (params->random_open_conditions) {
+              if (context->params->random_open_conditions) {
                 size_t pos =
                   size_t((goals.size() + 1.0)*rand()/(RAND_MAX + 1.0));
                 if (pos == goals.size()) {
@@ -222,8 +807,8 @@ static bool add_goal(const Chain<OpenCondition>*& open_conds,
               const Forall* forall = dynamic_cast<const Forall*>(goal);
               if (forall != NULL) {
                 const Formula& g = forall->universal_base(
-                    std::map<Variable, Term>(), *problem);
-                if (params->random_open_conditions) {
+                    std::map<Variable, Term>(), *context->problem);
+                if (context->params->random_open_conditions) {
                   size_t pos =
                     size_t((goals.size() + 1.0)*rand()/(RAND_MAX + 1.0));
                   if (pos == goals.size()) {
@@ -251,51 +836,51 @@ static bool add_goal(const Chain<OpenCondition>*& open_conds,
 
 /* Returns a set of achievers for the given literal. */
 static const ActionEffectMap* literal_achievers(const Literal& literal) {
-  if (params->ground_actions) {
-    return planning_graph->literal_achievers(literal);
+  if (context->params->ground_actions) {
+    return context->planning_graph->literal_achievers(literal);
   } else if (typeid(literal) == typeid(Atom)) {
     PredicateAchieverMap::const_iterator pai =
-      achieves_pred.find(literal.predicate());
-    return (pai != achieves_pred.end()) ? &(*pai).second : NULL;
+      context->achieves_pred.find(literal.predicate());
+    return (pai != context->achieves_pred.end()) ? &(*pai).second : NULL;
   } else {
     PredicateAchieverMap::const_iterator pai =
-      achieves_neg_pred.find(literal.predicate());
-    return (pai != achieves_neg_pred.end()) ? &(*pai).second : NULL;
+      context->achieves_neg_pred.find(literal.predicate());
+    return (pai != context->achieves_neg_pred.end()) ? &(*pai).second : NULL;
   }
 }
 
 
-/* Finds threats to the given link. */
-static void link_threats(const Chain<Unsafe>*& unsafes, size_t& num_unsafes,
-                         const Link& link, const Chain<Step>* steps,
+/* Finds threats to the given link by the given step. */
+static void link_threats(const FlawSet<Unsafe>*& unsafes,
+                         size_t& num_unsafes,
+                         const Link& link, const Step& s,
                          const Orderings& orderings,
                          const Bindings& bindings) {
   StepTime lt1 = link.effect_time();
   StepTime lt2 = end_time(link.condition_time());
-  for (const Chain<Step>* sc = steps; sc != NULL; sc = sc->tail) {
-    const Step& s = sc->head;
-    if (orderings.possibly_not_after(link.from_id(), lt1,
-                                     s.id(), StepTime::AT_END)
-        && orderings.possibly_not_before(link.to_id(), lt2,
-                                         s.id(), StepTime::AT_START)) {
-      const EffectList& effects = s.action().effects();
-      for (EffectList::const_iterator ei = effects.begin();
-           ei != effects.end(); ei++) {
-        const Effect& e = **ei;
-        if (!problem->durative() && e.link_condition().contradiction()) {
-          continue;
-        }
-        StepTime et = end_time(e);
-        if (!(s.id() == link.to_id() && et >= lt2)
-            && orderings.possibly_not_after(link.from_id(), lt1, s.id(), et)
-            && orderings.possibly_not_before(link.to_id(), lt2, s.id(), et)) {
-          if (typeid(link.condition()) == typeid(Negation)
-              || !(link.from_id() == s.id() && lt1 == et)) {
-            if (bindings.affects(e.literal(), s.id(),
-                                 link.condition(), link.to_id())) {
-              unsafes = new Chain<Unsafe>(Unsafe(link, s.id(), e), unsafes);
-              num_unsafes++;
-            }
+  if (orderings.possibly_not_after(link.from_id(), lt1,
+                                   s.id(), StepTime::AT_END)
+      && orderings.possibly_not_before(link.to_id(), lt2,
+                                       s.id(), StepTime::AT_START)) {
+    size_t key = literal_key(link.condition()) ^ 1;
+    const EffectList& effects = s.action().effects();
+    for (EffectList::const_iterator ei = effects.begin();
+         ei != effects.end(); ei++) {
+      const Effect& e = **ei;
+      if ((!context->problem->durative() && e.link_condition().contradiction())
+          || literal_key(e.literal()) != key) {
+        continue;
+      }
+      StepTime et = end_time(e);
+      if (!(s.id() == link.to_id() && et >= lt2)
+          && orderings.possibly_not_after(link.from_id(), lt1, s.id(), et)
+          && orderings.possibly_not_before(link.to_id(), lt2, s.id(), et)) {
+        if (typeid(link.condition()) == typeid(Negation)
+            || !(link.from_id() == s.id() && lt1 == et)) {
+          if (bindings.affects(e.literal(), s.id(),
+                               link.condition(), link.to_id())) {
+            unsafes = FlawSet<Unsafe>::add(Unsafe(link, s.id(), e), unsafes);
+            num_unsafes++;
           }
         }
       }
@@ -304,42 +889,58 @@ static void link_threats(const Chain<Unsafe>*& unsafes, size_t& num_unsafes,
 }
 
 
-/* Finds the threatened links by the given step. */
-static void step_threats(const Chain<Unsafe>*& unsafes, size_t& num_unsafes,
-                         const Step& step, const Chain<Link>* links,
+/* Finds threats to the given link.  The given steps extend the steps
+   covered by the given threat index. */
+static void link_threats(const FlawSet<Unsafe>*& unsafes,
+                         size_t& num_unsafes,
+                         const Link& link, const Chain<Step>* steps,
+                         const ThreatIndex& index,
+                         const Orderings& orderings,
+                         const Bindings& bindings) {
+  /* Steps not covered by the index come first in the chain of steps. */
+  for (const Chain<Step>* sc = steps;
+       sc != NULL && sc != index.steps; sc = sc->tail) {
+    link_threats(unsafes, num_unsafes, link, sc->head, orderings, bindings);
+  }
+  size_t key = literal_key(link.condition()) ^ 1;
+  if (key < index.producers.size()) {
+    for (const Chain<Step>* sc = index.producers[key];
+         sc != NULL; sc = sc->tail) {
+      link_threats(unsafes, num_unsafes, link, sc->head, orderings, bindings);
+    }
+  }
+}
+
+
+/* Finds the threatened links by the given step among the links
+   covered by the given threat index. */
+static void step_threats(const FlawSet<Unsafe>*& unsafes,
+                         size_t& num_unsafes,
+                         const Step& step, const ThreatIndex& index,
                          const Orderings& orderings,
                          const Bindings& bindings) {
   const EffectList& effects = step.action().effects();
-  for (const Chain<Link>* lc = links; lc != NULL; lc = lc->tail) {
-    const Link& l = lc->head;
-    StepTime lt1 = l.effect_time();
-    StepTime lt2 = end_time(l.condition_time());
-    if (orderings.possibly_not_after(l.from_id(), lt1,
-                                     step.id(), StepTime::AT_END)
-        && orderings.possibly_not_before(l.to_id(), lt2,
-                                         step.id(), StepTime::AT_START)) {
-      for (EffectList::const_iterator ei = effects.begin();
-           ei != effects.end(); ei++) {
-        const Effect& e = **ei;
-        if (!problem->durative() && e.link_condition().contradiction()) {
-          continue;
-        }
-        StepTime et = end_time(e);
-        if (!(step.id() == l.to_id() && et >= lt2)
-            && orderings.possibly_not_after(l.from_id(), lt1, step.id(), et)
-            && orderings.possibly_not_before(l.to_id(), lt2, step.id(), et)) {
-          if (typeid(l.condition()) == typeid(Negation)
-              || !(l.from_id() == step.id() && lt1 == et)) {
-            if (bindings.affects(e.literal(), step.id(),
-                                 l.condition(), l.to_id())) {
-              unsafes = new Chain<Unsafe>(Unsafe(l, step.id(), e), unsafes);
-              num_unsafes++;
-            }
-          }
-        }
+  std::vector<size_t> keys;
+  std::vector<IndexedLink> links;
+  for (EffectList::const_iterator ei = effects.begin();
+       ei != effects.end(); ei++) {
+    size_t key = literal_key((*ei)->literal()) ^ 1;
+    if (key < index.consumers.size()
+        && std::find(keys.begin(), keys.end(), key) == keys.end()) {
+      keys.push_back(key);
+      for (const Chain<IndexedLink>* lc = index.consumers[key];
+           lc != NULL; lc = lc->tail) {
+        links.push_back(lc->head);
       }
     }
   }
+  /* Visit the links in the order of the chain of links. */
+  std::sort(links.begin(), links.end(), later_link);
+  for (std::vector<IndexedLink>::const_iterator li = links.begin();
+       li != links.end(); li++) {
+    link_threats(unsafes, num_unsafes, *(*li).link, step,
+                 orderings, bindings);
+  }
 }
 
 
@@ -397,73 +998,287 @@ static void mutex_threats(const Chain<MutexThreat>*& mutex_threats,
 }
 
 
+/* A step parameter. */
+typedef std::pair<Variable, size_t> StepParameter;
+
+
+/* Returns binding constraints that bind each of the given step
+   parameters to an object, or NULL if no consistent binding
+   constraints can be found.  The parameter with the fewest values
+   consistent with the current binding constraints is bound first,
+   and the search backtracks as soon as some parameter has no
+   consistent value left. */
+static const Bindings* step_instantiation(
+    const std::vector<StepParameter>& parameters, const Bindings& bindings) {
+  /* Unbound parameter with the fewest consistent values. */
+  const StepParameter* next = NULL;
+  /* Consistent values for the next parameter. */
+  std::vector<Object> next_values;
+  for (std::vector<StepParameter>::const_iterator pi = parameters.begin();
+       pi != parameters.end(); pi++) {
+    const StepParameter& p = *pi;
+    if (p.first != bindings.binding(p.first, p.second)) {
+      continue;
+    }
+    const std::vector<Object>& objects =
+        context->problem->terms().compatible_objects(TermTable::type(p.first));
+    std::vector<Object> values;
+    for (std::vector<Object>::const_iterator oi = objects.begin();
+         oi != objects.end()
+             && (next == NULL || values.size() < next_values.size());
+         oi++) {
+      BindingList bl;
+      bl.push_back(Binding(p.first, p.second, *oi, 0, true));
+      if (bindings.add(bl, true) != NULL) {
+        values.push_back(*oi);
+      }
+    }
+    if (values.empty()) {
+      /* The parameter cannot be bound. */
+      return NULL;
+    } else if (next == NULL || values.size() < next_values.size()) {
+      next = &p;
+      next_values.swap(values);
+      if (next_values.size() == 1) {
+        break;
+      }
+    }
+  }
+  if (next == NULL) {
+    /* All parameters are bound. */
+    return &bindings;
+  }
+  for (std::vector<Object>::const_iterator oi = next_values.begin();
+       oi != next_values.end(); oi++) {
+    BindingList bl;
+    bl.push_back(Binding(next->first, next->second, *oi, 0, true));
+    const Bindings* new_bindings = bindings.add(bl);
+    if (new_bindings != NULL) {
+      const Bindings* result = step_instantiation(parameters, *new_bindings);
+      if (result != new_bindings) {
+        delete new_bindings;
+      }
+      if (result != NULL) {
+        return result;
+      }
+    }
+  }
+  return NULL;
+}
+
+
 /* Returns binding constraints that make the given steps fully
    instantiated, or NULL if no consistent binding constraints can be
    found. */
-static const Bindings* step_instantiation(const Chain<Step>* steps, size_t n,
+static const Bindings* step_instantiation(const Chain<Step>* steps,
                                           const Bindings& bindings) {
-  if (steps == NULL) {
-    return &bindings;
-  } else {
-    const Step& step = steps->head;
+  std::vector<StepParameter> parameters;
+  for (const Chain<Step>* sc = steps; sc != NULL; sc = sc->tail) {
+    const Step& step = sc->head;
     const ActionSchema* as = dynamic_cast<const ActionSchema*>(&step.action());
-    if (as == NULL || as->parameters().size() <= n) {
-      return step_instantiation(steps->tail, 0, bindings);
-    } else {
-      const Variable& v = as->parameters()[n];
-      if (v != bindings.binding(v, step.id())) {
-        return step_instantiation(steps, n + 1, bindings);
-      } else {
-        const Type& t = TermTable::type(v);
-        const std::vector<Object>& arguments =
-            problem->terms().compatible_objects(t);
-        for (std::vector<Object>::const_iterator oi = arguments.begin();
-             oi != arguments.end(); oi++) {
-          BindingList bl;
-          bl.push_back(Binding(v, step.id(), *oi, 0, true));
-          const Bindings* new_bindings = bindings.add(bl);
-          if (new_bindings != NULL) {
-            const Bindings* result = step_instantiation(steps, n + 1,
-                                                        *new_bindings);
-            if (result != new_bindings) {
-              delete new_bindings;
-            }
-            if (result != NULL) {
-              return result;
-            }
-          }
+    if (as != NULL) {
+      for (std::vector<Variable>::const_iterator vi =
+               as->parameters().begin();
+           vi != as->parameters().end(); vi++) {
+        if (*vi == bindings.binding(*vi, step.id())) {
+          parameters.push_back(std::make_pair(*vi, step.id()));
         }
-        return NULL;
       }
     }
   }
+  return step_instantiation(parameters, bindings);
+}
+
+
+/* Appends the given items to the given canonical plan, in sorted
+   order. */
+template<size_t N>
+static void add_sorted(std::string& canonical,
+                       std::vector<std::array<size_t, N> >& items) {
+  std::sort(items.begin(), items.end());
+  size_t n = items.size();
+  canonical.append(reinterpret_cast<const char*>(&n), sizeof n);
+  if (n > 0) {
+    canonical.append(reinterpret_cast<const char*>(&items[0]),
+                     n*sizeof items[0]);
+  }
+}
+
+
+/* Returns the index of the given effect among the effects of the
+   given action. */
+static size_t effect_index(const Action* action, const Effect& effect) {
+  if (action != NULL) {
+    const EffectList& effects = action->effects();
+    for (size_t i = 0; i < effects.size(); i++) {
+      if (effects[i] == &effect) {
+        return i;
+      }
+    }
+  }
+  return std::numeric_limits<size_t>::max();
+}
+
+
+/* Returns an identifier for the given condition that does not depend
+   on where the condition is stored.  Only literals have ids, so other
+   conditions are identified by their address. */
+static size_t condition_id(const Formula& condition) {
+  const Literal* literal = dynamic_cast<const Literal*>(&condition);
+  if (literal != NULL) {
+    return literal->id();
+  } else {
+    return reinterpret_cast<size_t>(&condition);
+  }
+}
+
+
+/* Returns a string that is the same for two plans if they have the
+   same steps, links, ordering constraints, binding constraints, and
+   flaws, regardless of the order in which these were added.  Steps
+   are renumbered by their action, their bound parameters, and the
+   conditions they achieve, so plans that add the same steps in a
+   different order get the same string as long as these keys tell the
+   steps apart; steps with equal keys keep the order of their ids. */
+static std::string canonical_plan(const Plan& plan) {
+  std::vector<std::pair<std::vector<size_t>, size_t> > keys;
+  size_t max_id = 0;
+  for (const Chain<Step>* sc = plan.steps(); sc != NULL; sc = sc->tail) {
+    const Step& step = sc->head;
+    if (step.id() == 0 || step.id() == Plan::GOAL_ID) {
+      /* The initial and goal steps keep their ids. */
+      continue;
+    }
+    std::vector<size_t> key(1, step.action().id());
+    const ActionSchema* as = dynamic_cast<const ActionSchema*>(&step.action());
+    if (as != NULL) {
+      for (std::vector<Variable>::const_iterator vi =
+               as->parameters().begin();
+           vi != as->parameters().end(); vi++) {
+        Term t = (plan.bindings() != NULL)
+          ? plan.bindings()->binding(*vi, step.id()) : Term(*vi);
+        key.push_back(t.object()
+                      ? std::hash<Term>()(t)
+                      : std::numeric_limits<size_t>::max());
+      }
+    }
+    std::vector<size_t> achieved;
+    for (const Chain<Link>* lc = plan.links(); lc != NULL; lc = lc->tail) {
+      if (lc->head.from_id() == step.id()) {
+        achieved.push_back(lc->head.condition().id());
+      }
+    }
+    std::sort(achieved.begin(), achieved.end());
+    key.insert(key.end(), achieved.begin(), achieved.end());
+    keys.push_back(std::make_pair(key, step.id()));
+    max_id = std::max(max_id, step.id());
+  }
+  std::sort(keys.begin(), keys.end());
+  std::vector<size_t> step_ids(max_id + 1, 0);
+  std::vector<const Action*> actions(max_id + 1, NULL);
+  for (size_t i = 0; i < keys.size(); i++) {
+    step_ids[keys[i].second] = i + 1;
+  }
+  for (const Chain<Step>* sc = plan.steps(); sc != NULL; sc = sc->tail) {
+    if (sc->head.id() <= max_id) {
+      actions[sc->head.id()] = &sc->head.action();
+    }
+  }
+  auto canonical_id = [&](size_t id) {
+    return (id < step_ids.size()) ? step_ids[id] : id;
+  };
+  auto step_action = [&](size_t id) {
+    return (id < actions.size()) ? actions[id] : NULL;
+  };
+
+  std::string canonical;
+  std::vector<std::array<size_t, 1> > steps;
+  for (size_t i = 0; i < keys.size(); i++) {
+    steps.push_back({ keys[i].first[0] });
+  }
+  add_sorted(canonical, steps);
+  std::vector<std::array<size_t, 6> > links;
+  for (const Chain<Link>* lc = plan.links(); lc != NULL; lc = lc->tail) {
+    const Link& l = lc->head;
+    links.push_back({ canonical_id(l.from_id()),
+                      size_t(l.effect_time().point),
+                      size_t(l.effect_time().rel), canonical_id(l.to_id()),
+                      l.condition().id(), size_t(l.condition_time()) });
+  }
+  add_sorted(canonical, links);
+  std::vector<std::array<size_t, 3> > open_conds;
+  for (FlawSet<OpenCondition>::const_iterator oci(plan.open_conds());
+       oci != FlawSet<OpenCondition>::end(); ++oci) {
+    const OpenCondition& oc = *oci;
+    open_conds.push_back({ canonical_id(oc.step_id()),
+                           condition_id(oc.condition()), size_t(oc.when()) });
+  }
+  add_sorted(canonical, open_conds);
+  std::vector<std::array<size_t, 5> > unsafes;
+  for (FlawSet<Unsafe>::const_iterator ui(plan.unsafes());
+       ui != FlawSet<Unsafe>::end(); ++ui) {
+    const Unsafe& u = *ui;
+    unsafes.push_back({ canonical_id(u.link().from_id()),
+                        canonical_id(u.link().to_id()),
+                        u.link().condition().id(), canonical_id(u.step_id()),
+                        effect_index(step_action(u.step_id()),
+                                     u.effect()) });
+  }
+  add_sorted(canonical, unsafes);
+  std::vector<std::array<size_t, 4> > mutex_threats;
+  for (const Chain<MutexThreat>* mc = plan.mutex_threats();
+       mc != NULL; mc = mc->tail) {
+    const MutexThreat& mt = mc->head;
+    if (mt.step_id1() == 0) {
+      /* Place holder for mutex threats not yet computed. */
+      mutex_threats.push_back({ 0, 0, 0, 0 });
+    } else {
+      mutex_threats.push_back({ canonical_id(mt.step_id1()),
+                                effect_index(step_action(mt.step_id1()),
+                                             mt.effect1()),
+                                canonical_id(mt.step_id2()),
+                                effect_index(step_action(mt.step_id2()),
+                                             mt.effect2()) });
+    }
+  }
+  add_sorted(canonical, mutex_threats);
+  std::ostringstream os;
+  plan.orderings().print_canonical(os, step_ids);
+  os << '|';
+  if (plan.bindings() != NULL) {
+    plan.bindings()->print_canonical(os, step_ids);
+  }
+  canonical += os.str();
+  return canonical;
+}
+
+
+/* Returns the signature of this plan. */
+PlanSignature Plan::signature() const {
+  std::string canonical = canonical_plan(*this);
+  /* The check is a 64-bit FNV-1a hash, which is independent of the
+     standard library hash. */
+  uint64_t check = 14695981039346656037ULL;
+  for (size_t i = 0; i < canonical.size(); i++) {
+    check ^= static_cast<unsigned char>(canonical[i]);
+    check *= 1099511628211ULL;
+  }
+  return PlanSignature(std::hash<std::string>()(canonical), check);
 }
 
 
 /* Returns the initial plan representing the given problem, or NULL
    if initial conditions or goals of the problem are inconsistent. */
 const Plan* Plan::make_initial_plan(const Problem& problem) {
-  /*
-   * Create goal of problem.
-   */
-  if (params->ground_actions) {
-    goal_action = new GroundAction("", false);
-    const Formula& goal_formula =
-        problem.goal().instantiation(std::map<Variable, Term>(), problem);
-    goal_action->set_condition(goal_formula);
-  } else {
-    goal_action = new ActionSchema("", false);
-    goal_action->set_condition(problem.goal());
-  }
   /* Chain of open conditions. */
-  const Chain<OpenCondition>* open_conds = NULL;
+  const FlawSet<OpenCondition>* open_conds = NULL;
   /* Number of open conditions. */
   size_t num_open_conds = 0;
   /* Bindings introduced by goal. */
   BindingList new_bindings;
   /* Add goals as open conditions. */
   if (!add_goal(open_conds, num_open_conds, new_bindings,
-                goal_action->condition(), GOAL_ID)) {
+                context->goal_action->condition(), GOAL_ID)) {
     /* Goals are inconsistent. */
     RCObject::ref(open_conds);
     RCObject::destructive_deref(open_conds);
@@ -475,7 +1290,8 @@ const Plan* Plan::make_initial_plan(const Problem& problem) {
   /* Make chain of initial steps. */
   const Chain<Step>* steps =
     new Chain<Step>(Step(0, problem.init_action()),
-                    new Chain<Step>(Step(GOAL_ID, *goal_action), NULL));
+                    new Chain<Step>(Step(GOAL_ID, *context->goal_action),
+                                    NULL));
   size_t num_steps = 0;
   /* Variable bindings. */
   const Bindings* bindings = &Bindings::EMPTY;
@@ -513,92 +1329,322 @@ const Plan* Plan::make_initial_plan(const Problem& problem) {
 
 /* Returns plan for given problem. */
 const Plan* Plan::plan(const Problem& problem, const Parameters& p,
-                       bool last_problem) {
+                       bool last_problem, SearchStatistics& stats) {
+  return plan(problem, p, NULL, last_problem, stats);
+}
+
+
+/* Returns a planning graph for the given problem, or NULL if the
+   given parameters do not need one. */
+const PlanningGraph* Plan::make_planning_graph(const Problem& problem,
+                                               const Parameters& p,
+                                               SearchStatistics& stats) {
+  bool need_pg = (p.ground_actions || p.domain_constraints
+                  || p.heuristic.needs_planning_graph());
+  for (size_t i = 0; !need_pg && i < p.flaw_orders.size(); i++) {
+    if (p.flaw_orders[i].needs_planning_graph()) {
+      need_pg = true;
+    }
+  }
+  if (!need_pg) {
+    return NULL;
+  }
+  std::lock_guard<std::mutex> lock(planning_graph_mutex);
+  Timer<> planning_graph_timer;
+  const PlanningGraph* pg = new PlanningGraph(problem, p);
+  stats.grounding_time = pg->grounding_time();
+  stats.planning_graph_time =
+    planning_graph_timer.ElapsedTime() - stats.grounding_time;
+  return pg;
+}
+
+
+/* Returns plan for given problem using the given planning graph. */
+const Plan* Plan::plan(const Problem& problem, const Parameters& p,
+                       const PlanningGraph* pg, bool last_problem,
+                       SearchStatistics& stats, PlanObserver* observer) {
   Timer<> timer;
 
+  /* Release the state left by an earlier problem in this thread. */
+  if (context != NULL) {
+    cleanup();
+  }
+  {
+    std::lock_guard<std::mutex> lock(planners_mutex);
+    if (num_active_planners == 0) {
+      num_problem_variables = TermTable::num_variables();
+    }
+    num_active_planners++;
+  }
+  context = new PlannerContext();
   /* Set planning parameters. */
-  params = &p;
+  context->params = &p;
+  const Parameters* params = &p;
   /* Set current domain. */
-  domain = &problem.domain();
-  ::problem = &problem;
+  context->domain = &problem.domain();
+  context->problem = &problem;
+  /* Set receiver of improved plans. */
+  context->observer = observer;
+  context->best_plan = NULL;
+  context->best_cost = std::numeric_limits<float>::infinity();
 
   /*
    * Initialize planning graph and maps from predicates to actions.
    */
-  bool need_pg = (params->ground_actions || params->domain_constraints
-                  || params->heuristic.needs_planning_graph());
-  for (size_t i = 0; !need_pg && i < params->flaw_orders.size(); i++) {
-    if (params->flaw_orders[i].needs_planning_graph()) {
-      need_pg = true;
+  context->own_planning_graph = (pg == NULL);
+  context->planning_graph = (context->own_planning_graph
+                             ? make_planning_graph(problem, p, stats) : pg);
+  if (!params->ground_actions) {
+    PredicateAchieverMap& achieves_pred = context->achieves_pred;
+    PredicateAchieverMap& achieves_neg_pred = context->achieves_neg_pred;
+    for (std::map<std::string, const ActionSchema*>::const_iterator ai =
+             context->domain->actions().begin();
+         ai != context->domain->actions().end(); ai++) {
+      const ActionSchema* as = (*ai).second;
+      for (EffectList::const_iterator ei = as->effects().begin();
+           ei != as->effects().end(); ei++) {
+        const Literal& literal = (*ei)->literal();
+        if (typeid(literal) == typeid(Atom)) {
+          achieves_pred[literal.predicate()].insert(std::make_pair(as, *ei));
+        } else {
+          achieves_neg_pred[literal.predicate()].insert(std::make_pair(as,
+                                                                       *ei));
+        }
+      }
+    }
+    const GroundAction& ia = problem.init_action();
+    for (EffectList::const_iterator ei = ia.effects().begin();
+         ei != ia.effects().end(); ei++) {
+      const Literal& literal = (*ei)->literal();
+      achieves_pred[literal.predicate()].insert(std::make_pair(&ia, *ei));
+    }
+    for (TimedActionTable::const_iterator ai = problem.timed_actions().begin();
+         ai != problem.timed_actions().end(); ai++) {
+      const GroundAction& action = *(*ai).second;
+      for (EffectList::const_iterator ei = action.effects().begin();
+           ei != action.effects().end(); ei++) {
+        const Literal& literal = (*ei)->literal();
+        if (typeid(literal) == typeid(Atom)) {
+          achieves_pred[literal.predicate()].insert(std::make_pair(&action,
+                                                                   *ei));
+        } else {
+          achieves_neg_pred[literal.predicate()].insert(std::make_pair(&action,
+                                                                       *ei));
+        }
+      }
+    }
+  }
+
+  /*
+   * Create goal of problem.
+   */
+  Action* goal_action;
+  if (params->ground_actions) {
+    goal_action = new GroundAction("", false);
+    const Formula& goal_formula =
+        problem.goal().instantiation(std::map<Variable, Term>(), problem);
+    goal_action->set_condition(goal_formula);
+  } else {
+    goal_action = new ActionSchema("", false);
+    goal_action->set_condition(problem.goal());
+  }
+  context->goal_action = goal_action;
+
+  stats.flaw_orders.resize(params->flaw_orders.size());
+  /* Flaw selection order that concluded a portfolio search. */
+  size_t winner = params->flaw_orders.size();
+  /* The plan to return. */
+  const Plan* current_plan;
+  if (params->portfolio && params->flaw_orders.size() > 1) {
+    /*
+     * Search with each flaw selection order in its own thread, and
+     * stop all threads as soon as one of them finds a complete plan
+     * or proves that the problem lacks solution.  In an anytime
+     * search, the threads share the best plan, and are stopped as
+     * soon as one of them proves it optimal.
+     */
+    size_t n = params->flaw_orders.size();
+    std::vector<const Plan*> initial_plans(n);
+    std::vector<const Plan*> results(n, NULL);
+    std::vector<SearchStatistics> worker_stats(n);
+    std::vector<std::exception_ptr> errors(n);
+    std::atomic<bool> stop(false);
+    for (size_t i = 0; i < n; i++) {
+      initial_plans[i] = make_initial_plan(problem);
+      if (initial_plans[i] != NULL) {
+        initial_plans[i]->id_ = 0;
+      }
+    }
+    /* Shared state is synchronized while the workers run. */
+    Threads::Scope threads_scope;
+    std::vector<std::thread> workers;
+    PlannerContext* shared_context = context;
+    for (size_t i = 0; i < n; i++) {
+      workers.push_back(std::thread([&, i]() {
+        context = shared_context;
+        try {
+          results[i] = search(initial_plans[i], std::vector<size_t>(1, i),
+                              timer, stop, i == 0, last_problem,
+                              worker_stats[i]);
+          if ((results[i] == NULL || results[i]->complete())
+              && !stop.exchange(true)) {
+            winner = i;
+          }
+        } catch (...) {
+          errors[i] = std::current_exception();
+          stop = true;
+        }
+      }));
+    }
+    for (size_t i = 0; i < n; i++) {
+      workers[i].join();
+      stats += worker_stats[i];
+    }
+    size_t chosen = (winner < n) ? winner : 0;
+    if (params->anytime) {
+      results[chosen] = best_plan(results[chosen], initial_plans[chosen],
+                                  winner < n, stats);
+    }
+    current_plan = results[chosen];
+    if (!last_problem) {
+      for (size_t i = 0; i < n; i++) {
+        if (i != chosen) {
+          if (results[i] != initial_plans[i]) {
+            delete results[i];
+          }
+          delete initial_plans[i];
+        } else if (current_plan != initial_plans[i]) {
+          delete initial_plans[i];
+        }
+      }
+    }
+    for (size_t i = 0; i < n; i++) {
+      if (errors[i]) {
+        std::rethrow_exception(errors[i]);
+      }
+    }
+  } else {
+    /*
+     * Interleave the flaw selection orders in a single thread, or
+     * distribute the search with a single flaw selection order over
+     * several threads.
+     */
+    std::vector<size_t> flaw_orders;
+    for (size_t i = 0; i < params->flaw_orders.size(); i++) {
+      flaw_orders.push_back(i);
+    }
+    /* Construct the initial plan. */
+    const Plan* initial_plan = make_initial_plan(problem);
+    if (initial_plan != NULL) {
+      initial_plan->id_ = 0;
+    }
+    if (params->parallel_search() && initial_plan != NULL
+        && !initial_plan->complete()) {
+      current_plan = parallel_search(initial_plan, params->search_threads,
+                                     timer, last_problem, stats);
+    } else {
+      std::atomic<bool> stop(false);
+      current_plan = search(initial_plan, flaw_orders, timer, stop, true,
+                            last_problem, stats);
+    }
+    if (params->anytime) {
+      bool exhausted = (current_plan == NULL || current_plan->complete());
+      current_plan = best_plan(current_plan, initial_plan, exhausted, stats);
+    }
+    if (!last_problem && current_plan != initial_plan) {
+      delete initial_plan;
     }
   }
-  if (need_pg) {
-    planning_graph = new PlanningGraph(problem, *params);
-  } else {
-    planning_graph = NULL;
+  if (!last_problem) {
+    release_search_memory();
   }
-  if (!params->ground_actions) {
-    achieves_pred.clear();
-    achieves_neg_pred.clear();
-    for (std::map<std::string, const ActionSchema*>::const_iterator ai =
-             domain->actions().begin();
-         ai != domain->actions().end(); ai++) {
-      const ActionSchema* as = (*ai).second;
-      for (EffectList::const_iterator ei = as->effects().begin();
-           ei != as->effects().end(); ei++) {
-        const Literal& literal = (*ei)->literal();
-        if (typeid(literal) == typeid(Atom)) {
-          achieves_pred[literal.predicate()].insert(std::make_pair(as, *ei));
-        } else {
-          achieves_neg_pred[literal.predicate()].insert(std::make_pair(as,
-                                                                       *ei));
-        }
-      }
+  if (verbosity > 0) {
+    /*
+     * Print statistics.
+     */
+    std::cerr << std::endl << "Plans generated: " << stats.num_generated_plans;
+    if (stats.num_static > 0) {
+      std::cerr << " [" << (stats.num_generated_plans - stats.num_static)
+                << "]";
     }
-    const GroundAction& ia = problem.init_action();
-    for (EffectList::const_iterator ei = ia.effects().begin();
-         ei != ia.effects().end(); ei++) {
-      const Literal& literal = (*ei)->literal();
-      achieves_pred[literal.predicate()].insert(std::make_pair(&ia, *ei));
+    std::cerr << std::endl << "Plans visited: " << stats.num_visited_plans;
+    if (stats.num_static > 0) {
+      std::cerr << " [" << (stats.num_visited_plans - stats.num_static) << "]";
     }
-    for (TimedActionTable::const_iterator ai = problem.timed_actions().begin();
-         ai != problem.timed_actions().end(); ai++) {
-      const GroundAction& action = *(*ai).second;
-      for (EffectList::const_iterator ei = action.effects().begin();
-           ei != action.effects().end(); ei++) {
-        const Literal& literal = (*ei)->literal();
-        if (typeid(literal) == typeid(Atom)) {
-          achieves_pred[literal.predicate()].insert(std::make_pair(&action,
-                                                                   *ei));
-        } else {
-          achieves_neg_pred[literal.predicate()].insert(std::make_pair(&action,
-                                                                       *ei));
-        }
-      }
+    std::cerr << std::endl << "Dead ends encountered: " << stats.num_dead_ends
+              << std::endl;
+    if (params->detect_duplicates) {
+      size_t num_checked = stats.num_duplicates + stats.num_generated_plans;
+      std::cerr << "Duplicate plans discarded: " << stats.num_duplicates
+                << " (" << (100.0*stats.num_duplicates/num_checked) << "%)"
+                << std::endl;
+    }
+    size_t num_unifications =
+      stats.num_unifier_hits + stats.num_unifier_misses;
+    if (num_unifications > 0) {
+      std::cerr << "Unifier cache hits: " << stats.num_unifier_hits
+                << " (" << (100.0*stats.num_unifier_hits/num_unifications)
+                << "%)" << std::endl;
+    }
+    if (stats.num_spilled_plans > 0) {
+      std::cerr << "Plans spilled to disk: " << stats.num_spilled_plans
+                << " (" << stats.num_reloaded_plans << " reloaded)"
+                << std::endl;
+    }
+    if (winner < params->flaw_orders.size()) {
+      std::cerr << "Search concluded by flaw order: " << winner << std::endl;
     }
   }
+  /* Return last plan, or NULL if problem does not have a solution. */
+  return current_plan;
+}
+
+
+/* Searches for a complete plan starting from the given initial plan,
+   using the flaw selection orders with the given indices. */
+const Plan* Plan::search(const Plan* initial_plan,
+                         const std::vector<size_t>& flaw_orders,
+                         const Timer<>& timer, const std::atomic<bool>& stop,
+                         bool show_progress, bool last_problem,
+                         SearchStatistics& stats) {
   static_pred_flaw = false;
+  /* Planning parameters. */
+  const Parameters* params = context->params;
 
   /* Number of visited plan. */
-  size_t num_visited_plans = 0;
+  size_t& num_visited_plans = stats.num_visited_plans;
   /* Number of generated plans. */
-  size_t num_generated_plans = 0;
+  size_t& num_generated_plans = stats.num_generated_plans;
   /* Number of static preconditions encountered. */
-  size_t num_static = 0;
+  size_t& num_static = stats.num_static;
   /* Number of dead ends encountered. */
-  size_t num_dead_ends = 0;
+  size_t& num_dead_ends = stats.num_dead_ends;
+  /* Number of duplicate plans discarded. */
+  size_t& num_duplicates = stats.num_duplicates;
+  /* Whether to collect phase timings. */
+  const bool timing = params->timing();
+  /* Unifier cache counters of this thread before the search. */
+  const size_t unifier_hits = Bindings::unifier_cache_hits();
+  const size_t unifier_misses = Bindings::unifier_cache_misses();
+  stats.flaw_orders.resize(params->flaw_orders.size());
 
   /* Generated plans for different flaw selection orders. */
-  std::vector<size_t> generated_plans(params->flaw_orders.size(), 0);
+  std::vector<size_t> generated_plans(flaw_orders.size(), 0);
   /* Queues of pending plans. */
-  std::vector<PlanQueue> plans(params->flaw_orders.size(), PlanQueue());
-  /* Dead plan queues. */
-  std::vector<PlanQueue*> dead_queues;
-  /* Construct the initial plan. */
-  const Plan* initial_plan = make_initial_plan(problem);
-  if (initial_plan != NULL) {
-    initial_plan->id_ = 0;
-  }
+  std::vector<PlanQueue> plans(flaw_orders.size(), PlanQueue());
+  /* Queued plans whose refinements are built when they are dequeued,
+     for different flaw selection orders. */
+  std::vector<PendingRefinementsMap> pending(flaw_orders.size());
+  /* Signatures of generated plans for different flaw selection orders. */
+  std::vector<PlanSignatureSet> signatures(params->detect_duplicates
+                                           ? flaw_orders.size() : 0);
+  /* Whether to spill pending plans to disk when over the memory limit. */
+  const bool spill_plans = params->spill_plans();
+  /* Files of spilled plans for different flaw selection orders. */
+  std::vector<PlanSpillFile> spills(flaw_orders.size());
+  /* Number of pending plans kept in memory before spilling, set when
+     the memory limit is first reached. */
+  size_t frontier_cap = 0;
 
   /* Variable for progress bar (number of generated plans). */
   size_t last_dot = 0;
@@ -609,13 +1655,14 @@ const Plan* Plan::plan(const Problem& problem, const Parameters& p,
    * Search for complete plan.
    */
   size_t current_flaw_order = 0;
-  size_t flaw_orders_left = params->flaw_orders.size();
+  size_t flaw_orders_left = flaw_orders.size();
   size_t next_switch = 1000;
   const Plan* current_plan = initial_plan;
   generated_plans[current_flaw_order]++;
   num_generated_plans++;
   if (verbosity > 1) {
-    std::cerr << "using flaw order " << current_flaw_order << std::endl;
+    std::cerr << "using flaw order " << flaw_orders[current_flaw_order]
+              << std::endl;
   }
   float f_limit;
   if (current_plan != NULL
@@ -624,21 +1671,187 @@ const Plan* Plan::plan(const Problem& problem, const Parameters& p,
   } else {
     f_limit = std::numeric_limits<float>::infinity();
   }
+
+  if (params->anytime && current_plan != NULL && current_plan->complete()) {
+    keep_plan(*current_plan);
+  }
   do {
     float next_f_limit = std::numeric_limits<float>::infinity();
-    while (current_plan != NULL && !current_plan->complete()) {
-      /* Do a little amortized cleanup of dead queues. */
-      for (size_t dq = 0; dq < 4 && !dead_queues.empty(); dq++) {
-        PlanQueue& dead_queue = *dead_queues.back();
-        delete dead_queue.top();
-        dead_queue.pop();
-        if (dead_queue.empty()) {
-          dead_queues.pop_back();
+
+    /* Returns true if the given newly generated plan should be added
+       to the search space, in which case it is assigned an id and
+       ranked; otherwise the plan is deleted. */
+    auto accept_plan = [&](const Plan& new_plan) {
+      size_t flaw_order = flaw_orders[current_flaw_order];
+      if (params->detect_duplicates
+          && !signatures[current_flaw_order].insert(new_plan.signature())) {
+        num_duplicates++;
+        delete &new_plan;
+        return false;
+      }
+      /* N.B. Must set id before computing rank, because it may be used. */
+      new_plan.id_ = num_generated_plans;
+      if (timing) {
+        Timer<> ranking_timer;
+        new_plan.primary_rank();
+        stats.ranking_time += ranking_timer.ElapsedTime();
+      }
+      if (new_plan.primary_rank() == std::numeric_limits<float>::infinity()
+          || (generated_plans[current_flaw_order]
+              >= params->search_limits[flaw_order])
+          || cannot_improve(new_plan)) {
+        delete &new_plan;
+        return false;
+      }
+      if (params->search_algorithm == Parameters::IDA_STAR
+          && new_plan.primary_rank() > f_limit) {
+        next_f_limit = std::min(next_f_limit, new_plan.primary_rank());
+        delete &new_plan;
+        return false;
+      }
+      generated_plans[current_flaw_order]++;
+      num_generated_plans++;
+      if (verbosity > 2) {
+        std::cerr << std::endl << "####CHILD (id " << new_plan.id_ << ")"
+                  << " with rank (" << new_plan.primary_rank();
+        for (size_t ri = 1; ri < new_plan.rank_.size(); ri++) {
+          std::cerr << ',' << new_plan.rank_[ri];
+        }
+        std::cerr << "):" << std::endl << new_plan << std::endl;
+      }
+      return true;
+    };
+
+    /* Keeps the given number of most promising plans in the given
+       queue, and spills the rest to disk. */
+    auto spill_queue = [&](size_t i, size_t keep) {
+      PlanQueue& queue = plans[i];
+      std::vector<const Plan*> kept;
+      while (kept.size() < keep && !queue.empty()) {
+        kept.push_back(queue.top());
+        queue.pop();
+      }
+      while (!queue.empty()) {
+        const Plan* plan = queue.top();
+        SpilledPlan spilled;
+        spilled.rank = plan->rank_;
+        spilled.id = plan->id_;
+        for (const Chain<std::pair<size_t, size_t> >* pc = plan->path_;
+             pc != NULL; pc = pc->tail) {
+          spilled.path.push_back(pc->head.second);
+          spilled.path.push_back(pc->head.first);
+        }
+        std::reverse(spilled.path.begin(), spilled.path.end());
+        spills[i].write(spilled);
+        stats.num_spilled_plans++;
+        delete plan;
+        queue.pop();
+      }
+      for (size_t k = 0; k < kept.size(); k++) {
+        queue.push(kept[k]);
+      }
+    };
+
+    /* Loads the most promising spilled plans back into the given
+       queue. */
+    auto reload_queue = [&](size_t i) {
+      std::vector<SpilledPlan> spilled;
+      spills[i].read(spilled);
+      std::sort(spilled.begin(), spilled.end(), more_promising);
+      size_t n = std::min(spilled.size(),
+                          std::max<size_t>(frontier_cap/2, 1));
+      for (size_t k = 0; k < spilled.size(); k++) {
+        if (k >= n) {
+          spills[i].write(spilled[k]);
+          continue;
+        }
+        const Plan* plan = initial_plan->replay(spilled[k].path);
+        if (plan == NULL || plan == initial_plan) {
+          throw std::logic_error("cannot replay spilled plan");
+        }
+        /* N.B. Must set id before computing rank, because it may be
+           used. */
+        plan->id_ = spilled[k].id;
+        plan->primary_rank();
+        plans[i].push(plan);
+        stats.num_reloaded_plans++;
+      }
+    };
+
+    /* Removes the next plan from the queue of the current flaw
+       selection order, or returns NULL if the queue is empty. */
+    auto next_plan = [&]() -> const Plan* {
+      PlanQueue& queue = plans[current_flaw_order];
+      PlanSpillFile& spill = spills[current_flaw_order];
+      while (true) {
+        /* Spilled plans are visited in the same order as if they had
+           been kept in memory. */
+        while (spill.size() > 0
+               && (queue.empty()
+                   || rank_less(spill.front(), queue.top()->rank_))) {
+          reload_queue(current_flaw_order);
+        }
+        if (queue.empty()) {
+          return NULL;
+        }
+        const Plan* plan = queue.top();
+        queue.pop();
+        PendingRefinementsMap::iterator pi =
+          pending[current_flaw_order].find(plan);
+        /* The best plan may have improved since the plan was queued. */
+        if (cannot_improve(*plan)) {
+          if (pi != pending[current_flaw_order].end()) {
+            pending[current_flaw_order].erase(pi);
+          }
+          if (plan != initial_plan) {
+            delete plan;
+          }
+          continue;
+        }
+        if (pi == pending[current_flaw_order].end()) {
+          return plan;
+        }
+        /* Build the next refinement of a plan queued in place of its
+           refinements, and queue the plan again if it has more. */
+        PendingRefinements& refinements = pi->second;
+        Timer<> phase_timer;
+        size_t n;
+        const Plan* new_plan =
+          plan->refinement(*refinements.flaw, refinements.next++, n);
+        if (timing) {
+          stats.refinement_time += phase_timer.ElapsedTime();
+        }
+        if (new_plan != NULL && accept_plan(*new_plan)) {
+          if (!refinements.added && refinements.static_flaw) {
+            num_static++;
+          }
+          refinements.added = true;
+        } else {
+          new_plan = NULL;
+        }
+        if (refinements.next < n) {
+          queue.push(plan);
+        } else {
+          if (!refinements.added) {
+            num_dead_ends++;
+            stats.flaw_orders[flaw_orders[current_flaw_order]]
+              .num_dead_ends++;
+          }
+          pending[current_flaw_order].erase(pi);
+          if (plan != initial_plan) {
+            delete plan;
+          }
+        }
+        if (new_plan != NULL) {
+          return new_plan;
         }
       }
+    };
+
+    while (current_plan != NULL && !current_plan->complete()) {
       const auto elapsed_time = timer.ElapsedTime();
-      if (elapsed_time >= params->time_limit) {
-        /* Time limit exceeded. */
+      if (elapsed_time >= params->time_limit || stop) {
+        /* Time limit exceeded, or search stopped. */
         break;
       }
 
@@ -646,7 +1859,7 @@ const Plan* Plan::plan(const Problem& problem, const Parameters& p,
        * Visiting a new plan.
        */
       num_visited_plans++;
-      if (verbosity == 1) {
+      if (verbosity == 1 && show_progress) {
         while (num_generated_plans - num_static - last_dot >= 1000) {
           std::cerr << '.';
           last_dot += 1000;
@@ -665,56 +1878,97 @@ const Plan* Plan::plan(const Problem& problem, const Parameters& p,
         }
         std::cerr << ")" << std::endl << *current_plan << std::endl;
       }
-      /* List of children to current plan. */
-      PlanList refinements;
-      /* Get plan refinements. */
-      current_plan->refinements(refinements,
-                                params->flaw_orders[current_flaw_order]);
-      /* Add children to queue of pending plans. */
-      bool added = false;
-      for (PlanList::const_iterator pi = refinements.begin();
-           pi != refinements.end(); pi++) {
-        const Plan& new_plan = **pi;
-        /* N.B. Must set id before computing rank, because it may be used. */
-        new_plan.id_ = num_generated_plans;
-        if (new_plan.primary_rank() != std::numeric_limits<float>::infinity()
-            && (generated_plans[current_flaw_order]
-                < params->search_limits[current_flaw_order])) {
-          if (params->search_algorithm == Parameters::IDA_STAR
-              && new_plan.primary_rank() > f_limit) {
-            next_f_limit = std::min(next_f_limit, new_plan.primary_rank());
-            delete &new_plan;
-            continue;
+      /* Index of current flaw selection order among all orders. */
+      size_t flaw_order = flaw_orders[current_flaw_order];
+      FlawOrderStatistics& flaw_order_stats = stats.flaw_orders[flaw_order];
+      flaw_order_stats.num_visited_plans++;
+      /* Select a flaw and get plan refinements. */
+      Timer<> phase_timer;
+      const Flaw& flaw =
+        current_plan->get_flaw(params->flaw_orders[flaw_order]);
+      if (timing) {
+        stats.flaw_selection_time += phase_timer.ElapsedTime();
+        phase_timer = Timer<>();
+      }
+      /* Whether the current plan is queued in place of its
+         refinements. */
+      bool current_queued = params->lazy_refinements;
+      if (current_queued) {
+        /* Queue the plan in place of its refinements, which are
+           ranked as the plan until they are built. */
+        PendingRefinements& refinements =
+          pending[current_flaw_order][current_plan];
+        refinements.flaw = &flaw;
+        refinements.next = 0;
+        refinements.static_flaw = static_pred_flaw;
+        refinements.added = false;
+        plans[current_flaw_order].push(current_plan);
+      } else {
+        /* List of children to current plan. */
+        PlanList refinements;
+        current_plan->refinements(refinements, flaw);
+        if (timing) {
+          stats.refinement_time += phase_timer.ElapsedTime();
+        }
+        /* Add children to queue of pending plans. */
+        bool added = false;
+        for (PlanList::const_iterator pi = refinements.begin();
+             pi != refinements.end(); pi++) {
+          const Plan& new_plan = **pi;
+          if (accept_plan(new_plan)) {
+            if (!added && static_pred_flaw) {
+              num_static++;
+            }
+            added = true;
+            plans[current_flaw_order].push(&new_plan);
           }
-          if (!added && static_pred_flaw) {
-            num_static++;
+        }
+        if (!added) {
+          num_dead_ends++;
+          flaw_order_stats.num_dead_ends++;
+        }
+      }
+      flaw_order_stats.peak_queue_size =
+        std::max(flaw_order_stats.peak_queue_size,
+                 plans[current_flaw_order].size());
+      size_t queue_size = 0;
+      for (size_t i = 0; i < plans.size(); i++) {
+        queue_size += plans[i].size();
+      }
+      stats.peak_queue_size = std::max(stats.peak_queue_size, queue_size);
+      if (spill_plans
+          && (frontier_cap > 0
+              ? queue_size > frontier_cap
+              : (num_visited_plans % 256 == 0
+                 && resident_megabytes() >= params->memory_limit))) {
+        /* Over the memory limit: spill the least promising half of
+           the pending plans to disk. */
+        if (frontier_cap == 0) {
+          frontier_cap = std::max<size_t>(queue_size, 1024);
+          if (verbosity > 1) {
+            std::cerr << "memory limit reached with " << queue_size
+                      << " pending plans" << std::endl;
           }
-          added = true;
-          plans[current_flaw_order].push(&new_plan);
-          generated_plans[current_flaw_order]++;
-          num_generated_plans++;
-          if (verbosity > 2) {
-            std::cerr << std::endl << "####CHILD (id " << new_plan.id_ << ")"
-                      << " with rank (" << new_plan.primary_rank();
-            for (size_t ri = 1; ri < new_plan.rank_.size(); ri++) {
-              std::cerr << ',' << new_plan.rank_[ri];
+        }
+        for (size_t i = 0; i < plans.size(); i++) {
+          if (generated_plans[i] < params->search_limits[flaw_orders[i]]) {
+            spill_queue(i, plans[i].size()/2);
+          } else {
+            /* Dead queues are discarded now, not spilled. */
+            while (!plans[i].empty()) {
+              delete plans[i].top();
+              plans[i].pop();
             }
-            std::cerr << "):" << std::endl << new_plan << std::endl;
           }
-        } else {
-          delete &new_plan;
         }
       }
-      if (!added) {
-        num_dead_ends++;
-      }
 
       /*
        * Process next plan.
        */
       bool limit_reached = false;
       if ((limit_reached = (generated_plans[current_flaw_order]
-                            >= params->search_limits[current_flaw_order]))
+                            >= params->search_limits[flaw_order]))
           || generated_plans[current_flaw_order] >= next_switch) {
         if (verbosity > 1) {
           std::cerr << "time to switch ("
@@ -722,8 +1976,9 @@ const Plan* Plan::plan(const Problem& problem, const Parameters& p,
         }
         if (limit_reached) {
           flaw_orders_left--;
-          /* Discard the rest of the plan queue. */
-          dead_queues.push_back(&plans[current_flaw_order]);
+          /* The rest of the plan queue is discarded at the end of the
+             search. */
+          spills[current_flaw_order].clear();
         }
         if (flaw_orders_left > 0) {
           do {
@@ -732,14 +1987,14 @@ const Plan* Plan::plan(const Problem& problem, const Parameters& p,
               std::cerr << "use flaw order "
                         << current_flaw_order << "?" << std::endl;
             }
-            if (current_flaw_order >= params->flaw_orders.size()) {
+            if (current_flaw_order >= flaw_orders.size()) {
               current_flaw_order = 0;
               next_switch *= 2;
             }
           } while ((generated_plans[current_flaw_order]
-                    >= params->search_limits[current_flaw_order]));
+                    >= params->search_limits[flaw_orders[current_flaw_order]]));
           if (verbosity > 1) {
-            std::cerr << "using flaw order " << current_flaw_order
+            std::cerr << "using flaw order " << flaw_orders[current_flaw_order]
                       << std::endl;
           }
         }
@@ -750,43 +2005,47 @@ const Plan* Plan::plan(const Problem& problem, const Parameters& p,
           generated_plans[current_flaw_order]++;
           num_generated_plans++;
         } else {
-          if (current_plan != initial_plan) {
+          if (current_plan != initial_plan && !current_queued) {
             delete current_plan;
           }
-          if (plans[current_flaw_order].empty()) {
-            /* Problem lacks solution. */
-            current_plan = NULL;
-          } else {
-            current_plan = plans[current_flaw_order].top();
-            plans[current_flaw_order].pop();
-          }
+          /* Problem lacks solution if there is no next plan. */
+          current_plan = next_plan();
         }
         /*
          * Instantiate all actions if the plan is otherwise complete.
+         * An anytime search keeps the complete plan if it is the
+         * cheapest so far, and goes on with the next plan.
          */
         bool instantiated = params->ground_actions;
-        while (current_plan != NULL && current_plan->complete()
-               && !instantiated) {
-          const Bindings* new_bindings =
-            step_instantiation(current_plan->steps(), 0,
-                               *current_plan->bindings_);
-          if (new_bindings != NULL) {
-            instantiated = true;
-            if (new_bindings != current_plan->bindings_) {
-              const Plan* inst_plan =
-                new Plan(current_plan->steps(), current_plan->num_steps(),
-                         current_plan->links(), current_plan->num_links(),
-                         current_plan->orderings(), *new_bindings,
-                         NULL, 0, NULL, 0, NULL, current_plan);
+        while (current_plan != NULL && current_plan->complete()) {
+          if (!instantiated) {
+            const Bindings* new_bindings =
+              step_instantiation(current_plan->steps(),
+                                 *current_plan->bindings_);
+            if (new_bindings != NULL) {
+              instantiated = true;
+              if (new_bindings != current_plan->bindings_) {
+                const Plan* inst_plan =
+                  new Plan(current_plan->steps(), current_plan->num_steps(),
+                           current_plan->links(), current_plan->num_links(),
+                           current_plan->orderings(), *new_bindings,
+                           NULL, 0, NULL, 0, NULL, current_plan);
+                delete current_plan;
+                current_plan = inst_plan;
+              }
+            } else {
+              /* Problem lacks solution if there is no next plan. */
+              current_plan = next_plan();
+            }
+          } else if (params->anytime) {
+            keep_plan(*current_plan);
+            if (current_plan != initial_plan) {
               delete current_plan;
-              current_plan = inst_plan;
             }
-          } else if (plans[current_flaw_order].empty()) {
-            /* Problem lacks solution. */
-            current_plan = NULL;
+            current_plan = next_plan();
+            instantiated = params->ground_actions;
           } else {
-            current_plan = plans[current_flaw_order].top();
-            plans[current_flaw_order].pop();
+            break;
           }
         }
       } else {
@@ -799,61 +2058,426 @@ const Plan* Plan::plan(const Problem& problem, const Parameters& p,
     if (current_plan != NULL && current_plan->complete()) {
       break;
     }
-    f_limit = next_f_limit;
+    f_limit = stop ? std::numeric_limits<float>::infinity() : next_f_limit;
     if (f_limit != std::numeric_limits<float>::infinity()) {
       /* Restart search. */
+      for (size_t i = 0; i < signatures.size(); i++) {
+        signatures[i].clear();
+      }
       if (current_plan != NULL && current_plan != initial_plan) {
         delete current_plan;
       }
       current_plan = initial_plan;
     }
   } while (f_limit != std::numeric_limits<float>::infinity());
-  if (verbosity > 0) {
-    /*
-     * Print statistics.
-     */
-    std::cerr << std::endl << "Plans generated: " << num_generated_plans;
-    if (num_static > 0) {
-      std::cerr << " [" << (num_generated_plans - num_static) << "]";
-    }
-    std::cerr << std::endl << "Plans visited: " << num_visited_plans;
-    if (num_static > 0) {
-      std::cerr << " [" << (num_visited_plans - num_static) << "]";
-    }
-    std::cerr << std::endl << "Dead ends encountered: " << num_dead_ends
-              << std::endl;
-  }
   /*
-   * Discard the rest of the plan queue and some other things, unless
-   * this is the last problem in which case we can save time by just
-   * letting the operating system reclaim the memory for us.
+   * Discard the rest of the plan queues, including those of flaw
+   * orders that reached their search limit, unless this is the last
+   * problem in which case we can save time by just letting the
+   * operating system reclaim the memory for us.
    */
   if (!last_problem) {
-    if (current_plan != initial_plan) {
-      delete initial_plan;
-    }
     for (size_t i = 0; i < plans.size(); i++) {
       while (!plans[i].empty()) {
-        delete plans[i].top();
+        /* The initial plan and the last plan may be queued in place of
+           their refinements. */
+        if (plans[i].top() != initial_plan
+            && plans[i].top() != current_plan) {
+          delete plans[i].top();
+        }
         plans[i].pop();
       }
     }
   }
+  for (size_t i = 0; i < flaw_orders.size(); i++) {
+    stats.flaw_orders[flaw_orders[i]].num_generated_plans +=
+      generated_plans[i];
+  }
+  stats.num_unifier_hits += Bindings::unifier_cache_hits() - unifier_hits;
+  stats.num_unifier_misses +=
+    Bindings::unifier_cache_misses() - unifier_misses;
   /* Return last plan, or NULL if problem does not have a solution. */
   return current_plan;
 }
 
 
+/* Searches for a complete plan starting from the given initial plan,
+   with the first flaw selection order, in the given number of
+   threads. */
+const Plan* Plan::parallel_search(const Plan* initial_plan,
+                                  size_t num_threads, const Timer<>& timer,
+                                  bool last_problem,
+                                  SearchStatistics& stats) {
+  /* Planning parameters. */
+  const Parameters* params = context->params;
+  /* Whether to collect phase timings. */
+  const bool timing = params->timing();
+  /* Search limit of the flaw selection order. */
+  const size_t search_limit = params->search_limits[0];
+
+  /* Mailboxes of the threads. */
+  std::vector<PlanMailbox> mailboxes(num_threads);
+  std::vector<SearchStatistics> worker_stats(num_threads);
+  std::vector<std::exception_ptr> errors(num_threads);
+  /* Number of plans generated by all threads. */
+  std::atomic<size_t> num_generated(1);
+  /* Next plan id. */
+  std::atomic<size_t> next_id(1);
+  /* Number of plans sent to a mailbox and not yet visited or
+     discarded; the search space is exhausted when it drops to zero. */
+  std::atomic<size_t> num_pending(1);
+  std::atomic<bool> stop(false);
+  /* The complete plan found, if any. */
+  const Plan* complete_plan = NULL;
+  /* Wakes up the waiting threads after the search was stopped or ran
+     out of pending plans. */
+  auto wake_all = [&]() {
+    for (size_t k = 0; k < num_threads; k++) {
+      mailboxes[k].notify();
+    }
+  };
+
+  stats.num_generated_plans++;
+  stats.flaw_orders[0].num_generated_plans++;
+  mailboxes[initial_plan->route_hash_ % num_threads].send(initial_plan,
+                                                         NULL);
+
+  /* Shared state is synchronized while the workers run. */
+  Threads::Scope threads_scope;
+  std::vector<std::thread> workers;
+  PlannerContext* shared_context = context;
+  for (size_t i = 0; i < num_threads; i++) {
+    workers.push_back(std::thread([&, i]() {
+      context = shared_context;
+      static_pred_flaw = false;
+      SearchStatistics& worker = worker_stats[i];
+      worker.flaw_orders.resize(params->flaw_orders.size());
+      FlawOrderStatistics& flaw_order_stats = worker.flaw_orders[0];
+      const size_t unifier_hits = Bindings::unifier_cache_hits();
+      const size_t unifier_misses = Bindings::unifier_cache_misses();
+      /* Pending plans owned by this thread. */
+      PlanQueue plans;
+      /* Signatures of the plans sent to this thread. */
+      PlanSignatureSet signatures;
+      /* Plans received from the mailbox of this thread. */
+      std::vector<std::pair<const Plan*, PlanVisit*> > messages;
+      /* Variables for progress bar. */
+      size_t last_dot = 0;
+      std::chrono::minutes next_hash(1);
+
+      /* Discards the given plan, which is no longer pending. */
+      auto discard_plan = [&](const Plan* plan) {
+        if (plan != initial_plan) {
+          delete plan;
+        }
+        if (--num_pending == 0) {
+          wake_all();
+        }
+      };
+
+      /* Records that a child of the given visit was added to the search
+         space or discarded, and counts the visit as a static open
+         condition or a dead end like the serial search. */
+      auto resolve_visit = [&](PlanVisit* visit, bool added) {
+        if (visit == NULL) {
+          return;
+        }
+        if (added && !visit->added.exchange(true) && visit->static_flaw) {
+          worker.num_static++;
+        }
+        if (--visit->num_pending == 0) {
+          if (!visit->added) {
+            worker.num_dead_ends++;
+            flaw_order_stats.num_dead_ends++;
+          }
+          delete visit;
+        }
+      };
+
+      try {
+        while (!stop) {
+          const auto elapsed_time = timer.ElapsedTime();
+          if (elapsed_time >= params->time_limit) {
+            stop = true;
+            wake_all();
+            break;
+          }
+          if (verbosity == 1 && i == 0) {
+            while (num_generated - last_dot >= 1000) {
+              std::cerr << '.';
+              last_dot += 1000;
+            }
+            while (elapsed_time >= next_hash) {
+              std::cerr << '#';
+              ++next_hash;
+            }
+          }
+
+          /*
+           * Rank the plans sent to this thread, and add them to the
+           * queue of pending plans.
+           */
+          mailboxes[i].receive(messages);
+          for (size_t k = 0; k < messages.size(); k++) {
+            const Plan* plan = messages[k].first;
+            PlanVisit* visit = messages[k].second;
+            if (params->detect_duplicates
+                && !signatures.insert(plan->signature())) {
+              worker.num_duplicates++;
+              resolve_visit(visit, false);
+              discard_plan(plan);
+              continue;
+            }
+            if (plan != initial_plan) {
+              Timer<> ranking_timer;
+              plan->primary_rank();
+              if (timing) {
+                worker.ranking_time += ranking_timer.ElapsedTime();
+              }
+              if (plan->primary_rank()
+                  == std::numeric_limits<float>::infinity()
+                  || num_generated >= search_limit || cannot_improve(*plan)) {
+                resolve_visit(visit, false);
+                discard_plan(plan);
+                continue;
+              }
+              num_generated++;
+              worker.num_generated_plans++;
+              flaw_order_stats.num_generated_plans++;
+            }
+            resolve_visit(visit, true);
+            plans.push(plan);
+          }
+          messages.clear();
+          worker.peak_queue_size =
+            std::max(worker.peak_queue_size, plans.size());
+          flaw_order_stats.peak_queue_size = worker.peak_queue_size;
+          if (plans.empty()) {
+            if (num_pending == 0) {
+              /* No thread has any plan left. */
+              break;
+            }
+            mailboxes[i].wait([&]() { return stop || num_pending == 0; });
+            continue;
+          }
+
+          /*
+           * Visit the most promising plan of this thread.
+           */
+          const Plan* current_plan = plans.top();
+          plans.pop();
+          /* The best plan may have improved since the plan was queued. */
+          if (cannot_improve(*current_plan)) {
+            discard_plan(current_plan);
+            continue;
+          }
+          if (current_plan->complete()) {
+            /* The initial plan is never complete here. */
+            if (!params->ground_actions) {
+              const Bindings* new_bindings =
+                step_instantiation(current_plan->steps(),
+                                   *current_plan->bindings_);
+              if (new_bindings == NULL) {
+                discard_plan(current_plan);
+                continue;
+              }
+              if (new_bindings != current_plan->bindings_) {
+                const Plan* inst_plan =
+                  new Plan(current_plan->steps(), current_plan->num_steps(),
+                           current_plan->links(), current_plan->num_links(),
+                           current_plan->orderings(), *new_bindings,
+                           NULL, 0, NULL, 0, NULL, current_plan);
+                inst_plan->id_ = current_plan->id_;
+                delete current_plan;
+                current_plan = inst_plan;
+              }
+            }
+            if (params->anytime) {
+              keep_plan(*current_plan);
+              discard_plan(current_plan);
+              continue;
+            }
+            if (!stop.exchange(true)) {
+              complete_plan = current_plan;
+              wake_all();
+            } else {
+              delete current_plan;
+            }
+            break;
+          }
+          worker.num_visited_plans++;
+          flaw_order_stats.num_visited_plans++;
+          Timer<> phase_timer;
+          const Flaw& flaw = current_plan->get_flaw(params->flaw_orders[0]);
+          if (timing) {
+            worker.flaw_selection_time += phase_timer.ElapsedTime();
+            phase_timer = Timer<>();
+          }
+          PlanList refinements;
+          current_plan->refinements(refinements, flaw);
+          if (timing) {
+            worker.refinement_time += phase_timer.ElapsedTime();
+          }
+          if (refinements.empty()) {
+            worker.num_dead_ends++;
+            flaw_order_stats.num_dead_ends++;
+          }
+          /* Send each child to the thread that owns its routing
+             hash.  The visit is counted by the threads that add or
+             discard the children. */
+          PlanVisit* visit = refinements.empty()
+            ? NULL : new PlanVisit(refinements.size(), static_pred_flaw);
+          for (PlanList::const_iterator pi = refinements.begin();
+               pi != refinements.end(); pi++) {
+            const Plan& new_plan = **pi;
+            /* N.B. Must set id before computing rank, because it may be
+               used. */
+            new_plan.id_ = next_id++;
+            num_pending++;
+            mailboxes[new_plan.route_hash_ % num_threads].send(&new_plan,
+                                                               visit);
+          }
+          discard_plan(current_plan);
+          if (num_generated >= search_limit) {
+            /* Search limit reached. */
+            stop = true;
+            wake_all();
+          }
+        }
+      } catch (...) {
+        errors[i] = std::current_exception();
+        stop = true;
+        wake_all();
+      }
+      if (!last_problem) {
+        while (!plans.empty()) {
+          if (plans.top() != initial_plan) {
+            delete plans.top();
+          }
+          plans.pop();
+        }
+      }
+      worker.num_unifier_hits += Bindings::unifier_cache_hits() - unifier_hits;
+      worker.num_unifier_misses +=
+        Bindings::unifier_cache_misses() - unifier_misses;
+    }));
+  }
+  for (size_t i = 0; i < num_threads; i++) {
+    workers[i].join();
+    stats += worker_stats[i];
+  }
+  /* Discard the plans still in transit, unless this is the last
+     problem. */
+  if (!last_problem) {
+    std::vector<std::pair<const Plan*, PlanVisit*> > messages;
+    for (size_t i = 0; i < num_threads; i++) {
+      mailboxes[i].receive(messages);
+    }
+    for (size_t k = 0; k < messages.size(); k++) {
+      if (messages[k].first != initial_plan) {
+        delete messages[k].first;
+      }
+      PlanVisit* visit = messages[k].second;
+      if (visit != NULL && --visit->num_pending == 0) {
+        delete visit;
+      }
+    }
+  }
+  for (size_t i = 0; i < num_threads; i++) {
+    if (errors[i]) {
+      delete complete_plan;
+      std::rethrow_exception(errors[i]);
+    }
+  }
+  if (complete_plan != NULL) {
+    return complete_plan;
+  }
+  /* Problem lacks solution if no plan is pending. */
+  return (num_pending == 0) ? NULL : initial_plan;
+}
+
+
+/* Keeps a copy of the given complete plan in an anytime search if it
+   is cheaper than the best plan found so far, and reports it. */
+void Plan::keep_plan(const Plan& plan) {
+  float cost = plan_cost(plan);
+  std::lock_guard<std::mutex> lock(context->best_mutex);
+  if (cost < context->best_cost) {
+    const Plan* best =
+      new Plan(plan.steps(), plan.num_steps(), plan.links(),
+               plan.num_links(), plan.orderings(), *plan.bindings_,
+               NULL, 0, NULL, 0, NULL, &plan);
+    best->id_ = plan.id_;
+    delete context->best_plan;
+    context->best_plan = best;
+    context->best_cost = cost;
+    if (verbosity > 1) {
+      std::cerr << "improved plan (id " << plan.id_ << ") with cost "
+                << cost << std::endl;
+    }
+    if (context->observer != NULL) {
+      context->observer->improved_plan(*best, cost);
+    }
+  }
+}
+
+
 /* Cleans up after planning. */
 void Plan::cleanup() {
-  if (planning_graph != NULL) {
-    delete planning_graph;
-    planning_graph = NULL;
+  if (context != NULL) {
+    if (context->own_planning_graph) {
+      delete context->planning_graph;
+    }
+    delete context->goal_action;
+    delete context->best_plan;
+    delete context;
+    context = NULL;
+    Bindings::clear_unifier_cache();
+    std::lock_guard<std::mutex> lock(planners_mutex);
+    num_active_planners--;
+    if (num_active_planners == 0) {
+      /* No plan refers to the variables added during the search
+         anymore, and no planner thread to the literals pinned while
+         the threads ran. */
+      TermTable::release_variables(num_problem_variables);
+      Literal::release_pinned();
+    }
+  }
+}
+
+
+/* Returns a well-mixed term of a routing hash for the given key. */
+static size_t route_term(uint64_t key) {
+  /* The finalizer of the SplitMix64 generator. */
+  key ^= key >> 30;
+  key *= 0xbf58476d1ce4e5b9ULL;
+  key ^= key >> 27;
+  key *= 0x94d049bb133111ebULL;
+  key ^= key >> 31;
+  return key;
+}
+
+
+/* Adds the routing hash terms of the given steps and links, up to but
+   not including the given tails, to the given hash.  Returns false if
+   a chain ends before its tail is reached. */
+static bool add_route_terms(size_t& hash, const Chain<Step>* steps,
+                            const Chain<Link>* links,
+                            const Chain<Step>* step_tail,
+                            const Chain<Link>* link_tail) {
+  for (; steps != step_tail; steps = steps->tail) {
+    if (steps == NULL) {
+      return false;
+    }
+    hash += route_term(2*uint64_t(steps->head.action().id()));
   }
-  if (goal_action != NULL) {
-    delete goal_action;
-    goal_action = NULL;
+  for (; links != link_tail; links = links->tail) {
+    if (links == NULL) {
+      return false;
+    }
+    hash += route_term(2*uint64_t(links->head.condition().id()) + 1);
   }
+  return true;
 }
 
 
@@ -861,15 +2485,17 @@ void Plan::cleanup() {
 Plan::Plan(const Chain<Step>* steps, size_t num_steps,
            const Chain<Link>* links, size_t num_links,
            const Orderings& orderings, const Bindings& bindings,
-           const Chain<Unsafe>* unsafes, size_t num_unsafes,
-           const Chain<OpenCondition>* open_conds, size_t num_open_conds,
+           const FlawSet<Unsafe>* unsafes, size_t num_unsafes,
+           const FlawSet<OpenCondition>* open_conds, size_t num_open_conds,
            const Chain<MutexThreat>* mutex_threats, const Plan* parent)
   : steps_(steps), num_steps_(num_steps),
     links_(links), num_links_(num_links),
     orderings_(&orderings), bindings_(&bindings),
     unsafes_(unsafes), num_unsafes_(num_unsafes),
     open_conds_(open_conds), num_open_conds_(num_open_conds),
-    mutex_threats_(mutex_threats) {
+    mutex_threats_(mutex_threats),
+    threat_index_((parent != NULL) ? parent->threat_index_ : NULL),
+    path_(NULL) {
   RCObject::ref(steps);
   RCObject::ref(links);
   Orderings::register_use(&orderings);
@@ -877,6 +2503,18 @@ Plan::Plan(const Chain<Step>* steps, size_t num_steps,
   RCObject::ref(unsafes);
   RCObject::ref(open_conds);
   RCObject::ref(mutex_threats);
+  RCObject::ref(threat_index_);
+  /* Only the steps and links added to those of the parent plan are
+     hashed, unless they do not extend the parent's. */
+  route_hash_ = 0;
+  if (parent != NULL
+      && add_route_terms(route_hash_, steps, links,
+                         parent->steps_, parent->links_)) {
+    route_hash_ += parent->route_hash_;
+  } else {
+    route_hash_ = 0;
+    add_route_terms(route_hash_, steps, links, NULL, NULL);
+  }
 #ifdef DEBUG
   depth_ = (parent != NULL) ? parent->depth() + 1 : 0;
 #endif
@@ -892,12 +2530,27 @@ Plan::~Plan() {
   RCObject::destructive_deref(unsafes_);
   RCObject::destructive_deref(open_conds_);
   RCObject::destructive_deref(mutex_threats_);
+  RCObject::destructive_deref(threat_index_);
+  RCObject::destructive_deref(path_);
+}
+
+
+/* Returns the threat index of this plan, first extending the index
+   inherited from the parent plan if necessary. */
+const ThreatIndex& Plan::threat_index() const {
+  const ThreatIndex* index = ThreatIndex::make(threat_index_, steps_, links_);
+  if (index != threat_index_) {
+    RCObject::ref(index);
+    RCObject::destructive_deref(threat_index_);
+    threat_index_ = index;
+  }
+  return *index;
 }
 
 
 /* Returns the bindings of this plan. */
 const Bindings* Plan::bindings() const {
-  return params->ground_actions ? NULL : bindings_;
+  return context->params->ground_actions ? NULL : bindings_;
 }
 
 
@@ -911,8 +2564,10 @@ bool Plan::complete() const {
    signifies a better plan. */
 float Plan::primary_rank() const {
   if (rank_.empty()) {
-    params->heuristic.plan_rank(rank_, *this, params->weight, *domain,
-                                planning_graph, params->search_algorithm);
+    const Parameters& params = *context->params;
+    params.heuristic.plan_rank(rank_, *this, params.weight, *context->domain,
+                               context->planning_graph,
+                               params.search_algorithm);
   }
   return rank_[0];
 }
@@ -926,8 +2581,9 @@ size_t Plan::serial_no() const {
 
 /* Returns the next flaw to work on. */
 const Flaw& Plan::get_flaw(const FlawSelectionOrder& flaw_order) const {
-  const Flaw& flaw = flaw_order.select(*this, *problem, planning_graph);
-  if (!params->ground_actions) {
+  const Flaw& flaw =
+    flaw_order.select(*this, *context->problem, context->planning_graph);
+  if (!context->params->ground_actions) {
     const OpenCondition* open_cond = dynamic_cast<const OpenCondition*>(&flaw);
     static_pred_flaw = (open_cond != NULL && open_cond->is_static());
   }
@@ -935,10 +2591,8 @@ const Flaw& Plan::get_flaw(const FlawSelectionOrder& flaw_order) const {
 }
 
 
-/* Returns the refinements for the next flaw to work on. */
-void Plan::refinements(PlanList& plans,
-                       const FlawSelectionOrder& flaw_order) const {
-  const Flaw& flaw = get_flaw(flaw_order);
+/* Returns the refinements for the given flaw. */
+void Plan::refinements(PlanList& plans, const Flaw& flaw) const {
   if (verbosity > 1) {
     std::cerr << std::endl << "handle ";
     flaw.print(std::cerr, *bindings_);
@@ -961,6 +2615,106 @@ void Plan::refinements(PlanList& plans,
       }
     }
   }
+  if (context->params->spill_plans()) {
+    /* Record refinement paths so that the plans can be spilled. */
+    size_t pos = flaw_position(flaw);
+    for (size_t i = 0; i < plans.size(); i++) {
+      plans[i]->path_ =
+        new Chain<std::pair<size_t, size_t> >(std::make_pair(pos, i), path_);
+      RCObject::ref(plans[i]->path_);
+    }
+  }
+}
+
+
+/* Returns the refinement with index i for the given flaw, or NULL if
+   there is no such refinement, and sets n to the number of
+   refinements. */
+const Plan* Plan::refinement(const Flaw& flaw, size_t i, size_t& n) const {
+  PlanList plans;
+  refinements(plans, flaw);
+  n = plans.size();
+  const Plan* plan = NULL;
+  for (size_t k = 0; k < n; k++) {
+    if (k == i) {
+      plan = plans[k];
+    } else {
+      delete plans[k];
+    }
+  }
+  return plan;
+}
+
+
+/* Returns the position of the given flaw among the flaws of this
+   plan. */
+size_t Plan::flaw_position(const Flaw& flaw) const {
+  size_t pos = 0;
+  for (FlawSet<Unsafe>::const_iterator ui(unsafes_);
+       ui != FlawSet<Unsafe>::end(); ++ui, pos++) {
+    if (&*ui == &flaw) {
+      return pos;
+    }
+  }
+  for (FlawSet<OpenCondition>::const_iterator oci(open_conds_);
+       oci != FlawSet<OpenCondition>::end(); ++oci, pos++) {
+    if (&*oci == &flaw) {
+      return pos;
+    }
+  }
+  for (const Chain<MutexThreat>* mc = mutex_threats_;
+       mc != NULL; mc = mc->tail, pos++) {
+    if (&mc->head == &flaw) {
+      return pos;
+    }
+  }
+  throw std::logic_error("flaw not in plan");
+}
+
+
+/* Returns the flaw at the given position, or NULL if there is no such
+   flaw. */
+const Flaw* Plan::flaw_at(size_t pos) const {
+  for (FlawSet<Unsafe>::const_iterator ui(unsafes_);
+       ui != FlawSet<Unsafe>::end(); ++ui) {
+    if (pos-- == 0) {
+      return &*ui;
+    }
+  }
+  for (FlawSet<OpenCondition>::const_iterator oci(open_conds_);
+       oci != FlawSet<OpenCondition>::end(); ++oci) {
+    if (pos-- == 0) {
+      return &*oci;
+    }
+  }
+  for (const Chain<MutexThreat>* mc = mutex_threats_;
+       mc != NULL; mc = mc->tail) {
+    if (pos-- == 0) {
+      return &mc->head;
+    }
+  }
+  return NULL;
+}
+
+
+/* Returns the plan reached by following the given refinement path,
+   root first, from this plan, or NULL if the path cannot be
+   followed. */
+const Plan* Plan::replay(const std::vector<uint32_t>& path) const {
+  const Plan* plan = this;
+  for (size_t i = 0; plan != NULL && i + 1 < path.size(); i += 2) {
+    const Flaw* flaw = plan->flaw_at(path[i]);
+    const Plan* next = NULL;
+    if (flaw != NULL) {
+      size_t n;
+      next = plan->refinement(*flaw, path[i + 1], n);
+    }
+    if (plan != this) {
+      delete plan;
+    }
+    plan = next;
+  }
+  return plan;
 }
 
 
@@ -1116,7 +2870,8 @@ int Plan::separate(PlanList& plans, const Unsafe& unsafe,
       goal = &(*goal || !effect_cond);
     }
   }
-  const Chain<OpenCondition>* new_open_conds = test_only ? NULL : open_conds();
+  const FlawSet<OpenCondition>* new_open_conds =
+    test_only ? NULL : open_conds();
   size_t new_num_open_conds = test_only ? 0 : num_open_conds();
   BindingList new_bindings;
   bool added = add_goal(new_open_conds, new_num_open_conds, new_bindings,
@@ -1130,13 +2885,15 @@ int Plan::separate(PlanList& plans, const Unsafe& unsafe,
     if (bindings != NULL) {
       if (!test_only) {
         const Orderings* new_orderings = orderings_;
-        if (!goal->tautology() && planning_graph != NULL) {
+        if (!goal->tautology() && context->planning_graph != NULL) {
           const TemporalOrderings* to =
             dynamic_cast<const TemporalOrderings*>(new_orderings);
           if (to != NULL) {
             HeuristicValue h, hs;
-            goal->heuristic_value(h, hs, *planning_graph, unsafe.step_id(),
-                                  params->ground_actions ? NULL : bindings);
+            goal->heuristic_value(h, hs, *context->planning_graph,
+                                  unsafe.step_id(),
+                                  context->params->ground_actions
+                                  ? NULL : bindings);
             new_orderings = to->refine(unsafe.step_id(),
                                        hs.makespan(), h.makespan());
           }
@@ -1275,7 +3032,7 @@ void Plan::separate(PlanList& plans, const MutexThreat& mutex_threat,
         }
       }
     }
-    const Chain<OpenCondition>* new_open_conds = open_conds();
+    const FlawSet<OpenCondition>* new_open_conds = open_conds();
     size_t new_num_open_conds = num_open_conds();
     BindingList new_bindings;
     bool added = add_goal(new_open_conds, new_num_open_conds, new_bindings,
@@ -1326,7 +3083,7 @@ void Plan::separate(PlanList& plans, const MutexThreat& mutex_threat,
       } else {
         goal = &!effect_cond;
       }
-      const Chain<OpenCondition>* new_open_conds = open_conds();
+      const FlawSet<OpenCondition>* new_open_conds = open_conds();
       size_t new_num_open_conds = num_open_conds();
       BindingList new_bindings;
       bool added = add_goal(new_open_conds, new_num_open_conds, new_bindings,
@@ -1336,13 +3093,14 @@ void Plan::separate(PlanList& plans, const MutexThreat& mutex_threat,
         const Bindings* bindings = bindings_->add(new_bindings);
         if (bindings != NULL) {
           const Orderings* new_orderings = orderings_;
-          if (!goal->tautology() && planning_graph != NULL) {
+          if (!goal->tautology() && context->planning_graph != NULL) {
             const TemporalOrderings* to =
               dynamic_cast<const TemporalOrderings*>(new_orderings);
             if (to != NULL) {
               HeuristicValue h, hs;
-              goal->heuristic_value(h, hs, *planning_graph, step_id,
-                                    params->ground_actions ? NULL : bindings);
+              goal->heuristic_value(h, hs, *context->planning_graph, step_id,
+                                    context->params->ground_actions
+                                    ? NULL : bindings);
               new_orderings = to->refine(step_id, hs.makespan(), h.makespan());
             }
           }
@@ -1495,7 +3253,7 @@ void Plan::handle_open_condition(PlanList& plans,
     }
     const Negation* negation = dynamic_cast<const Negation*>(literal);
     if (negation != NULL) {
-      new_cw_link(plans, problem->init_action().effects(),
+      new_cw_link(plans, context->problem->init_action().effects(),
                   *negation, open_cond);
     }
   } else {
@@ -1523,7 +3281,7 @@ int Plan::handle_disjunction(PlanList& plans, const Disjunction& disj,
   for (FormulaList::const_iterator fi = disjuncts.begin();
        fi != disjuncts.end(); fi++) {
     BindingList new_bindings;
-    const Chain<OpenCondition>* new_open_conds =
+    const FlawSet<OpenCondition>* new_open_conds =
       test_only ? NULL : open_conds()->remove(open_cond);
     size_t new_num_open_conds = test_only ? 0 : num_open_conds() - 1;
     bool added = add_goal(new_open_conds, new_num_open_conds, new_bindings,
@@ -1560,9 +3318,9 @@ int Plan::handle_inequality(PlanList& plans, const Inequality& neq,
   size_t step_id = open_cond.step_id();
   Variable variable2 = neq.term().as_variable();
   const NameSet& d1 = bindings_->domain(neq.variable(), neq.step_id1(step_id),
-                                        *problem);
+                                        *context->problem);
   const NameSet& d2 = bindings_->domain(variable2, neq.step_id2(step_id),
-                                        *problem);
+                                        *context->problem);
 
   /*
    * Branch on the variable with the smallest domain.
@@ -1593,7 +3351,7 @@ int Plan::handle_inequality(PlanList& plans, const Inequality& neq,
       count++;
     }
   }
-  if (planning_graph == NULL) {
+  if (context->planning_graph == NULL) {
     delete &d1;
     delete &d2;
   }
@@ -1678,7 +3436,7 @@ bool Plan::reusable_steps(int& refinements, const Literal& literal,
   }
   const Negation* negation = dynamic_cast<const Negation*>(&literal);
   if (negation != NULL) {
-    count += new_cw_link(dummy, problem->init_action().effects(),
+    count += new_cw_link(dummy, context->problem->init_action().effects(),
                          *negation, open_cond, true);
   }
   refinements = count;
@@ -1756,7 +3514,7 @@ int Plan::new_cw_link(PlanList& plans, const EffectList& effects,
     }
   }
   BindingList new_bindings;
-  const Chain<OpenCondition>* new_open_conds =
+  const FlawSet<OpenCondition>* new_open_conds =
     test_only ? NULL : open_conds()->remove(open_cond);
   size_t new_num_open_conds = test_only ? 0 : num_open_conds() - 1;
   bool added = add_goal(new_open_conds, new_num_open_conds, new_bindings,
@@ -1771,12 +3529,12 @@ int Plan::new_cw_link(PlanList& plans, const EffectList& effects,
     const Bindings* bindings = bindings_->add(new_bindings, test_only);
     if (bindings != NULL) {
       if (!test_only) {
-        const Chain<Unsafe>* new_unsafes = unsafes();
+        const FlawSet<Unsafe>* new_unsafes = unsafes();
         size_t new_num_unsafes = num_unsafes();
         const Chain<Link>* new_links =
           new Chain<Link>(Link(0, StepTime::AT_END, open_cond), links());
         link_threats(new_unsafes, new_num_unsafes, new_links->head, steps(),
-                     orderings(), *bindings);
+                     threat_index(), orderings(), *bindings);
         plans.push_back(new Plan(steps(), num_steps(),
                                  new_links, num_links() + 1,
                                  orderings(), *bindings,
@@ -1824,7 +3582,7 @@ int Plan::make_link(PlanList& plans, const Step& step, const Effect& effect,
   /*
    * If the effect is conditional, add condition as goal.
    */
-  const Chain<OpenCondition>* new_open_conds =
+  const FlawSet<OpenCondition>* new_open_conds =
     test_only ? NULL : open_conds()->remove(open_cond);
   size_t new_num_open_conds = test_only ? 0 : num_open_conds() - 1;
   const Formula* cond_goal = &(effect.condition() && effect.link_condition());
@@ -1875,8 +3633,9 @@ int Plan::make_link(PlanList& plans, const Step& step, const Effect& effect,
       }
       return 0;
     }
-    if (params->domain_constraints) {
-      bindings = bindings->add(step.id(), step.action(), *planning_graph);
+    if (context->params->domain_constraints) {
+      bindings = bindings->add(step.id(), step.action(),
+                               *context->planning_graph);
       if (bindings == NULL) {
         if (!test_only) {
           RCObject::ref(new_open_conds);
@@ -1909,16 +3668,17 @@ int Plan::make_link(PlanList& plans, const Step& step, const Effect& effect,
     StepTime gt = start_time(open_cond.when());
     const Orderings* new_orderings =
       orderings().refine(Ordering(step.id(), et, open_cond.step_id(), gt),
-                         step, planning_graph,
-                         params->ground_actions ? NULL : bindings);
+                         step, context->planning_graph,
+                         context->params->ground_actions ? NULL : bindings);
     if (new_orderings != NULL && !cond_goal->tautology()
-        && planning_graph != NULL) {
+        && context->planning_graph != NULL) {
       const TemporalOrderings* to =
         dynamic_cast<const TemporalOrderings*>(new_orderings);
       if (to != NULL) {
         HeuristicValue h, hs;
-        cond_goal->heuristic_value(h, hs, *planning_graph, step.id(),
-                                   params->ground_actions ? NULL : bindings);
+        cond_goal->heuristic_value(h, hs, *context->planning_graph, step.id(),
+                                   context->params->ground_actions
+                                   ? NULL : bindings);
         const Orderings* tmp_orderings = to->refine(step.id(), hs.makespan(),
                                                     h.makespan());
         if (tmp_orderings != new_orderings) {
@@ -1947,10 +3707,10 @@ int Plan::make_link(PlanList& plans, const Step& step, const Effect& effect,
     /*
      * Find any threats to the newly established link.
      */
-    const Chain<Unsafe>* new_unsafes = unsafes();
+    const FlawSet<Unsafe>* new_unsafes = unsafes();
     size_t new_num_unsafes = num_unsafes();
     link_threats(new_unsafes, new_num_unsafes, new_links->head, new_steps,
-                 *new_orderings, *bindings);
+                 threat_index(), *new_orderings, *bindings);
 
     /*
      * If this is a new step, find links it threatens.
@@ -1958,7 +3718,7 @@ int Plan::make_link(PlanList& plans, const Step& step, const Effect& effect,
     const Chain<MutexThreat>* new_mutex_threats = mutex_threats();
     if (step.id() > num_steps()) {
       step_threats(new_unsafes, new_num_unsafes, step,
-                   links(), *new_orderings, *bindings);
+                   threat_index(), *new_orderings, *bindings);
     }
 
     /* Adds the new plan. */
@@ -2070,25 +3830,39 @@ disable_interference(const std::vector<const Step*>& ordered_steps,
 #endif
 
 /* Output operator for plans. */
+/* Schedules the steps of this plan, filling in their start and end
+   times, and returns the makespan. */
+float Plan::schedule(std::vector<const Step*>& ordered_steps,
+                     std::map<size_t, float>& start_times,
+                     std::map<size_t, float>& end_times) const {
+  for (const Chain<Step>* sc = steps(); sc != NULL; sc = sc->tail) {
+    const Step& step = sc->head;
+    if (step.id() != 0 && step.id() != GOAL_ID) {
+      ordered_steps.push_back(&step);
+    }
+  }
+  float makespan = orderings().schedule(start_times, end_times);
+  sort(ordered_steps.begin(), ordered_steps.end(), StepSorter(start_times));
+  return makespan;
+}
+
+
 std::ostream& operator<<(std::ostream& os, const Plan& p) {
   const Step* init = NULL;
   const Step* goal = NULL;
   const Bindings* bindings = p.bindings_;
-  std::vector<const Step*> ordered_steps;
   for (const Chain<Step>* sc = p.steps(); sc != NULL; sc = sc->tail) {
     const Step& step = sc->head;
     if (step.id() == 0) {
       init = &step;
     } else if (step.id() == Plan::GOAL_ID) {
       goal = &step;
-    } else {
-      ordered_steps.push_back(&step);
     }
   }
+  std::vector<const Step*> ordered_steps;
   std::map<size_t, float> start_times;
   std::map<size_t, float> end_times;
-  float makespan = p.orderings().schedule(start_times, end_times);
-  sort(ordered_steps.begin(), ordered_steps.end(), StepSorter(start_times));
+  float makespan = p.schedule(ordered_steps, start_times, end_times);
 #if 0
   /*
    * Now make sure that nothing scheduled at the same time is
@@ -2181,18 +3955,18 @@ std::ostream& operator<<(std::ostream& os, const Plan& p) {
           }
           os << " -> ";
           link.condition().print(os, link.to_id(), *bindings);
-          for (const Chain<Unsafe>* uc = p.unsafes();
-               uc != NULL; uc = uc->tail) {
-            const Unsafe& unsafe = uc->head;
+          for (FlawSet<Unsafe>::const_iterator ui(p.unsafes());
+               ui != FlawSet<Unsafe>::end(); ++ui) {
+            const Unsafe& unsafe = *ui;
             if (unsafe.link() == link) {
               os << " <" << unsafe.step_id() << '>';
             }
           }
         }
       }
-      for (const Chain<OpenCondition>* occ = p.open_conds();
-           occ != NULL; occ = occ->tail) {
-        const OpenCondition& open_cond = occ->head;
+      for (FlawSet<OpenCondition>::const_iterator oci(p.open_conds());
+           oci != FlawSet<OpenCondition>::end(); ++oci) {
+        const OpenCondition& open_cond = *oci;
         if (open_cond.step_id() == step.id()) {
           os << std::endl << "           ?? -> ";
           open_cond.condition().print(os, open_cond.step_id(), *bindings);
@@ -22,10 +22,22 @@
 #ifndef PLANS_H
 #define PLANS_H
 
+#include <atomic>
+#include <chrono>
+#include <cstdint>
+#include <map>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
 #include "chain.h"
 #include "flaws.h"
+#include "flawset.h"
 #include "orderings.h"
 
+#include "src/pool.h"
+#include "src/timer.h"
+
 struct Parameters;
 struct BindingList;
 struct Literal;
@@ -38,6 +50,8 @@ struct Problem;
 struct Bindings;
 struct ActionEffectMap;
 struct FlawSelectionOrder;
+struct PlanningGraph;
+struct ThreatIndex;
 
 
 /* ====================================================================== */
@@ -119,6 +133,134 @@ private:
 };
 
 
+/* ====================================================================== */
+/* SearchStatistics */
+
+/*
+ * Statistics collected while searching with one flaw selection order.
+ */
+struct FlawOrderStatistics {
+  /* Number of generated plans. */
+  size_t num_generated_plans;
+  /* Number of visited plans. */
+  size_t num_visited_plans;
+  /* Number of dead ends encountered. */
+  size_t num_dead_ends;
+  /* Largest number of pending plans. */
+  size_t peak_queue_size;
+
+  /* Constructs empty flaw selection order statistics. */
+  FlawOrderStatistics()
+    : num_generated_plans(0), num_visited_plans(0), num_dead_ends(0),
+      peak_queue_size(0) {}
+};
+
+
+/*
+ * Statistics collected during planning.  Phase timings are only
+ * collected if requested by the planning parameters.
+ */
+struct SearchStatistics {
+  /* Number of visited plan. */
+  size_t num_visited_plans;
+  /* Number of generated plans. */
+  size_t num_generated_plans;
+  /* Number of static preconditions encountered. */
+  size_t num_static;
+  /* Number of dead ends encountered. */
+  size_t num_dead_ends;
+  /* Number of duplicate plans discarded. */
+  size_t num_duplicates;
+  /* Largest number of pending plans (summed over search threads). */
+  size_t peak_queue_size;
+  /* Number of unifications answered by the unifier cache. */
+  size_t num_unifier_hits;
+  /* Number of unifications not answered by the unifier cache. */
+  size_t num_unifier_misses;
+  /* Number of pending plans spilled to disk. */
+  size_t num_spilled_plans;
+  /* Number of spilled plans loaded back into memory. */
+  size_t num_reloaded_plans;
+  /* Statistics for each flaw selection order. */
+  std::vector<FlawOrderStatistics> flaw_orders;
+  /* Time spent instantiating actions. */
+  std::chrono::nanoseconds grounding_time;
+  /* Time spent constructing the planning graph, excluding grounding. */
+  std::chrono::nanoseconds planning_graph_time;
+  /* Time spent selecting flaws. */
+  std::chrono::nanoseconds flaw_selection_time;
+  /* Time spent generating refinements. */
+  std::chrono::nanoseconds refinement_time;
+  /* Time spent ranking generated plans. */
+  std::chrono::nanoseconds ranking_time;
+  /* Whether an anytime search proved its plan optimal. */
+  bool optimal;
+
+  /* Constructs empty search statistics. */
+  SearchStatistics();
+
+  /* Adds the given statistics to these statistics. */
+  SearchStatistics& operator+=(const SearchStatistics& stats);
+};
+
+
+/* ====================================================================== */
+/* PlanSignature */
+
+/*
+ * A plan signature: two independent hashes of the canonical form of
+ * a plan.
+ */
+struct PlanSignature {
+  /* Hash used to look up the signature. */
+  size_t hash;
+  /* Hash used to tell apart signatures with the same lookup hash. */
+  uint64_t check;
+
+  /* Constructs a plan signature. */
+  PlanSignature(size_t hash = 0, uint64_t check = 0)
+    : hash(hash), check(check) {}
+};
+
+
+/* ====================================================================== */
+/* PlanSignatureSet */
+
+/*
+ * A set of plan signatures.
+ */
+struct PlanSignatureSet : public std::unordered_map<size_t, uint64_t> {
+  /* Adds the given signature to this set, and returns false if the
+     signature was already in the set.  A signature whose lookup hash
+     collides with that of a different signature is not added, but
+     true is returned so that the plan is still searched. */
+  bool insert(const PlanSignature& signature) {
+    std::pair<iterator, bool> result =
+      std::unordered_map<size_t, uint64_t>::insert(
+          std::make_pair(signature.hash, signature.check));
+    return result.second || (*result.first).second != signature.check;
+  }
+};
+
+
+/* ====================================================================== */
+/* PlanObserver */
+
+struct Plan;
+
+/*
+ * Receiver of the plans found by an anytime search.
+ */
+struct PlanObserver {
+  /* Deletes this plan observer. */
+  virtual ~PlanObserver() {}
+
+  /* Called with each complete plan that is cheaper than all plans
+     found before it, and its cost. */
+  virtual void improved_plan(const Plan& plan, float cost) = 0;
+};
+
+
 /* ====================================================================== */
 /* Plan */
 
@@ -129,16 +271,44 @@ struct Plan {
   /* Id of goal step. */
   static const size_t GOAL_ID;
 
-  /* Returns plan for given problem. */
+  /* Returns plan for given problem, and fills in the given search
+     statistics.  The planner state is kept for the calling thread
+     until Plan::cleanup is called, so different threads can plan at
+     the same time. */
   static const Plan* plan(const Problem& problem, const Parameters& params,
-                          bool last_problem);
-
-  /* Cleans up after planning. */
+                          bool last_problem, SearchStatistics& stats);
+
+  /* Returns plan for given problem using the given planning graph,
+     and fills in the given search statistics.  The planning graph
+     must have been made for the problem with the same parameters,
+     and is kept by the caller; if it is NULL, a planning graph is
+     made if needed.  An anytime search passes each improved plan to
+     the given observer, unless it is NULL, and returns the cheapest
+     plan found. */
+  static const Plan* plan(const Problem& problem, const Parameters& params,
+                          const PlanningGraph* planning_graph,
+                          bool last_problem, SearchStatistics& stats,
+                          PlanObserver* observer = NULL);
+
+  /* Returns a planning graph for the given problem, or NULL if the
+     given parameters do not need one, and fills in the time spent
+     making it in the given search statistics. */
+  static const PlanningGraph* make_planning_graph(const Problem& problem,
+                                                  const Parameters& params,
+                                                  SearchStatistics& stats);
+
+  /* Cleans up after planning in the calling thread. */
   static void cleanup();
 
   /* Deletes this plan. */
   ~Plan();
 
+  /* Allocates memory for a plan from the plan pool. */
+  static void* operator new(size_t size) { return Pool<Plan>::Allocate(); }
+
+  /* Returns the memory for a plan to the plan pool. */
+  static void operator delete(void* p) { Pool<Plan>::Deallocate(p); }
+
   /* Returns the steps of this plan. */
   const Chain<Step>* steps() const { return steps_; }
 
@@ -160,13 +330,13 @@ struct Plan {
   const Bindings* bindings() const;
 
   /* Returns the potentially threatened links of this plan. */
-  const Chain<Unsafe>* unsafes() const { return unsafes_; }
+  const FlawSet<Unsafe>* unsafes() const { return unsafes_; }
 
   /* Returns the number of potentially threatened links in this plan. */
   size_t num_unsafes() const { return num_unsafes_; }
 
   /* Returns the open conditions of this plan. */
-  const Chain<OpenCondition>* open_conds() const { return open_conds_; }
+  const FlawSet<OpenCondition>* open_conds() const { return open_conds_; }
 
   /* Returns the number of open conditions in this plan. */
   size_t num_open_conds() const { return num_open_conds_; }
@@ -184,6 +354,14 @@ struct Plan {
   /* Returns the serial number of this plan. */
   size_t serial_no() const;
 
+  /* Schedules the steps of this plan, filling in their start and end
+     times, and returns the makespan.  The steps other than the initial
+     and goal steps are added to the given vector in order of start
+     time. */
+  float schedule(std::vector<const Step*>& ordered_steps,
+                 std::map<size_t, float>& start_times,
+                 std::map<size_t, float>& end_times) const;
+
 #ifdef DEBUG
   /* Returns the depth of this plan. */
   size_t depth() const { return depth_; }
@@ -221,6 +399,9 @@ struct Plan {
                       const OpenCondition& open_cond, int limit) const;
 
 private:
+  /* The unit tests build plans step by step. */
+  friend class PlanTest;
+
   /* List of plans. */
   struct PlanList : public std::vector<const Plan*> {
   };
@@ -237,20 +418,33 @@ private:
   const Orderings* orderings_;
   /* Binding constraints of this plan. */
   const Bindings* bindings_;
-  /* Chain of potentially threatened links. */
-  const Chain<Unsafe>* unsafes_;
+  /* Set of potentially threatened links. */
+  const FlawSet<Unsafe>* unsafes_;
   /* Number of potentially threatened links. */
   size_t num_unsafes_;
-  /* Chain of open conditions. */
-  const Chain<OpenCondition>* open_conds_;
+  /* Set of open conditions. */
+  const FlawSet<OpenCondition>* open_conds_;
   /* Number of open conditions. */
   const size_t num_open_conds_;
   /* Chain of mutex threats. */
   const Chain<MutexThreat>* mutex_threats_;
+  /* Index of steps and causal links for finding threats; may cover
+     only the steps and links of an ancestor until first used. */
+  mutable const ThreatIndex* threat_index_;
+  /* Refinement path from the initial plan to this plan, most recent
+     refinement first; each step holds the position of the repaired
+     flaw and the index of the chosen refinement.  Only recorded when
+     plans may be spilled to disk. */
+  mutable const Chain<std::pair<size_t, size_t> >* path_;
   /* Rank of this plan. */
   mutable std::vector<float> rank_;
   /* Plan id (serial number). */
   mutable size_t id_;
+  /* Hash of the actions of the steps and the conditions of the causal
+     links of this plan, which does not depend on the order in which
+     these were added; picks the thread that owns this plan in a
+     parallel search. */
+  size_t route_hash_;
 #ifdef DEBUG
   /* Depth of this plan in the search space. */
   size_t depth_;
@@ -260,20 +454,70 @@ private:
      if goals of problem are inconsistent. */
   static const Plan* make_initial_plan(const Problem& problem);
 
+  /* Searches for a complete plan starting from the given initial
+     plan, using the flaw selection orders with the given indices.
+     Returns the complete plan, NULL if the problem lacks solution, or
+     an incomplete plan if a limit was reached or the search was
+     stopped. */
+  static const Plan* search(const Plan* initial_plan,
+                            const std::vector<size_t>& flaw_orders,
+                            const Timer<>& timer, const std::atomic<bool>& stop,
+                            bool show_progress, bool last_problem,
+                            SearchStatistics& stats);
+
+  /* Searches for a complete plan starting from the given initial
+     plan, with the first flaw selection order, in the given number of
+     threads.  Each thread owns the pending plans whose routing hashes
+     map to it.  Returns the complete plan, NULL if the problem lacks
+     solution, or the initial plan if a limit was reached. */
+  static const Plan* parallel_search(const Plan* initial_plan,
+                                     size_t num_threads, const Timer<>& timer,
+                                     bool last_problem,
+                                     SearchStatistics& stats);
+
+  /* Keeps a copy of the given complete plan in an anytime search if it
+     is cheaper than the best plan found so far, and reports it. */
+  static void keep_plan(const Plan& plan);
+
   /* Constructs a plan. */
   Plan(const Chain<Step>* steps, size_t num_steps,
        const Chain<Link>* links, size_t num_links,
        const Orderings& orderings, const Bindings& bindings,
-       const Chain<Unsafe>* unsafes, size_t num_unsafes,
-       const Chain<OpenCondition>* open_conds, size_t num_open_conds,
+       const FlawSet<Unsafe>* unsafes, size_t num_unsafes,
+       const FlawSet<OpenCondition>* open_conds, size_t num_open_conds,
        const Chain<MutexThreat>* mutex_threats, const Plan* parent);
 
+  /* Returns the threat index of this plan. */
+  const ThreatIndex& threat_index() const;
+
+  /* Returns the signature of this plan, which is the same for plans
+     that only differ in the order in which steps, links, and
+     constraints were added. */
+  PlanSignature signature() const;
+
   /* Returns the next flaw to work on. */
   const Flaw& get_flaw(const FlawSelectionOrder& flaw_order) const;
 
-  /* Returns the refinements for the next flaw to work on. */
-  void refinements(PlanList& plans,
-                   const FlawSelectionOrder& flaw_order) const;
+  /* Returns the refinements for the given flaw. */
+  void refinements(PlanList& plans, const Flaw& flaw) const;
+
+  /* Returns the refinement with index i for the given flaw, or NULL
+     if there is no such refinement, and sets n to the number of
+     refinements. */
+  const Plan* refinement(const Flaw& flaw, size_t i, size_t& n) const;
+
+  /* Returns the position of the given flaw among the flaws of this
+     plan. */
+  size_t flaw_position(const Flaw& flaw) const;
+
+  /* Returns the flaw at the given position, or NULL if there is no
+     such flaw. */
+  const Flaw* flaw_at(size_t pos) const;
+
+  /* Returns the plan reached by following the given refinement path,
+     root first, from this plan, or NULL if the path cannot be
+     followed. */
+  const Plan* replay(const std::vector<uint32_t>& path) const;
 
   /* Handles an unsafe link. */
   void handle_unsafe(PlanList& plans, const Unsafe& unsafe) const;
@@ -36,6 +36,9 @@ class Predicate {
   // Constructs a predicate.
   explicit Predicate(int index) : index_(index) {}
 
+  // Returns the index of this predicate.  Indices are dense, starting at 0.
+  int index() const { return index_; }
+
  private:
   // Predicate index.
   int index_;
@@ -22,20 +22,26 @@
 #ifndef REFCOUNT_H_
 #define REFCOUNT_H_
 
-// An object with a reference counter.
+#include <atomic>
+
+#include "src/threads.h"
+
+// An object with a reference counter.  The counter is updated atomically while
+// several planner threads may be running, so objects can be shared by plans
+// that are searched in different threads.
 class RCObject {
  public:
   // Increases the reference count for the given object.
   static void ref(const RCObject* o) {
     if (o != 0) {
-      o->ref_count_++;
+      Threads::Increment(o->ref_count_);
     }
   }
 
   // Decreases the reference count for the given object.
   static void deref(const RCObject* o) {
     if (o != 0) {
-      o->ref_count_--;
+      Threads::Decrement(o->ref_count_);
     }
   }
 
@@ -43,8 +49,7 @@ class RCObject {
   // reference count becomes zero.
   static void destructive_deref(const RCObject* o) {
     if (o != 0) {
-      o->ref_count_--;
-      if (o->ref_count_ == 0) {
+      if (Threads::Decrement(o->ref_count_) == 0) {
         delete o;
       }
     }
@@ -62,7 +67,7 @@ class RCObject {
 
  private:
   // Reference counter.
-  mutable unsigned long ref_count_;
+  mutable std::atomic<unsigned long> ref_count_;
 };
 
 #endif  // REFCOUNT_H_
@@ -0,0 +1,165 @@
+// Copyright (C) 2019 Google Inc
+//
+// This file is part of VHPOP.
+//
+// VHPOP is free software; you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// VHPOP is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+// or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+// License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with VHPOP; if not, write to the Free Software Foundation,
+// Inc., #59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+//
+// Tests for the embeddable planner interface.
+
+#include "planner.h"
+
+#include <algorithm>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+#include "gtest/gtest.h"
+
+namespace {
+
+// A domain and two problems, one of which needs a step that the other
+// one does not.
+constexpr char kProblems[] = R"(
+(define (domain move)
+  (:requirements :strips)
+  (:predicates (at ?x) (road ?x ?y))
+  (:action move
+    :parameters (?x ?y)
+    :precondition (and (at ?x) (road ?x ?y))
+    :effect (and (at ?y) (not (at ?x)))))
+(define (problem one-move)
+  (:domain move)
+  (:objects a b c)
+  (:init (at a) (road a b) (road b c))
+  (:goal (at b)))
+(define (problem two-moves)
+  (:domain move)
+  (:objects a b c)
+  (:init (at a) (road a b) (road b c))
+  (:goal (at c)))
+)";
+
+// Returns the actions of the steps of the given result.
+std::vector<std::string> Actions(const PlanResult& result) {
+  std::vector<std::string> actions;
+  for (const PlanStep& step : result.steps) {
+    actions.push_back(step.action);
+  }
+  return actions;
+}
+
+class PlannerTest : public testing::Test {
+ protected:
+  void SetUp() override {
+    ASSERT_TRUE(Planner::parse_text(kProblems, "problems"));
+  }
+
+  void TearDown() override { Planner::clear(); }
+};
+
+TEST_F(PlannerTest, ParsesProblems) {
+  std::vector<std::string> problems = Planner::problems();
+  std::sort(problems.begin(), problems.end());
+  EXPECT_EQ(std::vector<std::string>({"one-move", "two-moves"}), problems);
+}
+
+TEST_F(PlannerTest, PlansProblemsInARow) {
+  Planner planner;
+  planner.set_option("heuristic", "ADD");
+  planner.set_option("flaw-order", "MW");
+  planner.set_option("detect-duplicates", "");
+
+  const PlanResult one_move = planner.plan("one-move");
+  EXPECT_EQ(PlanResult::SOLVED, one_move.outcome);
+  EXPECT_EQ(std::vector<std::string>({"(move a b)"}), Actions(one_move));
+
+  const PlanResult two_moves = planner.plan("two-moves");
+  EXPECT_EQ(PlanResult::SOLVED, two_moves.outcome);
+  EXPECT_EQ(std::vector<std::string>({"(move a b)", "(move b c)"}),
+            Actions(two_moves));
+  EXPECT_LT(two_moves.steps[0].start_time, two_moves.steps[1].start_time);
+}
+
+TEST_F(PlannerTest, PlansGroundActions) {
+  Planner planner;
+  planner.set_option("ground-actions", "1");
+  planner.set_option("heuristic", "ADDR");
+  planner.set_option("flaw-order", "MW-Loc");
+
+  const PlanResult two_moves = planner.plan("two-moves");
+  EXPECT_EQ(PlanResult::SOLVED, two_moves.outcome);
+  EXPECT_EQ(std::vector<std::string>({"(move a b)", "(move b c)"}),
+            Actions(two_moves));
+  const PlanResult one_move = planner.plan("one-move");
+  EXPECT_EQ(PlanResult::SOLVED, one_move.outcome);
+  EXPECT_EQ(std::vector<std::string>({"(move a b)"}), Actions(one_move));
+}
+
+TEST_F(PlannerTest, PlansWithLazyRefinements) {
+  Planner planner;
+  planner.set_option("lazy-refinements", "1");
+  planner.set_option("detect-duplicates", "");
+
+  const PlanResult two_moves = planner.plan("two-moves");
+  EXPECT_EQ(PlanResult::SOLVED, two_moves.outcome);
+  EXPECT_EQ(std::vector<std::string>({"(move a b)", "(move b c)"}),
+            Actions(two_moves));
+  const PlanResult one_move = planner.plan("one-move");
+  EXPECT_EQ(PlanResult::SOLVED, one_move.outcome);
+  EXPECT_EQ(std::vector<std::string>({"(move a b)"}), Actions(one_move));
+}
+
+TEST_F(PlannerTest, ReportsSearchLimit) {
+  Planner planner;
+  planner.set_option("limit", "1");
+  const PlanResult result = planner.plan("two-moves");
+  EXPECT_EQ(PlanResult::LIMIT, result.outcome);
+  EXPECT_TRUE(result.steps.empty());
+}
+
+TEST_F(PlannerTest, RejectsUnknownOption) {
+  Planner planner;
+  EXPECT_THROW(planner.set_option("no-such-option", "1"), std::runtime_error);
+  // The planner is still usable after the error.
+  EXPECT_EQ(PlanResult::SOLVED, planner.plan("one-move").outcome);
+}
+
+TEST_F(PlannerTest, RejectsInvalidOptionValue) {
+  Planner planner;
+  EXPECT_THROW(planner.set_option("limit", "many"), std::runtime_error);
+  EXPECT_THROW(planner.set_option("detect-duplicates", "maybe"),
+               std::runtime_error);
+}
+
+TEST_F(PlannerTest, RejectsMemoryLimitWithRandomOpenConditions) {
+  Planner planner;
+  planner.set_option("memory-limit", "1");
+  planner.set_option("random-open-conditions", "1");
+  EXPECT_THROW(planner.plan("one-move"), std::runtime_error);
+}
+
+TEST_F(PlannerTest, RejectsMemoryLimitWithLazyRefinements) {
+  Planner planner;
+  planner.set_option("memory-limit", "1");
+  planner.set_option("lazy-refinements", "1");
+  EXPECT_THROW(planner.plan("one-move"), std::runtime_error);
+}
+
+TEST_F(PlannerTest, RejectsUnknownProblem) {
+  Planner planner;
+  EXPECT_THROW(planner.plan("no-such-problem"), std::runtime_error);
+}
+
+}  // namespace
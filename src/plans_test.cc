@@ -0,0 +1,149 @@
+// Copyright (C) 2019 Google Inc
+//
+// This file is part of VHPOP.
+//
+// VHPOP is free software; you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// VHPOP is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+// or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+// License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with VHPOP; if not, write to the Free Software Foundation,
+// Inc., #59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+//
+// Tests for the detection of duplicate plans.
+
+#include "plans.h"
+
+#include <vector>
+
+#include "formulas.h"
+#include "parameters.h"
+#include "planner.h"
+#include "problems.h"
+
+#include "gtest/gtest.h"
+
+namespace {
+
+// A problem with two goals that are achieved by a new step each.
+constexpr char kProblem[] = R"(
+(define (domain make)
+  (:requirements :strips)
+  (:predicates (made ?x))
+  (:action make :parameters (?x) :effect (made ?x)))
+(define (problem make-two)
+  (:domain make)
+  (:objects a b)
+  (:goal (and (made a) (made b))))
+)";
+
+}  // namespace
+
+// Refines plans one open condition at a time.  The fixture is a friend
+// of Plan.
+class PlanTest : public testing::Test {
+ protected:
+  void SetUp() override {
+    ASSERT_TRUE(Planner::parse_text(kProblem, "make-two"));
+    const Problem* problem = Problem::find("make-two");
+    ASSERT_NE(nullptr, problem);
+    // Planning for the problem sets up the planner state of this
+    // thread, which is kept until Plan::cleanup.
+    SearchStatistics stats;
+    delete Plan::plan(*problem, params_, false, stats);
+    initial_plan_ = Keep(Plan::make_initial_plan(*problem));
+    ASSERT_NE(nullptr, initial_plan_);
+    for (FlawSet<OpenCondition>::const_iterator oci(
+             initial_plan_->open_conds());
+         oci != FlawSet<OpenCondition>::end(); ++oci) {
+      goals_.push_back(&(*oci).condition());
+    }
+    ASSERT_EQ(2u, goals_.size());
+  }
+
+  void TearDown() override {
+    for (const Plan* plan : plans_) {
+      delete plan;
+    }
+    Plan::cleanup();
+    Planner::clear();
+  }
+
+  // Returns the only refinement of the open condition of the given plan
+  // for the given goal.
+  const Plan* Refine(const Plan& plan, const Formula& goal) {
+    for (FlawSet<OpenCondition>::const_iterator oci(plan.open_conds());
+         oci != FlawSet<OpenCondition>::end(); ++oci) {
+      if (&(*oci).condition() == &goal) {
+        Plan::PlanList refinements;
+        plan.refinements(refinements, *oci);
+        for (const Plan* refinement : refinements) {
+          Keep(refinement);
+        }
+        EXPECT_EQ(1u, refinements.size());
+        return refinements.empty() ? nullptr : refinements[0];
+      }
+    }
+    ADD_FAILURE() << "no open condition for the goal";
+    return nullptr;
+  }
+
+  static PlanSignature Signature(const Plan& plan) {
+    return plan.signature();
+  }
+
+  Parameters params_;
+  const Plan* initial_plan_ = nullptr;
+  std::vector<const Formula*> goals_;
+
+ private:
+  // Deletes the given plan at the end of the test.
+  const Plan* Keep(const Plan* plan) {
+    if (plan != nullptr) {
+      plans_.push_back(plan);
+    }
+    return plan;
+  }
+
+  std::vector<const Plan*> plans_;
+};
+
+namespace {
+
+TEST_F(PlanTest, RejectsPlanWithStepsAddedInOtherOrder) {
+  const Plan* first = Refine(*initial_plan_, *goals_[0]);
+  ASSERT_NE(nullptr, first);
+  const Plan* first_second = Refine(*first, *goals_[1]);
+  ASSERT_NE(nullptr, first_second);
+  const Plan* second = Refine(*initial_plan_, *goals_[1]);
+  ASSERT_NE(nullptr, second);
+  const Plan* second_first = Refine(*second, *goals_[0]);
+  ASSERT_NE(nullptr, second_first);
+
+  PlanSignatureSet signatures;
+  EXPECT_TRUE(signatures.insert(Signature(*first_second)));
+  EXPECT_FALSE(signatures.insert(Signature(*second_first)));
+}
+
+TEST_F(PlanTest, AcceptsPlansWithDifferentSteps) {
+  const Plan* first = Refine(*initial_plan_, *goals_[0]);
+  ASSERT_NE(nullptr, first);
+  const Plan* second = Refine(*initial_plan_, *goals_[1]);
+  ASSERT_NE(nullptr, second);
+  const Plan* both = Refine(*first, *goals_[1]);
+  ASSERT_NE(nullptr, both);
+
+  PlanSignatureSet signatures;
+  EXPECT_TRUE(signatures.insert(Signature(*first)));
+  EXPECT_TRUE(signatures.insert(Signature(*second)));
+  EXPECT_TRUE(signatures.insert(Signature(*both)));
+  EXPECT_FALSE(signatures.insert(Signature(*first)));
+}
+
+}  // namespace
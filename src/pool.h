@@ -0,0 +1,243 @@
+// Copyright (C) 2019 Google Inc
+//
+// This file is part of VHPOP.
+//
+// VHPOP is free software; you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// VHPOP is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+// or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+// License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with VHPOP; if not, write to the Free Software Foundation,
+// Inc., #59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+//
+// Memory pools for objects that are allocated and freed in large numbers.
+
+#ifndef POOL_H_
+#define POOL_H_
+
+#include <algorithm>
+#include <cstddef>
+#include <functional>
+#include <mutex>
+#include <vector>
+
+// The memory pools that have allocated slabs.
+class Pools {
+ public:
+  // Releases the slabs of every pool whose blocks are all free (see
+  // Pool<T>::Trim), and returns the number of released slabs.
+  static size_t Trim() {
+    std::vector<size_t (*)()> trims;
+    {
+      std::lock_guard<std::mutex> lock(mutex_);
+      trims = trims_;
+    }
+    size_t num_released = 0;
+    for (size_t i = 0; i < trims.size(); i++) {
+      num_released += trims[i]();
+    }
+    return num_released;
+  }
+
+ private:
+  template <typename T>
+  friend class Pool;
+
+  // Registers the trim function of a pool.
+  static void Register(size_t (*trim)()) {
+    std::lock_guard<std::mutex> lock(mutex_);
+    trims_.push_back(trim);
+  }
+
+  // Mutex protecting the registered trim functions.
+  static inline std::mutex mutex_;
+  // Trim functions of the pools that have allocated slabs.
+  static inline std::vector<size_t (*)()> trims_;
+};
+
+// A pool of memory blocks for objects of type T.
+//
+// Blocks are carved out of large slabs and recycled through a free list that
+// is local to each thread, so allocation and deallocation never lock.  When a
+// thread exits, its free list is handed over to a shared list from which
+// other threads refill their own.  Blocks may be freed by a different thread
+// than the one that allocated them.  Slabs stay reachable from the pool, and
+// are only released by Trim.
+template <typename T>
+class Pool {
+ public:
+  // Returns a block of memory large enough for an object of type T.
+  static void* Allocate() {
+    LocalList& local = local_list();
+    if (local.head == nullptr) {
+      local.Refill();
+    }
+    Block* block = local.head;
+    local.head = block->next;
+    return block;
+  }
+
+  // Returns the given block, obtained from Allocate, to this pool.
+  static void Deallocate(void* p) {
+    Block* block = static_cast<Block*>(p);
+    LocalList& local = local_list();
+    block->next = local.head;
+    local.head = block;
+  }
+
+  // Releases the slabs whose blocks are all free, and returns the number of
+  // released slabs.  Only the free list of the calling thread and the shared
+  // list are examined, so a slab with a free block in the list of another
+  // thread is kept.  The remaining free blocks of the calling thread are
+  // handed over to the shared list, so that a thread that frees blocks but
+  // does not allocate them does not hold on to them.
+  static size_t Trim() {
+    LocalList& local = local_list();
+    Shared& s = shared();
+    std::lock_guard<std::mutex> lock(s.mutex);
+    if (s.free != nullptr) {
+      Block* tail = s.free;
+      while (tail->next != nullptr) {
+        tail = tail->next;
+      }
+      tail->next = local.head;
+      local.head = s.free;
+      s.free = nullptr;
+    }
+    // Count the free blocks of each slab, with the slabs sorted by address.
+    std::vector<Slab*> slabs;
+    for (Slab* slab = s.slabs; slab != nullptr; slab = slab->next) {
+      slabs.push_back(slab);
+    }
+    std::sort(slabs.begin(), slabs.end(), std::less<Slab*>());
+    std::vector<size_t> num_free(slabs.size());
+    for (Block* block = local.head; block != nullptr; block = block->next) {
+      num_free[slab_index(slabs, block)]++;
+    }
+    // Hand the blocks of the other slabs over to the shared list, and
+    // release the empty slabs.
+    while (local.head != nullptr) {
+      Block* block = local.head;
+      local.head = block->next;
+      if (num_free[slab_index(slabs, block)] < kBlocksPerSlab) {
+        block->next = s.free;
+        s.free = block;
+      }
+    }
+    size_t num_released = 0;
+    Slab** link = &s.slabs;
+    while (*link != nullptr) {
+      Slab* slab = *link;
+      size_t i = std::lower_bound(slabs.begin(), slabs.end(), slab,
+                                  std::less<Slab*>()) -
+                 slabs.begin();
+      if (num_free[i] == kBlocksPerSlab) {
+        *link = slab->next;
+        delete slab;
+        num_released++;
+      } else {
+        link = &slab->next;
+      }
+    }
+    return num_released;
+  }
+
+ private:
+  // A block of memory that is either free or holds an object of type T.
+  union Block {
+    Block* next;
+    alignas(T) unsigned char data[sizeof(T)];
+  };
+
+  // Number of blocks in a slab.
+  static constexpr size_t kBlocksPerSlab =
+      (sizeof(Block) < 65536) ? 65536 / sizeof(Block) : 1;
+
+  // A slab of blocks.
+  struct Slab {
+    Slab* next;
+    Block blocks[kBlocksPerSlab];
+  };
+
+  // State shared by all threads.
+  struct Shared {
+    std::mutex mutex;
+    Block* free = nullptr;
+    Slab* slabs = nullptr;
+    // Whether the trim function of this pool has been registered.
+    bool registered = false;
+  };
+
+  // The free list of a thread.
+  struct LocalList {
+    Block* head = nullptr;
+
+    // Hands the free blocks over to the shared list.
+    ~LocalList() {
+      if (head != nullptr) {
+        Block* tail = head;
+        while (tail->next != nullptr) {
+          tail = tail->next;
+        }
+        Shared& s = shared();
+        std::lock_guard<std::mutex> lock(s.mutex);
+        tail->next = s.free;
+        s.free = head;
+        head = nullptr;
+      }
+    }
+
+    // Fills this free list with blocks from the shared list, or from a new
+    // slab if the shared list is empty.
+    void Refill() {
+      Shared& s = shared();
+      std::lock_guard<std::mutex> lock(s.mutex);
+      if (s.free != nullptr) {
+        head = s.free;
+        s.free = nullptr;
+      } else {
+        if (!s.registered) {
+          Pools::Register(&Pool<T>::Trim);
+          s.registered = true;
+        }
+        Slab* slab = new Slab;
+        slab->next = s.slabs;
+        s.slabs = slab;
+        for (size_t i = kBlocksPerSlab; i > 0; i--) {
+          slab->blocks[i - 1].next = head;
+          head = &slab->blocks[i - 1];
+        }
+      }
+    }
+  };
+
+  // Returns the index of the slab holding the given block in the given slabs,
+  // sorted by address.
+  static size_t slab_index(const std::vector<Slab*>& slabs,
+                           const Block* block) {
+    const Slab* key = reinterpret_cast<const Slab*>(block);
+    return std::upper_bound(slabs.begin(), slabs.end(), key,
+                            std::less<const Slab*>()) -
+           slabs.begin() - 1;
+  }
+
+  // Returns the state shared by all threads.
+  static Shared& shared() {
+    static Shared* const s = new Shared();
+    return *s;
+  }
+
+  // Returns the free list of the calling thread.
+  static LocalList& local_list() {
+    thread_local LocalList list;
+    return list;
+  }
+};
+
+#endif  // POOL_H_
@@ -0,0 +1,128 @@
+// Copyright (C) 2019 Google Inc
+//
+// This file is part of VHPOP.
+//
+// VHPOP is free software; you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// VHPOP is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+// or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+// License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with VHPOP; if not, write to the Free Software Foundation,
+// Inc., #59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+//
+// Tests for memory pools.
+
+#include "pool.h"
+
+#include <cstdint>
+#include <set>
+#include <thread>
+#include <vector>
+
+#include "gtest/gtest.h"
+
+namespace {
+
+struct Small {
+  char c;
+};
+
+struct Large {
+  double values[1000];
+};
+
+struct Medium {
+  double values[100];
+};
+
+struct Tiny {
+  int i;
+};
+
+template <typename T>
+bool Aligned(const void* p) {
+  return reinterpret_cast<std::uintptr_t>(p) % alignof(T) == 0;
+}
+
+TEST(PoolTest, DistinctBlocks) {
+  std::vector<void*> blocks;
+  std::set<void*> distinct;
+  for (int i = 0; i < 100000; ++i) {
+    void* p = Pool<Small>::Allocate();
+    EXPECT_TRUE(Aligned<void*>(p));
+    blocks.push_back(p);
+    distinct.insert(p);
+  }
+  EXPECT_EQ(blocks.size(), distinct.size());
+  for (void* p : blocks) {
+    Pool<Small>::Deallocate(p);
+  }
+}
+
+TEST(PoolTest, ReusesFreedBlocks) {
+  void* p = Pool<Large>::Allocate();
+  EXPECT_TRUE(Aligned<Large>(p));
+  Pool<Large>::Deallocate(p);
+  EXPECT_EQ(p, Pool<Large>::Allocate());
+  Pool<Large>::Deallocate(p);
+}
+
+TEST(PoolTest, BlocksOutliveThreads) {
+  std::vector<void*> blocks(1000);
+  std::thread allocator([&blocks]() {
+    for (void*& p : blocks) {
+      p = Pool<Large>::Allocate();
+      *static_cast<Large*>(p) = Large();
+    }
+    Pool<Large>::Deallocate(Pool<Large>::Allocate());
+  });
+  allocator.join();
+  std::set<void*> distinct(blocks.begin(), blocks.end());
+  EXPECT_EQ(blocks.size(), distinct.size());
+  for (void* p : blocks) {
+    EXPECT_EQ(0.0, static_cast<Large*>(p)->values[999]);
+    Pool<Large>::Deallocate(p);
+  }
+}
+
+TEST(PoolTest, TrimReleasesEmptySlabs) {
+  // 81 blocks fit in a slab, so these blocks take 13 slabs.
+  std::vector<void*> blocks(1000);
+  for (void*& p : blocks) {
+    p = Pool<Medium>::Allocate();
+  }
+  for (size_t i = 1; i < blocks.size(); ++i) {
+    Pool<Medium>::Deallocate(blocks[i]);
+  }
+  EXPECT_EQ(12u, Pool<Medium>::Trim());
+  *static_cast<Medium*>(blocks[0]) = Medium();
+  Pool<Medium>::Deallocate(blocks[0]);
+  EXPECT_EQ(1u, Pool<Medium>::Trim());
+  EXPECT_EQ(0u, Pool<Medium>::Trim());
+  void* p = Pool<Medium>::Allocate();
+  EXPECT_TRUE(Aligned<Medium>(p));
+  Pool<Medium>::Deallocate(p);
+}
+
+TEST(PoolTest, TrimCollectsBlocksOfExitedThreads) {
+  std::vector<void*> blocks(1000);
+  std::thread allocator([&blocks]() {
+    for (void*& p : blocks) {
+      p = Pool<Tiny>::Allocate();
+    }
+  });
+  allocator.join();
+  for (void* p : blocks) {
+    Pool<Tiny>::Deallocate(p);
+  }
+  EXPECT_LT(0u, Pools::Trim());
+  EXPECT_EQ(0u, Pool<Tiny>::Trim());
+}
+
+}  // namespace
@@ -0,0 +1,106 @@
+// Copyright (C) 2019 Google Inc
+//
+// This file is part of VHPOP.
+//
+// VHPOP is free software; you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// VHPOP is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+// or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+// License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with VHPOP; if not, write to the Free Software Foundation,
+// Inc., #59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+//
+// Synchronization of state shared by planner threads.
+
+#ifndef THREADS_H_
+#define THREADS_H_
+
+#include <atomic>
+#include <cstddef>
+
+// Tracks whether several planner threads may be running.  State shared by
+// planners, such as reference counts and lazily filled tables, is only
+// synchronized while they may, so a single planner thread does not pay for
+// the synchronization.
+class Threads {
+ public:
+  // Marks several planner threads as possibly running for the lifetime of
+  // this object.  Construct one before starting planner threads, and delete it
+  // after they have been joined.
+  class Scope {
+   public:
+    Scope() { num_scopes_.fetch_add(1, std::memory_order_acq_rel); }
+
+    ~Scope() { num_scopes_.fetch_sub(1, std::memory_order_acq_rel); }
+
+    Scope(const Scope&) = delete;
+    Scope& operator=(const Scope&) = delete;
+  };
+
+  // Locks the given mutex for the lifetime of this object, but only if several
+  // planner threads may be running.
+  template <typename Mutex>
+  class Lock {
+   public:
+    explicit Lock(Mutex& mutex) : mutex_(Concurrent() ? &mutex : nullptr) {
+      if (mutex_ != nullptr) {
+        mutex_->lock();
+      }
+    }
+
+    ~Lock() {
+      if (mutex_ != nullptr) {
+        mutex_->unlock();
+      }
+    }
+
+    Lock(const Lock&) = delete;
+    Lock& operator=(const Lock&) = delete;
+
+   private:
+    // The locked mutex, or nullptr.
+    Mutex* mutex_;
+  };
+
+  // Tests if several planner threads may be running.
+  static bool Concurrent() {
+    return num_scopes_.load(std::memory_order_acquire) > 0;
+  }
+
+  // Increments the given counter, atomically if several planner threads may be
+  // running.
+  template <typename T>
+  static void Increment(std::atomic<T>& counter) {
+    if (Concurrent()) {
+      counter.fetch_add(1, std::memory_order_relaxed);
+    } else {
+      counter.store(counter.load(std::memory_order_relaxed) + 1,
+                    std::memory_order_relaxed);
+    }
+  }
+
+  // Decrements the given counter, atomically if several planner threads may be
+  // running, and returns its new value.
+  template <typename T>
+  static T Decrement(std::atomic<T>& counter) {
+    if (Concurrent()) {
+      return counter.fetch_sub(1, std::memory_order_acq_rel) - 1;
+    } else {
+      T value = counter.load(std::memory_order_relaxed) - 1;
+      counter.store(value, std::memory_order_relaxed);
+      return value;
+    }
+  }
+
+ private:
+  // Number of existing scopes.
+  static inline std::atomic<size_t> num_scopes_{0};
+};
+
+#endif  // THREADS_H_
@@ -0,0 +1,92 @@
+// Copyright (C) 2019 Google Inc
+//
+// This file is part of VHPOP.
+//
+// VHPOP is free software; you can redistribute it and/or modify it
+// under the terms of the GNU General Public License as published by
+// the Free Software Foundation; either version 2 of the License, or
+// (at your option) any later version.
+//
+// VHPOP is distributed in the hope that it will be useful, but WITHOUT
+// ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+// or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public
+// License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with VHPOP; if not, write to the Free Software Foundation,
+// Inc., #59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+//
+// Tests for the synchronization of state shared by planner threads.
+
+#include "threads.h"
+
+#include <atomic>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+#include "gtest/gtest.h"
+
+namespace {
+
+TEST(ThreadsTest, ConcurrentOnlyInScope) {
+  EXPECT_FALSE(Threads::Concurrent());
+  {
+    Threads::Scope scope;
+    EXPECT_TRUE(Threads::Concurrent());
+    {
+      Threads::Scope nested_scope;
+      EXPECT_TRUE(Threads::Concurrent());
+    }
+    EXPECT_TRUE(Threads::Concurrent());
+  }
+  EXPECT_FALSE(Threads::Concurrent());
+}
+
+TEST(ThreadsTest, CountsWithoutScope) {
+  std::atomic<size_t> counter(0);
+  Threads::Increment(counter);
+  Threads::Increment(counter);
+  EXPECT_EQ(1u, Threads::Decrement(counter));
+  EXPECT_EQ(0u, Threads::Decrement(counter));
+}
+
+TEST(ThreadsTest, LocksOnlyInScope) {
+  std::mutex mutex;
+  {
+    Threads::Lock<std::mutex> lock(mutex);
+    EXPECT_TRUE(mutex.try_lock());
+    mutex.unlock();
+  }
+  Threads::Scope scope;
+  {
+    Threads::Lock<std::mutex> lock(mutex);
+    EXPECT_FALSE(mutex.try_lock());
+  }
+  EXPECT_TRUE(mutex.try_lock());
+  mutex.unlock();
+}
+
+TEST(ThreadsTest, CountsInThreads) {
+  std::atomic<size_t> counter(0);
+  std::mutex mutex;
+  size_t locked_counter = 0;
+  Threads::Scope scope;
+  std::vector<std::thread> threads;
+  for (int i = 0; i < 4; ++i) {
+    threads.push_back(std::thread([&]() {
+      for (int j = 0; j < 100000; ++j) {
+        Threads::Increment(counter);
+        Threads::Lock<std::mutex> lock(mutex);
+        ++locked_counter;
+      }
+    }));
+  }
+  for (std::thread& t : threads) {
+    t.join();
+  }
+  EXPECT_EQ(400000u, counter.load());
+  EXPECT_EQ(400000u, locked_counter);
+}
+
+}  // namespace
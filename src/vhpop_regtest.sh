@@ -50,3 +50,124 @@ echo -n sussman_anomaly_ground...
 start=$(timestamp)
 HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} examples/blocks-world-domain.pddl examples/sussman-anomaly.pddl 2>/dev/null | grep -v '^Time: ' | diff src/testdata/sussman_anomaly_ground.golden -
 expect_ok ${start}
+
+echo -n sussman_anomaly_detect_duplicates...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -D -s IDA -h ADD examples/blocks-world-domain.pddl examples/sussman-anomaly.pddl 2>/dev/null | grep -v '^Time: ' | diff src/testdata/sussman_anomaly_lifted.golden -
+expect_ok ${start}
+
+echo -n sussman_anomaly_portfolio...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -P -f UCPOP -f UCPOP examples/blocks-world-domain.pddl examples/sussman-anomaly.pddl 2>/dev/null | grep -v '^Time: ' | diff src/testdata/sussman_anomaly_lifted.golden -
+expect_ok ${start}
+
+echo -n sussman_anomaly_statistics...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -x csv examples/blocks-world-domain.pddl examples/sussman-anomaly.pddl 2>/dev/null | grep -v '^Time: ' | diff src/testdata/sussman_anomaly_lifted.golden -
+expect_ok ${start}
+
+echo -n sussman_anomaly_unifier_cache...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -u examples/blocks-world-domain.pddl examples/sussman-anomaly.pddl 2>/dev/null | grep -v '^Time: ' | diff src/testdata/sussman_anomaly_lifted.golden -
+expect_ok ${start}
+
+echo -n sussman_anomaly_anytime...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -A examples/blocks-world-domain.pddl examples/sussman-anomaly.pddl 2>/dev/null | grep -v '^Time: ' | diff src/testdata/sussman_anomaly_anytime.golden -
+expect_ok ${start}
+
+echo -n sussman_anomaly_parallel...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -p 2 -A examples/blocks-world-domain.pddl examples/sussman-anomaly.pddl 2>/dev/null | grep -v '^Time: ' | tail -n 5 | diff <(tail -n 5 src/testdata/sussman_anomaly_anytime.golden) -
+expect_ok ${start}
+
+echo -n sussman_anomaly_memory_limit...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -M 1 examples/blocks-world-domain.pddl examples/sussman-anomaly.pddl 2>/dev/null | grep -v '^Time: ' | diff src/testdata/sussman_anomaly_lifted.golden -
+expect_ok ${start}
+
+echo -n sussman_anomaly_lazy_refinements...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -L examples/blocks-world-domain.pddl examples/sussman-anomaly.pddl 2>/dev/null | grep -v '^Time: ' | diff src/testdata/sussman_anomaly_lifted.golden -
+expect_ok ${start}
+
+echo -n sussman_anomaly_server...
+start=$(timestamp)
+problem=$(cat examples/sussman-anomaly.pddl)
+{ printf 'solve %d\n%s' ${#problem} "${problem}"; printf 'quit 0\n'; } | HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -R examples/blocks-world-domain.pddl 2>/dev/null | grep -v -E '^(Time: |plan |ok )' | diff src/testdata/sussman_anomaly_lifted.golden -
+expect_ok ${start}
+
+echo -n sussman_anomaly_server_redefined...
+start=$(timestamp)
+redefined=$(sed '1s/(problem /(problem ;redefined\n /' examples/sussman-anomaly.pddl)
+{ for text in "${problem}" "${redefined}" "${problem}" "${redefined}"; do printf 'solve %d\n%s' ${#text} "${text}"; done; printf 'quit 0\n'; } | HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -R examples/blocks-world-domain.pddl 2>/dev/null | grep -v -E '^(Time: |plan |ok )' | diff <(for i in 1 2 3 4; do cat src/testdata/sussman_anomaly_lifted.golden; done) -
+expect_ok ${start}
+
+echo -n logistics_a_ground...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -g -h ADDR -w 5 -f MW-Loc examples/logistics-domain.pddl examples/logistics-a.pddl 2>/dev/null | grep -v '^Time: ' | diff src/testdata/logistics_a_ground.golden -
+expect_ok ${start}
+
+echo -n logistics_a_ground_lazy_refinements...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -L -g -h ADDR -w 5 -f MW-Loc examples/logistics-domain.pddl examples/logistics-a.pddl 2>/dev/null | grep -v '^Time: ' | diff src/testdata/logistics_a_ground.golden -
+expect_ok ${start}
+
+echo -n bw_large_a_ground...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -g -v1 examples/simple-blocks-domain.pddl examples/bw-large-a.pddl 2>&1 | grep -v '^Time: ' | diff src/testdata/bw_large_a_ground.golden -
+expect_ok ${start}
+
+echo -n bw_large_a_spill...
+start=$(timestamp)
+# Ties are broken by LIFO, so spilling plans to disk must not change the
+# plans generated, visited, and found.
+function spill_search() {
+  HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} "$@" -g -h UCPOP/LIFO -x csv examples/simple-blocks-domain.pddl examples/bw-large-a.pddl 2>&1 | grep -v -E '^(Time: |problem,)'
+}
+spilled=$(spill_search -M 1) && unspilled=$(spill_search) && [[ -n $(echo "${spilled}" | awk -F, 'NF > 1 && $19 > 0 && $20 > 0') ]] && diff <(echo "${unspilled}" | cut -d, -f1-3,12-14) <(echo "${spilled}" | cut -d, -f1-3,12-14)
+expect_ok ${start}
+
+echo -n parallel_jobs...
+start=$(timestamp)
+HEAPCHECK=normal VHPOP_FREE_ALL_MEMORY= ${VHPOP} -j 2 -g -h ADDR -w 5 -f MW-Loc examples/logistics-domain.pddl examples/logistics-a.pddl examples/blocks-world-domain.pddl examples/sussman-anomaly.pddl 2>/dev/null | grep -v '^Time: ' | diff <(cat src/testdata/logistics_a_ground.golden src/testdata/sussman_anomaly_ground.golden) -
+expect_ok ${start}
+
+echo -n server_memory_flat...
+start=$(timestamp)
+if [[ -r /proc/self/status ]]; then
+  # Sends a renamed Sussman anomaly to the server, and waits for the reply.
+  function solve_variant() {
+    local text kind size
+    text=$(sed -e "s/sussman-anomaly/sussman-anomaly-${1}/" -e "s/\<\([abc]\)\>/\1${1}/g" examples/sussman-anomaly.pddl)
+    printf 'solve %d\n%s' ${#text} "${text}" >&"${SERVER[1]}"
+    while read -r kind size <&"${SERVER[0]}"; do
+      if [[ ${size} -gt 0 ]]; then
+        read -r -N ${size} text <&"${SERVER[0]}"
+      fi
+      case ${kind} in
+        ok) return 0 ;;
+        error) return 1 ;;
+      esac
+    done
+    return 1
+  }
+  function vm_rss() {
+    awk '/^VmRSS:/ { print $2 }' /proc/${SERVER_PID}/status
+  }
+  coproc SERVER { exec ${VHPOP} -R -g examples/blocks-world-domain.pddl 2>/dev/null; }
+  ok=1
+  for i in $(seq 1 400); do
+    solve_variant ${i} || { ok=0; break; }
+    if [[ ${i} = 50 ]]; then
+      warm=$(vm_rss)
+    fi
+  done
+  [[ ${ok} = 1 ]] && final=$(vm_rss)
+  printf 'quit 0\n' >&"${SERVER[1]}"
+  wait ${SERVER_PID}
+  # Domain, problem, and planning graph of each request are released once the
+  # next one replaces them, so 350 more problems must not grow the process.
+  [[ ${ok} = 1 && $(expr ${final} - ${warm}) -lt 2048 ]]
+fi
+expect_ok ${start}
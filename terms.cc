@@ -19,8 +19,11 @@
 
 #include "terms.h"
 
+#include <mutex>
 #include <typeinfo>
 
+#include "src/threads.h"
+
 Object Term::as_object() const {
   if (object()) {
     return Object(index_);
@@ -48,7 +51,14 @@ std::ostream& operator<<(std::ostream& os, const Term& t) {
 
 std::vector<std::string> TermTable::names_;
 std::vector<Type> TermTable::object_types_;
-std::vector<Type> TermTable::variable_types_;
+std::deque<Type> TermTable::variable_types_;
+
+namespace {
+
+// Mutex protecting the variable types, which can grow while planning.
+std::mutex variable_types_mutex;
+
+}  // namespace
 
 TermTable::~TermTable() {
   for (std::map<Type, const std::vector<Object>*>::const_iterator oi =
@@ -59,14 +69,29 @@ TermTable::~TermTable() {
 }
 
 Variable TermTable::add_variable(const Type& type) {
+  Threads::Lock<std::mutex> lock(variable_types_mutex);
   variable_types_.push_back(type);
   return Variable(-variable_types_.size());
 }
 
+size_t TermTable::num_variables() {
+  Threads::Lock<std::mutex> lock(variable_types_mutex);
+  return variable_types_.size();
+}
+
+void TermTable::release_variables(size_t n) {
+  Threads::Lock<std::mutex> lock(variable_types_mutex);
+  if (n < variable_types_.size()) {
+    variable_types_.erase(variable_types_.begin() + n, variable_types_.end());
+    variable_types_.shrink_to_fit();
+  }
+}
+
 void TermTable::set_type(const Term& term, const Type& type) {
   if (term.object()) {
     object_types_[term.index_] = type;
   } else {
+    Threads::Lock<std::mutex> lock(variable_types_mutex);
     variable_types_[-term.index_ - 1] = type;
   }
 }
@@ -75,6 +100,7 @@ const Type& TermTable::type(const Term& term) {
   if (term.object()) {
     return object_types_[term.index_];
   } else {
+    Threads::Lock<std::mutex> lock(variable_types_mutex);
     return variable_types_[-term.index_ - 1];
   }
 }
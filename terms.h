@@ -22,6 +22,8 @@
 #ifndef TERMS_H_
 #define TERMS_H_
 
+#include <deque>
+#include <functional>
 #include <iostream>
 #include <map>
 #include <string>
@@ -85,6 +87,7 @@ class Term {
   friend bool operator<(const Term& t1, const Term& t2);
   friend std::ostream& operator<<(std::ostream& os, const Term& t);
   friend struct TermTable;
+  friend struct std::hash<Term>;
 };
 
 inline Object::operator Term() const { return Term(index_); }
@@ -107,12 +110,28 @@ inline bool operator<(const Term& t1, const Term& t2) {
 // Output operator for terms.
 std::ostream& operator<<(std::ostream& os, const Term& t);
 
+// Hash function for terms.  Distinct terms have distinct hash values.
+namespace std {
+template <>
+struct hash<Term> {
+  size_t operator()(const Term& t) const { return size_t(t.index_); }
+};
+}  // namespace std
+
 // Term table.
 class TermTable {
  public:
   // Returns a fresh variable with the given type.
   static Variable add_variable(const Type& type);
 
+  // Returns the number of variables added so far.
+  static size_t num_variables();
+
+  // Removes the variables added after the first n variables, so that their
+  // indices are used again by later calls to add_variable.  The removed
+  // variables must no longer be referred to.
+  static void release_variables(size_t n);
+
   // Sets the type of the given term.
   static void set_type(const Term& term, const Type& type);
 
@@ -144,8 +163,9 @@ class TermTable {
   static std::vector<std::string> names_;
   // Object types.
   static std::vector<Type> object_types_;
-  // Variable types.
-  static std::vector<Type> variable_types_;
+  // Variable types.  A deque, so that references returned by type() stay valid
+  // while variables are added.
+  static std::deque<Type> variable_types_;
 
   // Parent term table.
   const TermTable* parent_;
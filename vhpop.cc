@@ -19,19 +19,36 @@
 //
 // Main program.
 
+#include <algorithm>
+#include <atomic>
 #include <cerrno>
 #include <cstdio>
 #include <cstdlib>
+#include <condition_variable>
 #include <cstring>
+#include <exception>
+#include <iomanip>
 #include <limits>
+#include <list>
+#include <map>
+#include <mutex>
+#include <regex>
+#include <sstream>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <thread>
+#include <unistd.h>
 
+#include "bindings.h"
 #include "debug.h"
 #include "domains.h"
 #include "heuristics.h"
 #include "parameters.h"
+#include "planner.h"
 #include "plans.h"
 #include "problems.h"
 
+#include "src/threads.h"
 #include "src/timer.h"
 
 #if HAVE_GETOPT_LONG
@@ -46,43 +63,56 @@ extern int yyparse();
 /* File to parse. */
 extern FILE* yyin;
 
-/* Name of current file. */
-std::string current_file;
 /* Level of warnings. */
-int warning_level;
-/* Verbosity level. */
-int verbosity;
+extern int warning_level;
 
 
 /* Program options. */
 static struct option long_options[] = {
   { "action-cost", required_argument, NULL, 'a' },
+  { "anytime", no_argument, NULL, 'A' },
+  { "detect-duplicates", no_argument, NULL, 'D' },
   { "domain-constraints", optional_argument, NULL, 'd' },
   { "flaw-order", required_argument, NULL, 'f' },
   { "ground-actions", no_argument, NULL, 'g' },
   { "help", no_argument, NULL, 'H' },
   { "heuristic", required_argument, NULL, 'h' },
+  { "jobs", required_argument, NULL, 'j' },
+  { "lazy-refinements", no_argument, NULL, 'L' },
   { "limit", required_argument, NULL, 'l' },
+  { "memory-limit", required_argument, NULL, 'M' },
+  { "parallel", required_argument, NULL, 'p' },
+  { "portfolio", no_argument, NULL, 'P' },
   { "random-open-conditions", no_argument, NULL, 'r' },
   { "search-algorithm", required_argument, NULL, 's' },
   { "seed", required_argument, NULL, 'S' },
+  { "server", optional_argument, NULL, 'R' },
+  { "statistics", required_argument, NULL, 'x' },
   { "time-limit", required_argument, NULL, 'T' },
   { "tolerance", required_argument, NULL, 't' },
+  { "unifier-cache", no_argument, NULL, 'u' },
   { "version", no_argument, NULL, 'V' },
   { "verbose", optional_argument, NULL, 'v' },
   { "warnings", optional_argument, NULL, 'W' },
   { "weight", required_argument, NULL, 'w' },
   { 0, 0, 0, 0 }
 };
-static const char OPTION_STRING[] = "a:d::f:gHh:l:rS:s:T:t:Vv::W::w:";
+static const char OPTION_STRING[] =
+  "Aa:Dd::f:gHh:j:Ll:M:Pp:R::rS:s:T:t:uVv::W::w:x:";
 
 
 /* Displays help. */
 static void display_help() {
   std::cout << "usage: " << PACKAGE << " [options] [file ...]" << std::endl
             << "options:" << std::endl
+            << "  -A,    --anytime\t"
+            << "keep searching for cheaper plans until the time limit"
+            << std::endl
             << "  -a a,  --action-cost=a" << std::endl
             << "\t\t\tuse action cost a" << std::endl
+            << "  -D,    --detect-duplicates" << std::endl
+            << "\t\t\tdiscard plans that have already been generated"
+            << std::endl
             << "  -d[k], --domain-constraints=[k]" << std::endl
             << "\t\t\tuse parameter domain constraints;" << std::endl
             << "\t\t\t  if k is 0, static preconditions are pruned;"
@@ -97,8 +127,26 @@ static void display_help() {
             << "display this help and exit" << std::endl
             << "  -h h,  --heuristic=h\t"
             << "use heuristic h to rank plans" << std::endl
+            << "  -j n,  --jobs=n\t"
+            << "solve up to n problems at the same time" << std::endl
+            << "  -L,    --lazy-refinements" << std::endl
+            << "\t\t\tbuild refinements of a plan when they are dequeued"
+            << std::endl
             << "  -l l,  --limit=l\t"
             << "search no more than l plans" << std::endl
+            << "  -M m,  --memory-limit=m" << std::endl
+            << "\t\t\tspill pending plans to disk when using more than"
+            << std::endl
+            << "\t\t\t  m megabytes of memory" << std::endl
+            << "  -P,    --portfolio\t"
+            << "search with each flaw order in its own thread" << std::endl
+            << "  -p n,  --parallel=n\t"
+            << "search with a single flaw order in n threads" << std::endl
+            << "  -R[p], --server[=p]\t"
+            << "serve planning requests on standard input and output;"
+            << std::endl
+            << "\t\t\t  if p is given, on the Unix domain socket p"
+            << std::endl
             << "  -r,    --random-open-conditions" << std::endl
             << "\t\t\tadd open conditions in random order"
             << std::endl
@@ -113,6 +161,8 @@ static void display_help() {
             << "\t\t\t  time stamps less than t appart are considered"
             << std::endl
             << "\t\t\t  indistinguishable (default is 0.01)" << std::endl
+            << "  -u,    --unifier-cache" << std::endl
+            << "\t\t\tcache unification results" << std::endl
             << "  -v[n], --verbose[=n]\t"
             << "use verbosity level n;" << std::endl
             << "\t\t\t  n is a number from 0 (verbose mode off) and up;"
@@ -128,6 +178,10 @@ static void display_help() {
             << "\t\t\t  2 treats warnings as errors" << std::endl
             << "  -w,    --weight=w\t"
             << "weight to use with heuristic (default is 1)" << std::endl
+            << "  -x f,  --statistics=f\t"
+            << "print statistics for each problem to standard error;"
+            << std::endl
+            << "\t\t\t  f is the format, either json or csv" << std::endl
             << "  file ...\t\t"
             << "files containing domain and problem descriptions;" << std::endl
             << "\t\t\t  if none, descriptions are read from standard input"
@@ -154,22 +208,628 @@ static void display_version() {
 }
 
 
-/* Parses the given file, and returns true on success. */
-static bool read_file(const char* name) {
-  yyin = fopen(name, "r");
-  if (yyin == NULL) {
-    std::cerr << PACKAGE << ':' << name << ": " << strerror(errno)
-              << std::endl;
-    return false;
+/*
+ * Statistics for a problem.
+ */
+struct ProblemStatistics {
+  /* Name of the problem. */
+  std::string problem;
+  /* Outcome of planning: solved, unsolvable, or limit. */
+  std::string outcome;
+  /* Number of steps in the plan, if solved. */
+  size_t num_steps;
+  /* Time spent parsing the input files. */
+  std::chrono::nanoseconds parsing_time;
+  /* Time spent printing the plan. */
+  std::chrono::nanoseconds output_time;
+  /* Total planning time for the problem. */
+  std::chrono::nanoseconds total_time;
+  /* Statistics collected by the planner. */
+  SearchStatistics search;
+};
+
+
+/* Returns the given duration in milliseconds, formatted for output. */
+static std::string millis(std::chrono::nanoseconds d) {
+  std::ostringstream os;
+  os << std::fixed << std::setprecision(3)
+     << std::chrono::duration<double, std::milli>(d).count();
+  return os.str();
+}
+
+
+/* Returns the given string quoted for JSON output. */
+static std::string json_string(const std::string& s) {
+  std::string result = "\"";
+  for (size_t i = 0; i < s.size(); i++) {
+    if (s[i] == '"' || s[i] == '\\') {
+      result += '\\';
+    }
+    result += s[i];
+  }
+  return result + "\"";
+}
+
+
+/* Returns the given string quoted for CSV output if necessary. */
+static std::string csv_string(const std::string& s) {
+  if (s.find_first_of(",\"\n") == std::string::npos) {
+    return s;
+  }
+  std::string result = "\"";
+  for (size_t i = 0; i < s.size(); i++) {
+    if (s[i] == '"') {
+      result += '"';
+    }
+    result += s[i];
+  }
+  return result + "\"";
+}
+
+
+/* Prints statistics for a problem as a line of JSON. */
+static void print_json_statistics(std::ostream& os,
+                                  const std::vector<std::string>& flaw_orders,
+                                  const ProblemStatistics& ps) {
+  const SearchStatistics& ss = ps.search;
+  os << "{\"problem\":" << json_string(ps.problem)
+     << ",\"outcome\":" << json_string(ps.outcome)
+     << ",\"steps\":" << ps.num_steps
+     << ",\"time_ms\":{\"parsing\":" << millis(ps.parsing_time)
+     << ",\"grounding\":" << millis(ss.grounding_time)
+     << ",\"planning_graph\":" << millis(ss.planning_graph_time)
+     << ",\"flaw_selection\":" << millis(ss.flaw_selection_time)
+     << ",\"refinement\":" << millis(ss.refinement_time)
+     << ",\"ranking\":" << millis(ss.ranking_time)
+     << ",\"output\":" << millis(ps.output_time)
+     << ",\"total\":" << millis(ps.total_time) << '}'
+     << ",\"plans_generated\":" << ss.num_generated_plans
+     << ",\"plans_visited\":" << ss.num_visited_plans
+     << ",\"dead_ends\":" << ss.num_dead_ends
+     << ",\"duplicates\":" << ss.num_duplicates
+     << ",\"peak_queue_size\":" << ss.peak_queue_size
+     << ",\"unifier_cache_hits\":" << ss.num_unifier_hits
+     << ",\"unifier_cache_misses\":" << ss.num_unifier_misses
+     << ",\"plans_spilled\":" << ss.num_spilled_plans
+     << ",\"plans_reloaded\":" << ss.num_reloaded_plans
+     << ",\"flaw_orders\":[";
+  for (size_t i = 0; i < ss.flaw_orders.size(); i++) {
+    const FlawOrderStatistics& fs = ss.flaw_orders[i];
+    os << ((i > 0) ? "," : "")
+       << "{\"flaw_order\":" << json_string(flaw_orders[i])
+       << ",\"plans_generated\":" << fs.num_generated_plans
+       << ",\"plans_visited\":" << fs.num_visited_plans
+       << ",\"dead_ends\":" << fs.num_dead_ends
+       << ",\"peak_queue_size\":" << fs.peak_queue_size << '}';
+  }
+  os << "]}" << std::endl;
+}
+
+
+/* Prints the header line for statistics in CSV format. */
+static void print_csv_header(std::ostream& os, size_t num_flaw_orders) {
+  os << "problem,outcome,steps,parsing_ms,grounding_ms,planning_graph_ms,"
+     << "flaw_selection_ms,refinement_ms,ranking_ms,output_ms,total_ms,"
+     << "plans_generated,plans_visited,dead_ends,duplicates,peak_queue_size,"
+     << "unifier_cache_hits,unifier_cache_misses,plans_spilled,"
+     << "plans_reloaded";
+  for (size_t i = 0; i < num_flaw_orders; i++) {
+    os << ",flaw_order_" << i << "_plans_generated"
+       << ",flaw_order_" << i << "_plans_visited"
+       << ",flaw_order_" << i << "_dead_ends"
+       << ",flaw_order_" << i << "_peak_queue_size";
+  }
+  os << std::endl;
+}
+
+
+/* Prints statistics for a problem as a line of CSV. */
+static void print_csv_statistics(std::ostream& os,
+                                 const ProblemStatistics& ps) {
+  const SearchStatistics& ss = ps.search;
+  os << csv_string(ps.problem) << ',' << ps.outcome << ',' << ps.num_steps
+     << ',' << millis(ps.parsing_time)
+     << ',' << millis(ss.grounding_time)
+     << ',' << millis(ss.planning_graph_time)
+     << ',' << millis(ss.flaw_selection_time)
+     << ',' << millis(ss.refinement_time)
+     << ',' << millis(ss.ranking_time)
+     << ',' << millis(ps.output_time)
+     << ',' << millis(ps.total_time)
+     << ',' << ss.num_generated_plans << ',' << ss.num_visited_plans
+     << ',' << ss.num_dead_ends << ',' << ss.num_duplicates
+     << ',' << ss.peak_queue_size
+     << ',' << ss.num_unifier_hits << ',' << ss.num_unifier_misses
+     << ',' << ss.num_spilled_plans << ',' << ss.num_reloaded_plans;
+  for (size_t i = 0; i < ss.flaw_orders.size(); i++) {
+    const FlawOrderStatistics& fs = ss.flaw_orders[i];
+    os << ',' << fs.num_generated_plans << ',' << fs.num_visited_plans
+       << ',' << fs.num_dead_ends << ',' << fs.peak_queue_size;
+  }
+  os << std::endl;
+}
+
+
+/*
+ * Printer of the improved plans of an anytime search, each printed as
+ * soon as it is found and followed by its cost.
+ */
+struct PlanPrinter : public PlanObserver {
+  /* Constructs a plan printer for the given stream. */
+  explicit PlanPrinter(std::ostream& os) : os_(os) {}
+
+  /* Prints the given plan and its cost. */
+  virtual void improved_plan(const Plan& plan, float cost) {
+    os_ << plan << std::endl << ";Cost: " << cost << std::endl;
+  }
+
+private:
+  /* Stream to print plans to. */
+  std::ostream& os_;
+};
+
+
+/* Solves the given problem, using the given planning graph unless it
+   is NULL, prints the plan to the given stream, and fills in the given
+   statistics.  An anytime search prints each improved plan instead. */
+static void solve_problem(const Problem& problem, const Parameters& params,
+                          const PlanningGraph* planning_graph,
+                          bool last_problem, std::ostream& os,
+                          ProblemStatistics& stats) {
+  os << ';' << problem.name() << std::endl;
+  Timer<> timer;
+  stats.problem = problem.name();
+  stats.num_steps = 0;
+  PlanPrinter printer(os);
+  const Plan* plan = Plan::plan(problem, params, planning_graph,
+                                last_problem, stats.search, &printer);
+  Timer<> output_timer;
+  if (plan != NULL) {
+    if (plan->complete()) {
+      if (verbosity > 0) {
+#ifdef DEBUG
+        std::cerr << "Depth of solution: " << plan->depth() << std::endl;
+#endif
+        std::cerr << "Number of steps: " << plan->num_steps() << std::endl;
+      }
+      if (!params.anytime) {
+        os << *plan << std::endl;
+      } else if (stats.search.optimal) {
+        os << ";Plan is optimal." << std::endl;
+      }
+      stats.outcome = "solved";
+      stats.num_steps = plan->num_steps();
+    } else {
+      os << "no plan" << std::endl;
+      os << ";Search limit reached." << std::endl;
+      stats.outcome = "limit";
+    }
   } else {
-    current_file = name;
-    bool success = (yyparse() == 0);
-    fclose(yyin);
-    return success;
+    os << "no plan" << std::endl;
+    os << ";Problem has no solution." << std::endl;
+    stats.outcome = "unsolvable";
+  }
+  stats.output_time = output_timer.ElapsedTime();
+  if (!last_problem) {
+    if (plan != NULL) {
+      delete plan;
+    }
+    Plan::cleanup();
+  }
+  /* Planning time. */
+  const auto elapsed_millis =
+      std::chrono::duration_cast<std::chrono::milliseconds>(
+          timer.ElapsedTime());
+  os << "Time: " << elapsed_millis.count() << std::endl;
+  stats.total_time = timer.ElapsedTime();
+}
+
+
+/* Prints the given statistics in the format selected by the given
+   parameters, if any. */
+static void print_statistics(std::ostream& os, const Parameters& params,
+                             const std::vector<std::string>& flaw_order_names,
+                             const ProblemStatistics& stats) {
+  if (params.statistics_format == Parameters::JSON) {
+    print_json_statistics(os, flaw_order_names, stats);
+  } else if (params.statistics_format == Parameters::CSV) {
+    print_csv_statistics(os, stats);
+  }
+}
+
+
+/* Solves the given problems with up to the given number of threads.
+   The plans and statistics are printed in the order of the problems,
+   each one as soon as it and all problems before it are solved. */
+static void solve_problems(const std::vector<const Problem*>& problems,
+                           const Parameters& params,
+                           const std::vector<std::string>& flaw_order_names,
+                           std::chrono::nanoseconds parsing_time,
+                           size_t num_jobs) {
+  const size_t n = problems.size();
+  std::vector<std::string> plans(n);
+  std::vector<ProblemStatistics> stats(n);
+  std::vector<std::exception_ptr> errors(n);
+  std::vector<bool> solved(n, false);
+  std::mutex mutex;
+  std::condition_variable problem_solved;
+  std::atomic<size_t> next_problem(0);
+  std::atomic<bool> stopped(false);
+  auto solve = [&]() {
+    while (!stopped) {
+      const size_t i = next_problem++;
+      if (i >= n) {
+        break;
+      }
+      std::ostringstream os;
+      stats[i].parsing_time = parsing_time;
+      try {
+        solve_problem(*problems[i], params, NULL, false, os, stats[i]);
+      } catch (...) {
+        /* Release the planner state of this thread, so that the
+           variables of the problem are released for the other jobs. */
+        Plan::cleanup();
+        errors[i] = std::current_exception();
+      }
+      std::lock_guard<std::mutex> lock(mutex);
+      plans[i] = os.str();
+      solved[i] = true;
+      problem_solved.notify_one();
+    }
+  };
+  /* Shared state is synchronized while the threads run. */
+  Threads::Scope threads_scope;
+  std::vector<std::thread> threads;
+  for (size_t j = 0; j < std::min(num_jobs, n); j++) {
+    threads.push_back(std::thread(solve));
+  }
+  std::exception_ptr error;
+  for (size_t i = 0; i < n && !error; i++) {
+    {
+      std::unique_lock<std::mutex> lock(mutex);
+      problem_solved.wait(lock, [&]() { return bool(solved[i]); });
+    }
+    std::cout << plans[i] << std::flush;
+    if (errors[i]) {
+      error = errors[i];
+      stopped = true;
+    } else {
+      print_statistics(std::cerr, params, flaw_order_names, stats[i]);
+    }
+  }
+  for (std::vector<std::thread>::iterator ti = threads.begin();
+       ti != threads.end(); ti++) {
+    (*ti).join();
+  }
+  if (error) {
+    std::rethrow_exception(error);
   }
 }
 
 
+/*
+ * Cache of problems and their planning graphs, keyed by the text
+ * defining each problem.  The least recently used problem is deleted
+ * when the cache is full.
+ */
+struct PlanningGraphCache {
+  /* Constructs an empty cache holding at most the given number of
+     problems. */
+  explicit PlanningGraphCache(size_t capacity) : capacity_(capacity) {}
+
+  /* Deletes this cache and the problems in it. */
+  ~PlanningGraphCache() {
+    clear();
+  }
+
+  /* Returns the problem defined by the given text, and sets the given
+     planning graph to its planning graph, or returns NULL if the
+     problem is not in the cache. */
+  const Problem* find(const std::string& text,
+                      const PlanningGraph*& planning_graph) {
+    for (std::list<Entry>::iterator ei = entries_.begin();
+         ei != entries_.end(); ei++) {
+      if ((*ei).text == text) {
+        entries_.splice(entries_.begin(), entries_, ei);
+        planning_graph = entries_.front().planning_graph;
+        return entries_.front().problem;
+      }
+    }
+    return NULL;
+  }
+
+  /* Adds the given problem, defined by the given text, with the given
+     planning graph to this cache. */
+  void insert(const std::string& text, const Problem& problem,
+              const PlanningGraph* planning_graph) {
+    entries_.push_front({ text, problem.name(), &problem, planning_graph });
+    while (entries_.size() > capacity_) {
+      erase(--entries_.end());
+    }
+  }
+
+  /* Forgets the problems in this cache that have been deleted, which
+     happens when a problem with the same name is parsed. */
+  void forget_replaced() {
+    std::list<Entry>::iterator ei = entries_.begin();
+    while (ei != entries_.end()) {
+      if (Problem::find((*ei).name) != (*ei).problem) {
+        delete (*ei).planning_graph;
+        ei = entries_.erase(ei);
+      } else {
+        ei++;
+      }
+    }
+  }
+
+  /* Deletes all problems in this cache. */
+  void clear() {
+    while (!entries_.empty()) {
+      erase(entries_.begin());
+    }
+  }
+
+private:
+  /* A cached problem. */
+  struct Entry {
+    /* Text defining the problem. */
+    std::string text;
+    /* Name of the problem. */
+    std::string name;
+    /* The problem. */
+    const Problem* problem;
+    /* Planning graph for the problem, or NULL if none is needed. */
+    const PlanningGraph* planning_graph;
+  };
+
+  /* Cached problems, most recently used first. */
+  std::list<Entry> entries_;
+  /* Largest number of cached problems. */
+  size_t capacity_;
+
+  /* Deletes the given entry and its problem.  The planning graph
+     refers to the problem, so it is deleted first. */
+  void erase(std::list<Entry>::iterator ei) {
+    delete (*ei).planning_graph;
+    delete (*ei).problem;
+    entries_.erase(ei);
+  }
+};
+
+
+/*
+ * A planner serving requests.  Domains stay in memory between
+ * requests, and the planning graphs of recently solved problems are
+ * cached.
+ *
+ * Each request is a line holding a command and the length of the text
+ * that follows the line.  The commands are:
+ *
+ *   domain n   parse the n bytes of PDDL that follow, keeping the
+ *              domains; all problems are forgotten
+ *   solve n    solve the problem defined by the n bytes of PDDL that
+ *              follow
+ *   quit 0     stop serving
+ *
+ * Each response is a sequence of frames in the same format.  A solve
+ * request is answered by a `plan' frame with the output of the batch
+ * planner, followed by a `stats' frame if statistics were requested.
+ * Every response ends with an `ok' frame, or an `error' frame holding
+ * an error message.
+ */
+struct PlannerServer {
+  /* Number of problems whose planning graphs are cached. */
+  static const size_t CACHE_SIZE = 16;
+
+  /* Constructs a server planning with the given parameters. */
+  PlannerServer(const Parameters& params,
+                const std::vector<std::string>& flaw_order_names)
+    : params_(params), flaw_order_names_(flaw_order_names),
+      cache_(CACHE_SIZE) {}
+
+  /* Serves requests on the Unix domain socket with the given path, or
+     on standard input and output if the path is NULL, until a quit
+     request is received or the input ends.  Returns false if the
+     socket cannot be used. */
+  bool run(const char* path) {
+    if (path == NULL) {
+      serve(stdin, stdout);
+      return true;
+    }
+    int sock = socket(AF_UNIX, SOCK_STREAM, 0);
+    sockaddr_un address;
+    memset(&address, 0, sizeof address);
+    address.sun_family = AF_UNIX;
+    strncpy(address.sun_path, path, sizeof address.sun_path - 1);
+    unlink(path);
+    if (sock < 0
+        || bind(sock, reinterpret_cast<sockaddr*>(&address),
+                sizeof address) != 0
+        || listen(sock, 1) != 0) {
+      std::cerr << PACKAGE ":" << path << ": " << strerror(errno)
+                << std::endl;
+      if (sock >= 0) {
+        close(sock);
+      }
+      return false;
+    }
+    bool quit = false;
+    while (!quit) {
+      int conn = accept(sock, NULL, NULL);
+      if (conn < 0) {
+        if (errno == EINTR) {
+          continue;
+        }
+        std::cerr << PACKAGE ":" << path << ": " << strerror(errno)
+                  << std::endl;
+        break;
+      }
+      FILE* in = fdopen(conn, "r");
+      FILE* out = fdopen(dup(conn), "w");
+      quit = !serve(in, out);
+      fclose(in);
+      fclose(out);
+    }
+    close(sock);
+    unlink(path);
+    return quit;
+  }
+
+private:
+  /* Planning parameters. */
+  const Parameters& params_;
+  /* Names of the flaw selection orders, for statistics. */
+  const std::vector<std::string>& flaw_order_names_;
+  /* Recently solved problems and their planning graphs. */
+  PlanningGraphCache cache_;
+
+  /* Serves requests from the given input until a quit request is
+     received or the input ends; returns false on a quit request. */
+  bool serve(FILE* in, FILE* out) {
+    std::string command, text;
+    while (read_request(in, command, text)) {
+      try {
+        if (command == "domain") {
+          load_domains(text, out);
+        } else if (command == "solve") {
+          solve(text, out);
+        } else if (command == "quit") {
+          write_frame(out, "ok", "");
+          return false;
+        } else {
+          write_frame(out, "error", "unknown command `" + command + "'");
+        }
+      } catch (const std::exception& e) {
+        Plan::cleanup();
+        write_frame(out, "error", e.what());
+      }
+    }
+    return true;
+  }
+
+  /* Reads a request from the given input, and returns false at the
+     end of the input. */
+  static bool read_request(FILE* in, std::string& command,
+                           std::string& text) {
+    std::string header;
+    int c;
+    while ((c = getc(in)) != EOF && c != '\n') {
+      header += char(c);
+    }
+    if (c == EOF) {
+      return false;
+    }
+    std::istringstream is(header);
+    size_t length;
+    if (!(is >> command >> length)) {
+      return false;
+    }
+    text.resize(length);
+    return (length == 0 || fread(&text[0], 1, length, in) == length);
+  }
+
+  /* Writes a frame of the given kind with the given text. */
+  static void write_frame(FILE* out, const std::string& kind,
+                          const std::string& text) {
+    fprintf(out, "%s %lu\n", kind.c_str(), (unsigned long) text.size());
+    fwrite(text.data(), 1, text.size(), out);
+    fflush(out);
+  }
+
+  /* Returns the given PDDL text without comments. */
+  static std::string strip_comments(const std::string& text) {
+    std::string stripped;
+    bool comment = false;
+    for (size_t i = 0; i < text.size(); i++) {
+      if (text[i] == ';') {
+        comment = true;
+      } else if (text[i] == '\n') {
+        comment = false;
+      }
+      if (!comment) {
+        stripped += text[i];
+      }
+    }
+    return stripped;
+  }
+
+  /* Parses the domains defined by the given text. */
+  void load_domains(const std::string& text, FILE* out) {
+    /* Problems may refer to domains that are about to be redefined. */
+    cache_.clear();
+    Problem::clear();
+    bool success = Planner::parse_text(text, "<request>");
+    Problem::clear();
+    if (success) {
+      write_frame(out, "ok", "");
+    } else {
+      write_frame(out, "error", "cannot parse domain");
+    }
+  }
+
+  /* Solves the problem defined by the given text. */
+  void solve(const std::string& text, FILE* out) {
+    Timer<> parsing_timer;
+    ProblemStatistics stats;
+    const PlanningGraph* planning_graph = NULL;
+    const Problem* problem = cache_.find(text, planning_graph);
+    if (problem == NULL) {
+      static const std::regex domain_def("\\(\\s*define\\s*\\(\\s*domain\\b",
+                                         std::regex::icase);
+      if (std::regex_search(strip_comments(text), domain_def)) {
+        write_frame(out, "error", "solve request defines a domain");
+        return;
+      }
+      std::map<std::string, const Problem*> old_problems(Problem::begin(),
+                                                         Problem::end());
+      bool success = Planner::parse_text(text, "<request>");
+      /* A problem with the same name as a cached problem replaces the
+         cached problem when parsed. */
+      cache_.forget_replaced();
+      std::vector<const Problem*> new_problems;
+      for (Problem::ProblemMap::const_iterator pi = Problem::begin();
+           pi != Problem::end(); pi++) {
+        std::map<std::string, const Problem*>::const_iterator oi =
+          old_problems.find((*pi).first);
+        if (oi == old_problems.end() || (*oi).second != (*pi).second) {
+          new_problems.push_back((*pi).second);
+        }
+      }
+      if (!success || new_problems.size() != 1) {
+        for (size_t i = 0; i < new_problems.size(); i++) {
+          delete new_problems[i];
+        }
+        write_frame(out, "error",
+                    success ? "solve request must define one problem"
+                    : "cannot parse problem");
+        return;
+      }
+      problem = new_problems[0];
+      stats.parsing_time = parsing_timer.ElapsedTime();
+      planning_graph =
+        Plan::make_planning_graph(*problem, params_, stats.search);
+      cache_.insert(text, *problem, planning_graph);
+    } else {
+      stats.parsing_time = parsing_timer.ElapsedTime();
+    }
+    std::ostringstream plan;
+    solve_problem(*problem, params_, planning_graph, false, plan, stats);
+    write_frame(out, "plan", plan.str());
+    std::ostringstream statistics;
+    if (params_.statistics_format == Parameters::JSON) {
+      print_json_statistics(statistics, flaw_order_names_, stats);
+    } else if (params_.statistics_format == Parameters::CSV) {
+      print_csv_header(statistics, params_.flaw_orders.size());
+      print_csv_statistics(statistics, stats);
+    }
+    if (!statistics.str().empty()) {
+      write_frame(out, "stats", statistics.str());
+    }
+    write_frame(out, "ok", "");
+  }
+};
+
+
 /* Cleanup function. */
 static void cleanup() {
   Problem::clear();
@@ -184,8 +844,17 @@ int main(int argc, char* argv[]) {
   const bool free_all_memory = getenv("VHPOP_FREE_ALL_MEMORY");
   /* Default planning parameters. */
   Parameters params;
+  /* Names of the flaw selection orders, for statistics. */
+  std::vector<std::string> flaw_order_names(1, "UCPOP");
   bool no_flaw_order = true;
   bool no_search_limit = true;
+  /* Whether to serve planning requests. */
+  bool server = false;
+  /* Unix domain socket to serve requests on, or NULL for standard
+     input and output. */
+  const char* server_socket = NULL;
+  /* Number of problems to solve at the same time. */
+  size_t num_jobs = 1;
   /* Set default verbosity. */
   verbosity = 0;
   /* Set default warning level. */
@@ -205,6 +874,9 @@ int main(int argc, char* argv[]) {
       break;
     }
     switch (c) {
+    case 'A':
+      params.anytime = true;
+      break;
     case 'a':
       try {
         params.set_action_cost(optarg);
@@ -215,6 +887,9 @@ int main(int argc, char* argv[]) {
         return -1;
       }
       break;
+    case 'D':
+      params.detect_duplicates = true;
+      break;
     case 'd':
       params.domain_constraints = true;
       params.keep_static_preconditions = (optarg == NULL || atoi(optarg) != 0);
@@ -223,9 +898,11 @@ int main(int argc, char* argv[]) {
       try {
         if (no_flaw_order) {
           params.flaw_orders.clear();
+          flaw_order_names.clear();
           no_flaw_order = false;
         }
         params.flaw_orders.push_back(FlawSelectionOrder(optarg));
+        flaw_order_names.push_back(optarg);
       } catch (const InvalidFlawSelectionOrder& e) {
         std::cerr << PACKAGE << ": " << e.what() << std::endl
              << "Try `" << PACKAGE << " --help' for more information."
@@ -249,6 +926,12 @@ int main(int argc, char* argv[]) {
         return -1;
       }
       break;
+    case 'j':
+      num_jobs = std::max(1, atoi(optarg));
+      break;
+    case 'L':
+      params.lazy_refinements = true;
+      break;
     case 'l':
       if (no_search_limit) {
         params.search_limits.clear();
@@ -260,6 +943,19 @@ int main(int argc, char* argv[]) {
         params.search_limits.push_back(atoi(optarg));
       }
       break;
+    case 'M':
+      params.memory_limit = atoi(optarg);
+      break;
+    case 'P':
+      params.portfolio = true;
+      break;
+    case 'p':
+      params.search_threads = std::max(1, atoi(optarg));
+      break;
+    case 'R':
+      server = true;
+      server_socket = optarg;
+      break;
     case 'r':
       params.random_open_conditions = true;
       break;
@@ -277,7 +973,9 @@ int main(int argc, char* argv[]) {
       }
       break;
     case 'T':
-      params.time_limit = std::chrono::minutes(atoi(optarg));
+      params.time_limit =
+        std::chrono::duration_cast<std::chrono::nanoseconds>(
+            std::chrono::duration<double, std::ratio<60> >(atof(optarg)));
       break;
     case 't':
       if (optarg == std::string("unlimited")) {
@@ -286,6 +984,9 @@ int main(int argc, char* argv[]) {
         Orderings::threshold = atof(optarg);
       }
       break;
+    case 'u':
+      Bindings::cache_unifiers = true;
+      break;
     case 'V':
       display_version();
       return 0;
@@ -298,6 +999,16 @@ int main(int argc, char* argv[]) {
     case 'w':
       params.weight = atof(optarg);
       break;
+    case 'x':
+      try {
+        params.set_statistics_format(optarg);
+      } catch (const InvalidStatisticsFormat& e) {
+        std::cerr << PACKAGE ": " << e.what() << std::endl
+                  << "Try `" PACKAGE " --help' for more information."
+                  << std::endl;
+        return -1;
+      }
+      break;
     case ':':
     default:
       std::cerr << "Try `" PACKAGE " --help' for more information."
@@ -305,25 +1016,53 @@ int main(int argc, char* argv[]) {
       return -1;
     }
   }
-  for (size_t i = 0;
-       i < params.flaw_orders.size() - params.search_limits.size(); i++) {
+  while (params.search_limits.size() < params.flaw_orders.size()) {
     params.search_limits.push_back(params.search_limits.back());
   }
+  if (params.spill_plans() && params.random_open_conditions) {
+    /* Spilled plans are rebuilt from their refinements, which needs
+       the same order of open conditions. */
+    std::cerr << PACKAGE ": -M cannot be used with -r" << std::endl;
+    return -1;
+  }
+  if (params.spill_plans() && params.lazy_refinements) {
+    /* A spilled plan would lose the refinements already built. */
+    std::cerr << PACKAGE ": -M cannot be used with -L" << std::endl;
+    return -1;
+  }
+  if (params.search_threads > 1 && !params.parallel_search()
+      && warning_level > 0) {
+    std::cerr << PACKAGE ": -p has no effect with ";
+    if (params.flaw_orders.size() > 1) {
+      std::cerr << "several flaw selection strategies";
+    } else if (params.search_algorithm == Parameters::IDA_STAR) {
+      std::cerr << "IDA*";
+    } else if (params.lazy_refinements) {
+      std::cerr << "lazy refinements";
+    } else {
+      std::cerr << "a memory limit";
+    }
+    std::cerr << std::endl;
+    if (warning_level > 1) {
+      return -1;
+    }
+  }
 
   try {
     /*
      * Read pddl files.
      */
+    Timer<> parsing_timer;
     if (optind < argc) {
       /*
        * Use remaining command line arguments as file names.
        */
       while (optind < argc) {
-        if (!read_file(argv[optind++])) {
+        if (!Planner::parse_file(argv[optind++])) {
           return -1;
         }
       }
-    } else {
+    } else if (!server) {
       /*
        * No remaining command line argument, so read from standard input.
        */
@@ -333,6 +1072,8 @@ int main(int argc, char* argv[]) {
       }
     }
 
+    const auto parsing_time = parsing_timer.ElapsedTime();
+
     if (verbosity > 1) {
       /*
        * Display domains and problems.
@@ -353,46 +1094,41 @@ int main(int argc, char* argv[]) {
     }
 
     std::cerr.setf(std::ios::unitbuf);
+    if (server) {
+      /*
+       * Keep the domains, and serve requests for problems.
+       */
+      Problem::clear();
+      PlannerServer planner_server(params, flaw_order_names);
+      return planner_server.run(server_socket) ? 0 : -1;
+    }
+    if (params.statistics_format == Parameters::CSV) {
+      print_csv_header(std::cerr, params.flaw_orders.size());
+    }
 
     /*
      * Solve the problems.
      */
-    for (Problem::ProblemMap::const_iterator pi = Problem::begin();
-         pi != Problem::end(); ) {
-      const Problem& problem = *(*pi).second;
-      pi++;
-      std::cout << ';' << problem.name() << std::endl;
-      Timer<> timer;
-      const Plan* plan =
-          Plan::plan(problem, params, !free_all_memory && pi == Problem::end());
-      if (plan != NULL) {
-        if (plan->complete()) {
-          if (verbosity > 0) {
-#ifdef DEBUG
-            std::cerr << "Depth of solution: " << plan->depth() << std::endl;
-#endif
-            std::cerr << "Number of steps: " << plan->num_steps() << std::endl;
-          }
-          std::cout << *plan << std::endl;
-        } else {
-          std::cout << "no plan" << std::endl;
-          std::cout << ";Search limit reached." << std::endl;
-        }
-      } else {
-        std::cout << "no plan" << std::endl;
-        std::cout << ";Problem has no solution." << std::endl;
+    if (num_jobs > 1) {
+      std::vector<const Problem*> problems;
+      for (Problem::ProblemMap::const_iterator pi = Problem::begin();
+           pi != Problem::end(); pi++) {
+        problems.push_back((*pi).second);
       }
-      if (free_all_memory || pi != Problem::end()) {
-        if (plan != NULL) {
-          delete plan;
-        }
-        Plan::cleanup();
+      solve_problems(problems, params, flaw_order_names, parsing_time,
+                     num_jobs);
+    } else {
+      for (Problem::ProblemMap::const_iterator pi = Problem::begin();
+           pi != Problem::end(); ) {
+        const Problem& problem = *(*pi).second;
+        pi++;
+        ProblemStatistics stats;
+        stats.parsing_time = parsing_time;
+        solve_problem(problem, params, NULL,
+                      !free_all_memory && pi == Problem::end(), std::cout,
+                      stats);
+        print_statistics(std::cerr, params, flaw_order_names, stats);
       }
-      /* Planning time. */
-      const auto elapsed_millis =
-          std::chrono::duration_cast<std::chrono::milliseconds>(
-              timer.ElapsedTime());
-      std::cout << "Time: " << elapsed_millis.count() << std::endl;
     }
   } catch (const std::exception& e) {
     std::cerr << PACKAGE ": " << e.what() << std::endl;